@@ -2,10 +2,17 @@
 # TODO: replace all assert calls with a proper exception throw
 
 import argparse
+import cProfile
+import json
 import nanoproject
-import subprocess
+import passes
+import time
+import tracemalloc
+import watch
 import os
 
+from buildstats import format_report, format_pass_totals
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         prog='nanolang',
@@ -13,17 +20,57 @@ if __name__ == '__main__':
     )
     parser.add_argument('projectdir', help="The Nanolang project directory.")
     parser.add_argument('-o', metavar='output', dest='out', help="The directory to compile the Goboscript project to. Defaults to {projectdir}/.gs")
-    parser.add_argument('--sb3', metavar='path', dest='sb3', help="Call goboscript to create an sb3 file at the given path.")
+    parser.add_argument('--sb3', metavar='path', dest='sb3', help="Create an sb3 file at the given path, see --sb3-backend.")
+    parser.add_argument('--sb3-backend', dest='sb3_backend', choices=nanoproject.SB3_BACKENDS, default='goboscript', help="How to build the sb3 file: by calling goboscript, or natively without it. Defaults to goboscript.")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="Recompile every sprite instead of reusing unchanged ones from the build cache.")
+    parser.add_argument('--watch', action='store_true', help="Keep running and rebuild whenever a source file or asset changes.")
+    parser.add_argument('--timings', nargs='?', const='text', choices=['text', 'json'], help="Report time and memory used by each phase and each file, as text or json.")
+    parser.add_argument('--profile', metavar='path', dest='profile', help="Write cProfile stats for the whole compile to the given path. With -j, sprites compiled by worker processes are not included.")
+    parser.add_argument('-O', dest='opt_level', type=int, choices=passes.OPT_LEVELS, default=0, help="Optimization level of the generated code. Defaults to 0 (no optimization).")
+    parser.add_argument('-j', metavar='N', dest='jobs', type=int, default=1, help="Compile sprites in N parallel processes. Defaults to 1.")
 
     args = parser.parse_args()
     
     gs_out = os.path.join(args.projectdir, '.gs') if args.out == None else args.out
-    nanoproject.compile(args.projectdir, gs_out)
+
+    if args.watch:
+        watch.watch(args.projectdir, gs_out, args.sb3, args.sb3_backend, jobs=args.jobs, use_cache=args.cache, opt_level=args.opt_level)
+        exit()
+
+    if args.timings:
+        tracemalloc.start()
+    
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    summary = nanoproject.compile(args.projectdir, gs_out, jobs=args.jobs, use_cache=args.cache, detailed=args.timings != None, opt_level=args.opt_level)
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    if args.timings:
+        tracemalloc.stop()
+
+    if args.timings != 'json':
+        print(f"compiled {summary['files']} files ({summary['cached']} cached), {summary['files_written']} rewritten")
+        if args.opt_level > 0:
+            print(format_pass_totals(summary['optimized']))
 
     if args.sb3:
-        proc = subprocess.run(['goboscript', 'build', '-i', gs_out, '-o', args.sb3])
-        if proc.returncode != 0:
-            print("errors occured when compiling goboscript project")
+        start = time.perf_counter()
+        nanoproject.build_sb3(gs_out, args.sb3, args.sb3_backend, summary['programs'])
+        summary['timings'][args.sb3_backend] = time.perf_counter() - start
+
+    if args.timings == 'json':
+        print(json.dumps({
+            'timings': summary['timings'],
+            'passes': summary['passes'],
+            'files': summary['file_stats']
+        }, indent=2))
+    elif args.timings:
+        print(format_report(summary))
 
     # tokens = TokenQueue(parse_tokens('src.nano'))
     # program = parse_program(tokens)
@@ -4,10 +4,40 @@ from compilertypes import ValueType
 from builtin_methods import BUILTIN_METHODS
 import os
     
+# maps every visible local variable/parameter name to a stack of bindings,
+# the innermost one on top. each scope remembers the names it bound,
+# so they can be popped off again when the scope ends.
+class SymbolTable:
+    def __init__(self):
+        self.bindings = {}
+        self.scopes = []
+    
+    def push_scope(self):
+        self.scopes.append([])
+    
+    def pop_scope(self):
+        bindings = self.bindings
+        for name in self.scopes.pop():
+            stack = bindings[name]
+            stack.pop()
+            if not stack:
+                del bindings[name]
+    
+    def declare(self, name, info):
+        stack = self.bindings.get(name)
+        if stack == None:
+            self.bindings[name] = [info]
+        else:
+            stack.append(info)
+        
+        self.scopes[-1].append(name)
+    
+    def lookup(self, name):
+        stack = self.bindings.get(name)
+        return None if stack == None else stack[-1]
+
 class Block:
     def __init__(self, parent=None):
-        self.variables = {}
-        self.parameters = {}
         self.parent = parent
         self.statements = []
 
@@ -15,35 +45,43 @@ class Block:
         self.func_references = set()
         self.return_type = None
         self.top_level = False
+        self.function = None # function whose body this is, None in event handlers
 
         if parent:
+            self.symbols = parent.symbols
             self.static_variables = parent.static_variables
             self.return_type = parent.return_type
             self.func_references = parent.func_references
+            self.function = parent.function
+        else:
+            self.symbols = SymbolTable()
+        
+        self.symbols.push_scope()
+    
+    # called once the block has been parsed, to take its variables out of scope
+    def end_scope(self):
+        self.symbols.pop_scope()
     
     def declare_variable(self, var_name, var_type, metadata=None):
-        self.variables[var_name] = {
+        self.symbols.declare(var_name, {
             'name': var_name,
             'type': var_type,
             'metadata': metadata
-        }
+        })
     
     def declare_parameter(self, var_name, var_type, metadata=None):
-        self.parameters[var_name] = {
+        self.symbols.declare(var_name, {
             'name': var_name,
             'type': var_type,
             'metadata': metadata
-        }
+        })
     
+    # locals and parameters shadow sprite/stage variables
     def get_variable_info(self, var_name):
-        if var_name in self.variables:
-            return self.variables[var_name]
-        elif var_name in self.parameters:
-            return self.parameters[var_name]
-        elif var_name in self.static_variables:
-            return self.static_variables[var_name]
-        else:
-            return None if self.parent == None else self.parent.get_variable_info(var_name)
+        info = self.symbols.lookup(var_name)
+        if info == None:
+            return self.static_variables.get(var_name)
+        return info
 
 class ExpressionNode:
     def __init__(self):
@@ -165,8 +203,9 @@ class UnaryOperator(ExpressionNode):
                 return not v
 
 class IdentifierOperator(ExpressionNode):
-    def __init__(self, op, type, id, data=None):
+    def __init__(self, op, type, id, data=None, token=None):
         super().__init__()
+        self.token = token
         self.op = op
         self.type = type
         self.id = id
@@ -189,8 +228,10 @@ class Function:
         self.definition = None
         self.attributes = attribs
         self.func_references = set()
+        self.self_calls = [] # tokens of the calls the function makes to itself
+        self.tail_calls = [] # statements of the ones in tail position
 
-ATTRIBUTES = ['warp']
+ATTRIBUTES = ['warp', 'inline', 'noinline', 'tailcall']
 HAT_EVENTS = {
     'flag': None,
     'keypressed': 'string',
@@ -202,12 +243,6 @@ HAT_EVENTS = {
     'cloned': None
 }
 
-COMPARISON_SYMBOLS = ['<', '>', '<=', '>=']
-COMPARISON_SYMBOL_NAMES = ['op_lt', 'op_gt', 'op_lte', 'op_gte']
-
-ARITHMETIC_SYMBOLS = ['+', '-', '*', '/']
-ARITHMETIC_SYMBOLS_NAMES = ['op_add', 'op_sub', 'op_mul', 'op_div']
-
 ASSIGNMENT_SYMBOLS = ['=', '+=', '-=']
 
 # returns either an op_cast expression or the expression itself,
@@ -270,6 +305,8 @@ def parse_function_call(program, tokens, block, id_token):
         raise CompilationException.from_token(id_token, f"not enough function arguments for '{func_name}'")
     
     block.func_references.add(func_name)
+    if block.function is func_data:
+        func_data.self_calls.append(id_token)
     
     return {
         'function': func_data,
@@ -277,248 +314,212 @@ def parse_function_call(program, tokens, block, id_token):
         'args': func_args
     }
 
-def parse_expression(program, tokens, block, order=0):
-    # order 0: or
-    # order 1: and
-    # order 2: == !=
-    # order 3: < > <= >=
-    # order 4: & (string concatenation)
-    # order 5: + -
-    # order 6: * / %
-    # order 7: not - (unary)
-    # last order: func call, array subscript, struct member access, parentheses, raw values
-
-    next_order = order+1
-
-    if order == 0:
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.is_symbol('||'):
-            tokens.pop()
-            b = parse_expression(program, tokens, block, next_order)
+# binary operator builders.
+# each one type checks the operands and returns the resulting expression node.
 
-            a = type_cast(program, op_tok, a, ValueType(ValueType.BOOL))
-            b = type_cast(program, op_tok, b, ValueType(ValueType.BOOL))
-            a = BinaryOperator('op_bor', ValueType(ValueType.BOOL), a, b)
-            op_tok = tokens.peek()
-        return a
-    
-    elif order == 1:
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.is_symbol('&&'):
-            tokens.pop()
-            b = parse_expression(program, tokens, block, next_order)
+def binop_logic(program, op_tok, op_name, a, b):
+    a = type_cast(program, op_tok, a, ValueType(ValueType.BOOL))
+    b = type_cast(program, op_tok, b, ValueType(ValueType.BOOL))
+    return BinaryOperator(op_name, ValueType(ValueType.BOOL), a, b)
 
-            a = type_cast(program, op_tok, a, ValueType(ValueType.BOOL))
-            b = type_cast(program, op_tok, b, ValueType(ValueType.BOOL))
-            a = BinaryOperator('op_band', ValueType(ValueType.BOOL), a, b)
-            op_tok = tokens.peek()
-        return a
-    
-    elif order == 2:
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.is_symbol('==') or op_tok.is_symbol('!='):
-            tokens.pop()
-            b = parse_expression(program, tokens, block, next_order)
-            b = type_cast(program, op_tok, b, a.type)
+def binop_compare(program, op_tok, op_name, a, b):
+    b = type_cast(program, op_tok, b, a.type)
+    return BinaryOperator(op_name, ValueType(ValueType.BOOL), a, b)
 
-            a = BinaryOperator('op_eq' if op_tok.value == '==' else 'op_neq', ValueType(ValueType.BOOL), a, b)
-            op_tok = tokens.peek()
-        return a
+def binop_join(program, op_tok, op_name, a, b):
+    if not (a.type.can_cast_implicit(ValueType.STRING) and b.type.can_cast_implicit(ValueType.STRING)):
+        raise CompilationException.from_token(op_tok, "attempt to concatenate " + str(a.type) + " with " + str(b.type))
     
-    elif order == 3: # comparison symbols
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.type == Token.TYPE_SYMBOL and op_tok.value in COMPARISON_SYMBOLS:
-            tokens.pop()
-            b = parse_expression(program, tokens, block, next_order)
-            b = type_cast(program, op_tok, b, a.type)
+    a = type_cast(program, op_tok, a, ValueType(ValueType.STRING))
+    b = type_cast(program, op_tok, b, ValueType(ValueType.STRING))
+    return BinaryOperator(op_name, ValueType(ValueType.STRING), a, b)
+
+def binop_add(program, op_tok, op_name, a, b):
+    out_ptr = a.type.is_pointer()
+    if not ((out_ptr or a.type.is_a(ValueType.NUMBER)) and b.type.is_a(ValueType.NUMBER)):
+        raise CompilationException.from_token(op_tok, "attempt to add " + str(a.type) + " with " + str(b.type))
+    
+    return BinaryOperator(op_name, a.type, a, b)
+
+def binop_multiply(program, op_tok, op_name, a, b):
+    if not (a.type.is_a(ValueType.NUMBER) and b.type.is_a(ValueType.NUMBER)):
+        raise CompilationException.from_token(op_tok, "attempt to multiply " + str(a.type) + " with " + str(b.type))
+
+    return BinaryOperator(op_name, ValueType(ValueType.NUMBER), a, b)
+
+# symbol -> (order, opcode, builder)
+# higher orders bind tighter. all binary operators are left-associative.
+#   order 0: or
+#   order 1: and
+#   order 2: == !=
+#   order 3: < > <= >=
+#   order 4: & (string concatenation)
+#   order 5: + -
+#   order 6: * /
+# unary operators (not, negation, address-of, indirection) bind tighter than all of them.
+BINARY_OPERATORS = {
+    '||': (0, 'op_bor', binop_logic),
+    '&&': (1, 'op_band', binop_logic),
+    '==': (2, 'op_eq', binop_compare),
+    '!=': (2, 'op_neq', binop_compare),
+    '<': (3, 'op_lt', binop_compare),
+    '>': (3, 'op_gt', binop_compare),
+    '<=': (3, 'op_lte', binop_compare),
+    '>=': (3, 'op_gte', binop_compare),
+    '&': (4, 'op_join', binop_join),
+    '+': (5, 'op_add', binop_add),
+    '-': (5, 'op_sub', binop_add),
+    '*': (6, 'op_mul', binop_multiply),
+    '/': (6, 'op_div', binop_multiply),
+}
 
-            op_name = COMPARISON_SYMBOL_NAMES[COMPARISON_SYMBOLS.index(op_tok.value)]
-            a = BinaryOperator(op_name, ValueType(ValueType.BOOL), a, b)
-            op_tok = tokens.peek()
-        return a
+# precedence climbing: parses a unary expression, then folds in every following
+# binary operator whose order is at least the given one.
+def parse_expression(program, tokens, block, order=0):
+    a = parse_unary_expression(program, tokens, block)
 
-    elif order == 4: # &
-        a = parse_expression(program, tokens, block, next_order)
+    while True:
         op_tok = tokens.peek()
-        while op_tok.is_symbol('&'):
-            tokens.pop()
-            b = parse_expression(program, tokens, block, next_order)
-
-            if not (a.type.can_cast_implicit(ValueType.STRING) and b.type.can_cast_implicit(ValueType.STRING)):
-                raise CompilationException.from_token(op_tok, "attempt to concatenate " + str(a.type) + " with " + str(b.type))
-            
-            a = type_cast(program, op_tok, a, ValueType(ValueType.STRING))
-            b = type_cast(program, op_tok, b, ValueType(ValueType.STRING))
-            a = BinaryOperator('op_join', ValueType(ValueType.STRING), a, b)
-            op_tok = tokens.peek()
+        if op_tok.type != Token.TYPE_SYMBOL:
+            return a
         
-        return a
-
-    elif order == 5: # + -
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.is_symbol('+') or op_tok.is_symbol('-'):
-            op_name = ARITHMETIC_SYMBOLS_NAMES[ARITHMETIC_SYMBOLS.index(tokens.pop().value)]
-            b = parse_expression(program, tokens, block, next_order)
-
-            out_ptr = a.type.is_pointer()
-            if not ((out_ptr or a.type.is_a(ValueType.NUMBER)) and b.type.is_a(ValueType.NUMBER)):
-                raise CompilationException.from_token(op_tok, "attempt to add " + str(a.type) + " with " + str(b.type))
-            
-            a = BinaryOperator(op_name, a.type, a, b)
-            op_tok = tokens.peek()
+        op = BINARY_OPERATORS.get(op_tok.value)
+        if op == None or op[0] < order:
+            return a
         
-        return a
-    
-    elif order == 6: # * /
-        a = parse_expression(program, tokens, block, next_order)
-        op_tok = tokens.peek()
-        while op_tok.is_symbol('*') or op_tok.is_symbol('/'):
-            op_name = ARITHMETIC_SYMBOLS_NAMES[ARITHMETIC_SYMBOLS.index(tokens.pop().value)]
-            b = parse_expression(program, tokens, block, next_order)
-            
-            if not (a.type.is_a(ValueType.NUMBER) and b.type.is_a(ValueType.NUMBER)):
-                raise CompilationException.from_token(op_tok, "attempt to multiply " + str(a.type) + " with " + str(b.type))
+        tokens.pop()
+        b = parse_expression(program, tokens, block, op[0] + 1)
+        a = op[2](program, op_tok, op[1], a, b)
 
-            a = BinaryOperator(op_name, ValueType(ValueType.NUMBER), a, b)
-            op_tok = tokens.peek()
-        
-        return a
-    
-    # assume that this is the last order - parentheses or raw values
-    else:
-        tok = tokens.peek()
+# unary operators, func call, array subscript, struct member access, parentheses, raw values
+def parse_unary_expression(program, tokens, block):
+    tok = tokens.peek()
 
-        # parenthesis
-        if tok.is_symbol('('):
-            tokens.pop()
-            expr = parse_expression(program, tokens, block, 0)
-            assert(tokens.pop().is_symbol(')'))
-            return expr
-        
-        # unary negation
-        elif tok.is_symbol('-'):
-            tokens.pop()
-            expr = parse_expression(program, tokens, block, order)
-            return UnaryOperator('op_neg', expr.type, expr)
+    # parenthesis
+    if tok.is_symbol('('):
+        tokens.pop()
+        expr = parse_expression(program, tokens, block, 0)
+        assert(tokens.pop().is_symbol(')'))
+        return expr
+    
+    # unary negation
+    elif tok.is_symbol('-'):
+        tokens.pop()
+        expr = parse_unary_expression(program, tokens, block)
+        return UnaryOperator('op_neg', expr.type, expr)
 
-        # binary not
-        elif tok.is_symbol('!'):
-            tokens.pop()
-            expr = parse_expression(program, tokens, block, order)
-            return UnaryOperator('op_bnot', ValueType(ValueType.BOOL), expr)
+    # binary not
+    elif tok.is_symbol('!'):
+        tokens.pop()
+        expr = parse_unary_expression(program, tokens, block)
+        return UnaryOperator('op_bnot', ValueType(ValueType.BOOL), expr)
 
-        # address of
-        elif tok.is_symbol('&'):
-            tokens.pop()
-            expr = parse_expression(program, tokens, block, order)
-            if not expr.can_address:
-                raise CompilationException.from_token(tok, "can only take address of lvalue")
-            
-            if expr.op == 'var_get':
-                var_info = block.get_variable_info(expr.id)
-                var_info['metadata']['needs_ref'] = True
-            
-            return UnaryOperator('op_addr', ValueType.pointer_to(expr.type), expr)
+    # address of
+    elif tok.is_symbol('&'):
+        tokens.pop()
+        expr = parse_unary_expression(program, tokens, block)
+        if not expr.can_address:
+            raise CompilationException.from_token(tok, "can only take address of lvalue")
         
-        # indirect
-        elif tok.is_symbol('*'):
-            tokens.pop()
-            expr = parse_expression(program, tokens, block, order)
-            if not expr.type.is_pointer():
-                raise CompilationException.from_token(tok, "attempt to use indirection on a non-pointer type")
-            
-            out = UnaryOperator('op_indirect', expr.type.base_type, expr)
-            out.can_address = True
-            return out
+        if expr.op == 'var_get':
+            var_info = block.get_variable_info(expr.id)
+            var_info['metadata']['needs_ref'] = True
         
-        # type cast
-        elif tok.type == Token.TYPE_KEYWORD and tok.value in Token.KEYWORD_TYPES:
-            output_type = parse_type(program, tokens)
-
-            # get expression inbetween parentheses
-            if not tokens.pop().is_symbol('('):
-                raise CompilationException.from_token(tok, 'expected (')
-            expr = parse_expression(program, tokens, block, 0)
-            if not tokens.pop().is_symbol(')'):
-                raise CompilationException.from_token(tok, 'expected )')
-
-            return type_cast(program, tok, expr, output_type)
+        return UnaryOperator('op_addr', ValueType.pointer_to(expr.type), expr)
+    
+    # indirect
+    elif tok.is_symbol('*'):
+        tokens.pop()
+        expr = parse_unary_expression(program, tokens, block)
+        if not expr.type.is_pointer():
+            raise CompilationException.from_token(tok, "attempt to use indirection on a non-pointer type")
         
-        elif tok.type == Token.TYPE_IDENTIFIER:
-            tokens.pop()
+        out = UnaryOperator('op_indirect', expr.type.base_type, expr)
+        out.can_address = True
+        return out
+    
+    # type cast
+    elif tok.type == Token.TYPE_KEYWORD and tok.value in Token.KEYWORD_TYPES:
+        output_type = parse_type(program, tokens)
+
+        # get expression inbetween parentheses
+        if not tokens.pop().is_symbol('('):
+            raise CompilationException.from_token(tok, 'expected (')
+        expr = parse_expression(program, tokens, block, 0)
+        if not tokens.pop().is_symbol(')'):
+            raise CompilationException.from_token(tok, 'expected )')
+
+        return type_cast(program, tok, expr, output_type)
+    
+    elif tok.type == Token.TYPE_IDENTIFIER:
+        tokens.pop()
 
-            id_op = tokens.peek()
-            var_info = block.get_variable_info(tok.value)
+        id_op = tokens.peek()
+        var_info = block.get_variable_info(tok.value)
 
-            if id_op.is_symbol('('):
-                # here, a function is required
-                if var_info != None:
-                    raise CompilationException.from_token(id_op, "attempt to perform a function call on a variable")
-                
-                func_call_data = parse_function_call(program, tokens, block, tok)
-                func_data = func_call_data['function']
-                func_args = func_call_data['args']
+        if id_op.is_symbol('('):
+            # here, a function is required
+            if var_info != None:
+                raise CompilationException.from_token(id_op, "attempt to perform a function call on a variable")
+            
+            func_call_data = parse_function_call(program, tokens, block, tok)
+            func_data = func_call_data['function']
+            func_args = func_call_data['args']
 
-                if func_data.type.is_a(ValueType.VOID):
-                    raise CompilationException.from_token(tok, f"function '{tok.value}' does not return a value")
+            if func_data.type.is_a(ValueType.VOID):
+                raise CompilationException.from_token(tok, f"function '{tok.value}' does not return a value")
 
-                if func_call_data['builtin']:
-                    return IdentifierOperator('builtin_func_call', func_data.type, tok.value, func_args)
-                else:
-                    return IdentifierOperator('func_call', func_data.type, tok.value, func_args)
+            if func_call_data['builtin']:
+                return IdentifierOperator('builtin_func_call', func_data.type, tok.value, func_args)
             else:
-                # here, a variable is required
-                if var_info == None:
-                    raise CompilationException.from_token(tok, f"use of undeclared identifier '{(tok.value)}'")
-                
-                # TODO: multi-indexing
-                if id_op.is_symbol('['):
-                    tokens.pop()
+                return IdentifierOperator('func_call', func_data.type, tok.value, func_args, tok)
+        else:
+            # here, a variable is required
+            if var_info == None:
+                raise CompilationException.from_token(tok, f"use of undeclared identifier '{(tok.value)}'")
+            
+            # TODO: multi-indexing
+            if id_op.is_symbol('['):
+                tokens.pop()
 
-                    if not var_info['type'].is_pointer() or var_info['type'].base_type.is_a(ValueType.VOID):
-                        raise CompilationException.from_token(tok, "cannot take index of a " + str(var_info['type']))
-                    
-                    index_expr = parse_expression(program, tokens, block)
+                if not var_info['type'].is_pointer() or var_info['type'].base_type.is_a(ValueType.VOID):
+                    raise CompilationException.from_token(tok, "cannot take index of a " + str(var_info['type']))
+                
+                index_expr = parse_expression(program, tokens, block)
 
-                    if not index_expr.type.can_cast_implicit(ValueType.NUMBER):
-                        raise CompilationException.from_token(id_op, "expected number for index, got a " + str(index_expr.type))
+                if not index_expr.type.can_cast_implicit(ValueType.NUMBER):
+                    raise CompilationException.from_token(id_op, "expected number for index, got a " + str(index_expr.type))
 
-                    if not tokens.peek().is_symbol(']'):
-                        raise CompilationException.from_token(tok, "expected ']', got " + str(tokens.peek()))
-                    tokens.pop()
+                if not tokens.peek().is_symbol(']'):
+                    raise CompilationException.from_token(tok, "expected ']', got " + str(tokens.peek()))
+                tokens.pop()
 
-                    return IdentifierOperator('op_index', var_info['type'].base_type, tok.value, index_expr);
-                    # raise Exception("arrays not yet supported")
-            
-                # TODO: structs
-                elif id_op.is_symbol('.'):
-                    raise Exception("struct indexing not yet supported")
+                return IdentifierOperator('op_index', var_info['type'].base_type, tok.value, index_expr);
+                # raise Exception("arrays not yet supported")
+        
+            # TODO: structs
+            elif id_op.is_symbol('.'):
+                raise Exception("struct indexing not yet supported")
 
-                elif id_op.is_symbol('->'):
-                    raise Exception("pointer indirection not yet supported")
+            elif id_op.is_symbol('->'):
+                raise Exception("pointer indirection not yet supported")
 
-                else:
-                    return IdentifierOperator('var_get', var_info['type'], var_info['name'])
-        
-        # true and false
-        elif tok.is_keyword('true') or tok.is_keyword('false'):
-            tokens.pop()
-            return ExpressionConstant(tok)    
-        
-        # strings and numbers
-        elif tok.type == Token.TYPE_STRING or tok.type == Token.TYPE_NUMBER:
-            tokens.pop()
-            return ExpressionConstant(tok)
-        
-        else:
-            raise CompilationException.from_token(tok, 'unexpected ' + str(tok))
+            else:
+                return IdentifierOperator('var_get', var_info['type'], var_info['name'])
+    
+    # true and false
+    elif tok.is_keyword('true') or tok.is_keyword('false'):
+        tokens.pop()
+        return ExpressionConstant(tok)    
+    
+    # strings and numbers
+    elif tok.type == Token.TYPE_STRING or tok.type == Token.TYPE_NUMBER:
+        tokens.pop()
+        return ExpressionConstant(tok)
     
-    raise Exception('parse_expression: unreachable code')
+    else:
+        raise CompilationException.from_token(tok, 'unexpected ' + str(tok))
+
 
 def parse_type(program, tokens, allow_void=False):
     tok = tokens.pop()
@@ -567,7 +568,6 @@ def parse_if_branch(program, tokens, block):
 
     tok = tokens.peek()
     cond_expr = type_cast(program, tok, parse_expression(program, tokens, block), ValueType(ValueType.BOOL))
-    print("EXPR: " + str(cond_expr))
     if_branch = parse_branch(program, tokens, block, True)
     else_branch = None
 
@@ -668,13 +668,15 @@ def parse_statement(program, tokens, block):
 
             statement = {
                 'type': 'return',
-                'value': return_expr
+                'value': return_expr,
+                'tail_call': False
             }
         
         else:
             statement = {
                 'type': 'return',
-                'value': None
+                'value': None,
+                'tail_call': False
             }
         
         return statement
@@ -691,7 +693,8 @@ def parse_statement(program, tokens, block):
         # the statement structure, for later optimization
         # by the scratchblocks generator
         var_metadata = {
-            'needs_ref': False 
+            'needs_ref': False,
+            'assigned': False
         }
 
         # two valid forms: one with a specified type and one without
@@ -724,7 +727,6 @@ def parse_statement(program, tokens, block):
                 'init': expr,
                 'metadata': var_metadata
             }
-            print("EXPR: " + str(expr))
         
         # variable declaration without initial assignment
         else:
@@ -797,15 +799,23 @@ def parse_statement(program, tokens, block):
             return {
                 'type': 'builtin_func_call' if func_call_data['builtin'] else 'func_call',
                 'func_name': func_call_data['function'].name,
-                'args': func_call_data['args']
+                'args': func_call_data['args'],
+                'token': tok,
+                'tail_call': False
             }
 
         # variable assignment
         else:
+            assignment = parse_assignment(program, tokens, block, tok, var_info['type'])
+
+            # assigning through an index doesn't change the variable itself
+            if assignment['type'] != 'index':
+                var_info['metadata']['assigned'] = True
+
             return {
                 'type': 'var_assign',
                 'var_name': var_name,
-                'assignment': parse_assignment(program, tokens, block, tok, var_info['type'])
+                'assignment': assignment
             }
             
     
@@ -832,7 +842,8 @@ def parse_block(program, tokens, parent_block=None, if_block=False):
                 if not does_return:
                     block.statements.append({
                         'type': 'return',
-                        'value': None
+                        'value': None,
+                        'tail_call': False
                     })
 
             break
@@ -846,18 +857,75 @@ def parse_block(program, tokens, parent_block=None, if_block=False):
             if statement['type'] == 'return' or statement['type'] == 'forever' or statement['type'] == 'deleteclone':
                 does_return = True
 
+    block.end_scope()
     return block
 
+# statements after which nothing else in a function runs. a return doesn't
+# leave the function, so that's only the last statement, and the last ones of
+# the branches of an if that is last
+def tail_statements(statements):
+    if not statements:
+        return []
+
+    last = statements[-1]
+    tail = [last]
+    if last['type'] == 'if':
+        for branch in (last['branch'], last['else_branch']):
+            if branch == None:
+                continue
+            tail.extend(tail_statements([branch['branch']] if branch['single'] else branch['branch'].statements))
+
+    return tail
+
+# calls a function makes to itself in tail position, returning their value or
+# as the last statement of a void function. irgen turns them into a jump back
+# to the start of the function that reuses its stack frame
+def find_tail_calls(function):
+    tail_calls = []
+
+    for statement in tail_statements(function.definition.statements):
+        if statement['type'] == 'return':
+            value = statement['value']
+            if value != None and value.op == 'func_call' and value.id == function.name:
+                tail_calls.append((statement, value.token))
+
+        elif statement['type'] == 'func_call' and statement['func_name'] == function.name and function.type.is_void():
+            tail_calls.append((statement, statement['token']))
+
+    return tail_calls
+
 def parse_function(program, tokens, function):
     func_block = Block()
     func_block.return_type = function.type
     func_block.top_level = True
+    func_block.function = function
 
     for param in function.parameters:
-        func_block.declare_parameter(param['name'], param['type'])
+        func_block.declare_parameter(param['name'], param['type'], param['metadata'])
     
     function.definition = parse_block(program, tokens, func_block)
     function.func_references = func_block.func_references
+    func_block.end_scope()
+
+    tail_calls = find_tail_calls(function)
+    tail_tokens = set(id(tok) for _, tok in tail_calls)
+
+    if 'tailcall' in function.attributes:
+        if not function.self_calls:
+            raise CompilationException.from_token(function.idtok, f"function '{function.name}' has the tailcall attribute but never calls itself")
+
+        for tok in function.self_calls:
+            if not id(tok) in tail_tokens:
+                raise CompilationException.from_token(tok, f"call to '{function.name}' is not in tail position")
+
+    function.tail_calls = [statement for statement, _ in tail_calls]
+    for statement in function.tail_calls:
+        statement['tail_call'] = True
+
+    # a tail call sets every parameter to a new value
+    if function.tail_calls:
+        for param in function.parameters:
+            param['metadata']['assigned'] = True
 
 def parse_program(tokens, project_dir_path, stage=None):
     program = {}
@@ -943,7 +1011,7 @@ def parse_program(tokens, project_dir_path, stage=None):
                 'name': var_name,
                 'type': var_type,
                 'init': var_init,
-                'metadata': { 'needs_ref': var_type.size() != 1 }
+                'metadata': { 'needs_ref': var_type.size() != 1, 'assigned': False }
             }
             program['static_order'].append(var_name)
         
@@ -977,7 +1045,8 @@ def parse_program(tokens, project_dir_path, stage=None):
 
                     func_params.append({
                         'name': param_name,
-                        'type': param_type
+                        'type': param_type,
+                        'metadata': { 'needs_ref': False, 'assigned': False }
                     })
 
                     # read either a closing parenthesis or a comma
@@ -1019,6 +1088,12 @@ def parse_program(tokens, project_dir_path, stage=None):
             event_name = tok.get_identifier()
             if not event_name in HAT_EVENTS:
                 raise CompilationException.from_token(tok, f"invalid event '{event_name}'")
+
+            if 'inline' in attributes or 'noinline' in attributes:
+                raise CompilationException.from_token(tok, "event handlers can't be inlined")
+
+            if 'tailcall' in attributes:
+                raise CompilationException.from_token(tok, "event handlers can't make tail calls")
             
             event_param_type = HAT_EVENTS[event_name]
             event_param = None
@@ -1045,13 +1120,16 @@ def parse_program(tokens, project_dir_path, stage=None):
             
             parent_block = Block(toplevel_block)
             parent_block.return_type = ValueType(ValueType.VOID)
+            parent_block.func_references = set()
 
             program['events'].append({
                 'event_name': event_name,
                 'event_param': event_param,
                 'definition': parse_block(program, tokens, parent_block),
-                'attributes': attributes[:]
+                'attributes': attributes[:],
+                'func_references': parent_block.func_references
             })
+            parent_block.end_scope()
             attributes.clear()
         
         elif tok.is_symbol('@'):
@@ -1064,6 +1142,9 @@ def parse_program(tokens, project_dir_path, stage=None):
             if attr_name in attributes:
                 raise CompilationException.from_token(tok, "same attribute defined more than once")
 
+            if (attr_name == 'inline' and 'noinline' in attributes) or (attr_name == 'noinline' and 'inline' in attributes):
+                raise CompilationException.from_token(tok, "a function can't be both inline and noinline")
+
             attributes.append(attr_name)
         
         else:
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# times generate_program on a large generated sprite.
+# the source is parsed once, and only code generation is timed.
+#
+# usage: python benchmarks/bench_codegen.py [functions] [repeats]
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lexer import tokenize, TokenQueue
+from astgen import parse_program
+from gbgen import generate_program
+from synth import make_source
+
+def main():
+    parser = argparse.ArgumentParser(description="Time code generation for a large generated sprite")
+    parser.add_argument('functions', type=int, nargs='?', default=2000, help="Functions in the sprite. Defaults to 2000.")
+    parser.add_argument('repeats', type=int, nargs='?', default=5, help="Runs; the best time is kept. Defaults to 5.")
+    args = parser.parse_args()
+
+    num_functions = args.functions
+    repeats = args.repeats
+
+    stage = parse_program(TokenQueue(tokenize('costume "blank.svg"\n')), '.')
+    sprite = parse_program(TokenQueue(tokenize(make_source(num_functions))), '.', stage)
+
+    stage_ctx = generate_program(stage, io.StringIO())
+
+    best = None
+    for _ in range(repeats):
+        out = io.StringIO()
+        start = time.perf_counter()
+        generate_program(sprite, out, stage_ctx)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    
+    lines = out.getvalue().count('\n')
+    print(f"{num_functions} functions, {lines} lines emitted")
+    print(f"generate_program: {best:.3f}s (best of {repeats}), {lines / best:.0f} lines/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# compiler benchmark suite. generates synthetic projects of a few sizes and
+# times lexing (parse_tokens), parse_program, generate_program and a full
+# nanoproject.compile on each. every phase is run several times and the best
+# time is kept.
+#
+# results can be saved as json and compared against an earlier run; the
+# comparison fails if a phase got slower by more than the threshold.
+#
+# usage: python benchmarks/bench_compiler.py [--config small,medium] [--repeats N]
+#                                            [--output results.json] [--compare baseline.json]
+#                                            [--threshold 0.25]
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nanoproject
+from lexer import parse_tokens, TokenQueue
+from astgen import parse_program
+from gbgen import generate_program
+from synth import make_project
+
+CONFIGS = {
+    'small': {'sprites': 2, 'functions': 20, 'statements': 8, 'depth': 3, 'statics': 4},
+    'medium': {'sprites': 4, 'functions': 80, 'statements': 10, 'depth': 3, 'statics': 8},
+    'large': {'sprites': 8, 'functions': 200, 'statements': 12, 'depth': 4, 'statics': 16},
+}
+
+SEED = 0
+
+# like timeit, garbage is collected before every run and the collector is
+# off while it runs, so a collection triggered by an earlier run's garbage
+# isn't timed. the previous run's result is dropped before the next run, so
+# that it doesn't get collected during it either
+def best_of(repeats, fn):
+    best = None
+    result = None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        best = elapsed if best == None else min(best, elapsed)
+    return best, result
+
+def git_commit():
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+def run_config(params, repeats):
+    with tempfile.TemporaryDirectory() as tmp:
+        project_dir = os.path.join(tmp, 'project')
+        output_dir = os.path.join(tmp, 'out')
+        make_project(project_dir, seed=SEED, **params)
+
+        stage_path = os.path.join(project_dir, 'stage.nano')
+        sprite_paths = sorted(
+            os.path.join(project_dir, filename) for filename in os.listdir(project_dir)
+            if filename.endswith('.nano') and filename != 'stage.nano'
+        )
+
+        stage = parse_program(TokenQueue(parse_tokens(stage_path)), '.')
+        stage_gen = generate_program(stage, io.StringIO())
+
+        # each phase gets the output of the previous one, prepared up front
+        lex_time, token_lists = best_of(repeats, lambda: [parse_tokens(path) for path in sprite_paths])
+        parse_time, programs = best_of(repeats, lambda: [parse_program(TokenQueue(tokens), '.', stage) for tokens in token_lists])
+
+        def codegen():
+            outputs = []
+            for program in programs:
+                out = io.StringIO()
+                generate_program(program, out, stage_gen)
+                outputs.append(out.getvalue())
+            return outputs
+
+        codegen_time, outputs = best_of(repeats, codegen)
+        compile_time, _ = best_of(repeats, lambda: nanoproject.compile(project_dir, output_dir, use_cache=False))
+
+        tokens = sum(len(token_list) for token_list in token_lists)
+        lines = sum(output.count('\n') for output in outputs)
+
+    return {
+        'params': params,
+        'tokens': tokens,
+        'lines': lines,
+        'phases': {
+            'lex': {'seconds': lex_time, 'tokens_per_second': tokens / lex_time},
+            'parse': {'seconds': parse_time, 'tokens_per_second': tokens / parse_time},
+            'codegen': {'seconds': codegen_time, 'lines_per_second': lines / codegen_time},
+            'compile': {'seconds': compile_time, 'lines_per_second': lines / compile_time},
+        }
+    }
+
+def print_results(results):
+    print(f"{'config':>8} {'phase':>8} {'time':>10} {'throughput':>22}")
+    for name, result in results.items():
+        for phase_name, phase in result['phases'].items():
+            if 'tokens_per_second' in phase:
+                throughput = f"{phase['tokens_per_second']:.0f} tokens/s"
+            else:
+                throughput = f"{phase['lines_per_second']:.0f} lines/s"
+            print(f"{name:>8} {phase_name:>8} {phase['seconds'] * 1000:>8.1f}ms {throughput:>22}")
+
+# prints the change of every phase against a baseline run.
+# returns False if any phase got slower by more than threshold
+def compare(results, baseline, threshold):
+    ok = True
+
+    print(f"\n{'config':>8} {'phase':>8} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+
+        old = baseline['results'][name]
+        if old['params'] != result['params'] or old['tokens'] != result['tokens']:
+            print(f"{name:>8}: input differs from the baseline, not comparable")
+            continue
+
+        for phase_name, phase in result['phases'].items():
+            if phase_name not in old['phases']:
+                continue
+
+            before = old['phases'][phase_name]['seconds']
+            after = phase['seconds']
+            change = after / before - 1
+            regressed = change > threshold
+            ok = ok and not regressed
+
+            print(f"{name:>8} {phase_name:>8} {before * 1000:>8.1f}ms {after * 1000:>8.1f}ms {change * 100:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Nanolang compiler benchmark suite")
+    parser.add_argument('--config', default='small,medium', help="Comma separated configurations to run: " + ", ".join(CONFIGS))
+    parser.add_argument('--repeats', type=int, default=10, help="Runs per phase; the best time is kept.")
+    parser.add_argument('--output', help="Save results as json to this path.")
+    parser.add_argument('--compare', help="Compare against results saved by an earlier run.")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Slowdown that counts as a regression. Defaults to 0.25 (25%%).")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.config.split(','):
+        if name not in CONFIGS:
+            parser.error(f"unknown configuration {name}")
+        results[name] = run_config(CONFIGS[name], args.repeats)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': git_commit(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'repeats': args.repeats,
+                    'seed': SEED,
+                },
+                'results': results
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# compares the peak memory of parsing a large generated .nano file
+# with the list-based token path against the streaming token path.
+#
+# usage: python benchmarks/bench_memory.py [functions]
+
+import argparse
+import os
+import sys
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synth import make_source
+
+# runs in a child process, so that the peak RSS only covers one path
+def measure(mode, path):
+    import resource
+    import time
+    from lexer import parse_tokens, stream_tokens, TokenQueue
+    from astgen import parse_program
+
+    start = time.perf_counter()
+
+    if mode == 'list':
+        tokens = TokenQueue(parse_tokens(path))
+    else:
+        tokens = TokenQueue(stream_tokens(path))
+    
+    parse_program(tokens, '.')
+    elapsed = time.perf_counter() - start
+
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the peak memory of the list-based and streaming token paths")
+    parser.add_argument('functions', type=int, nargs='?', default=5000, help="Functions in the generated file. Defaults to 5000.")
+    # used by the child processes
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    num_functions = args.functions
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.nano')
+        with open(path, 'w') as f:
+            f.write(make_source(num_functions))
+
+        print(f"source: {os.path.getsize(path) / 1024:.0f} KiB, {num_functions} functions")
+
+        for mode in ['list', 'stream']:
+            out = subprocess.run(
+                [sys.executable, __file__, '--measure', mode, path],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+
+            # ru_maxrss is in kilobytes on linux
+            print(f"{mode:>8}: peak rss {int(out[0]) / 1024:8.1f} MiB, {float(out[1]):6.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# parser micro-benchmark. parses a few expression shapes in isolation and reports
+# the number of python function calls and the time spent per expression,
+# as well as the deepest parenthesis nesting that parses under the default
+# recursion limit.
+#
+# usage: python benchmarks/bench_parser.py [iterations]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lexer import tokenize, TokenQueue
+from astgen import Block, parse_expression
+from compilertypes import ValueType
+
+EXPRESSIONS = {
+    'literal': '1',
+    'variable': 'a',
+    'arithmetic': 'a + b * 2 - (a / 3)',
+    'comparison': 'a < b && b != 3 || !(a == 1)',
+    'join': '"x" & a & "y" & b',
+    'nested': '((((a + 1) * 2) - 3) / 4)',
+}
+
+def make_block():
+    block = Block()
+    block.declare_variable('a', ValueType(ValueType.NUMBER), { 'needs_ref': False })
+    block.declare_variable('b', ValueType(ValueType.NUMBER), { 'needs_ref': False })
+    return block
+
+def parse(source, block):
+    program = { 'functions': {} }
+    return parse_expression(program, TokenQueue(tokenize(source)), block)
+
+def count_calls(source, block):
+    calls = 0
+
+    def profile(frame, event, arg):
+        nonlocal calls
+        if event == 'call':
+            calls += 1
+    
+    tokens = TokenQueue(tokenize(source))
+    program = { 'functions': {} }
+
+    sys.setprofile(profile)
+    parse_expression(program, tokens, block)
+    sys.setprofile(None)
+
+    return calls
+
+def max_nesting(block):
+    low, high = 1, 10000
+
+    while low < high:
+        depth = (low + high + 1) // 2
+        try:
+            parse('(' * depth + '1' + ')' * depth, block)
+            low = depth
+        except RecursionError:
+            high = depth - 1
+    
+    return low
+
+def main():
+    parser = argparse.ArgumentParser(description="Parser micro-benchmark")
+    parser.add_argument('iterations', type=int, nargs='?', default=2000, help="Times each expression is parsed. Defaults to 2000.")
+    args = parser.parse_args()
+
+    iterations = args.iterations
+    block = make_block()
+
+    print(f"{'expression':>12} {'calls':>7} {'us/expr':>9}")
+    for name, source in EXPRESSIONS.items():
+        calls = count_calls(source, block)
+
+        # lex up front so that only the parser is timed
+        token_lists = [tokenize(source) for _ in range(iterations)]
+        program = { 'functions': {} }
+
+        start = time.perf_counter()
+        for tokens in token_lists:
+            parse_expression(program, TokenQueue(tokens), block)
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:>12} {calls:>7} {elapsed / iterations * 1e6:>9.1f}")
+    
+    print(f"max parenthesis nesting: {max_nesting(block)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# generates synthetic .nano projects for benchmarking.
+# the output only depends on the parameters and the seed, so runs made
+# from the same parameters can be compared with each other.
+#
+# usage: python benchmarks/synth.py <dir> [sprites] [functions] [statements] [depth] [statics] [seed]
+
+import argparse
+import os
+import random
+
+COMPARISONS = ['<', '>', '==', '!=', '<=', '>=']
+ARITHMETIC = ['+', '-', '*', '/']
+
+# a chain of functions that each call the one before, with a fixed shape.
+# used by the benchmarks that measure a single large sprite
+def make_source(num_functions):
+    lines = ['costume "../alien-in-suit.png"', '']
+
+    for i in range(num_functions):
+        lines.append(f"func f{i}(a: number, b: number): number")
+        lines.append(f"    var x = (a + {i}) * (b - 2) / 3")
+        lines.append(f"    var s = \"value \" & x & \" of f{i}\"")
+        if i > 0:
+            lines.append(f"    x = f{i - 1}(x, a) + f{i - 1}(a, 1) * 2")
+            lines.append(f"    say_wait(\"x\" & ask(s) & f{i - 1}(b, x), 1)")
+        lines.append(f"    if x > {i} && a != b")
+        lines.append(f"        x += a * b - (x + 1)")
+        lines.append(f"    elseif x == 0 || !(a < b)")
+        lines.append(f"        x -= 1")
+        lines.append(f"    end")
+        lines.append(f"    repeat 3")
+        lines.append(f"        say(s)")
+        lines.append(f"    end")
+        lines.append(f"    return x + a + b")
+        lines.append(f"end")
+        lines.append('')
+
+    return '\n'.join(lines) + '\n'
+
+class SpriteGenerator:
+    def __init__(self, rng, index, statements, depth):
+        self.rng = rng
+        self.index = index
+        self.statements = statements
+        self.depth = depth
+        self.functions = [] # (name, return type) of functions generated so far
+        self.lines = []
+
+    def expression(self, depth, names):
+        rng = self.rng
+
+        if depth <= 0 or rng.random() < 0.3:
+            if names and rng.random() < 0.5:
+                return rng.choice(names)
+            return str(rng.randint(0, 99))
+
+        a = self.expression(depth - 1, names)
+        b = self.expression(depth - 1, names)
+        op = rng.choice(ARITHMETIC)
+
+        if rng.random() < 0.3:
+            return f"({a} {op} {b})"
+        return f"{a} {op} {b}"
+
+    def condition(self, names):
+        return f"{self.expression(2, names)} {self.rng.choice(COMPARISONS)} {self.expression(2, names)}"
+
+    def block(self, count, indent, names):
+        rng = self.rng
+        names = list(names)
+        pad = '    ' * indent
+        depth = self.depth
+
+        for k in range(count):
+            c = rng.random()
+
+            if c < 0.25:
+                name = f"v{indent}_{k}"
+                self.lines.append(f"{pad}var {name} = {self.expression(depth, names)}")
+                names.append(name)
+
+            elif c < 0.4 and len(names) > 2:
+                self.lines.append(f"{pad}{rng.choice(names)} {rng.choice(['=', '+=', '-='])} {self.expression(depth, names)}")
+
+            elif c < 0.5 and indent < 3:
+                self.lines.append(f"{pad}if {self.condition(names)}")
+                self.block(2, indent + 1, names)
+                self.lines.append(f"{pad}elseif {self.condition(names)}")
+                self.block(1, indent + 1, names)
+                self.lines.append(f"{pad}else")
+                self.block(1, indent + 1, names)
+                self.lines.append(f"{pad}end")
+
+            elif c < 0.55 and indent < 3:
+                self.lines.append(f"{pad}repeat {self.expression(1, names)}")
+                self.block(2, indent + 1, names)
+                self.lines.append(f"{pad}end")
+
+            elif c < 0.6 and indent < 3:
+                self.lines.append(f"{pad}while {self.condition(names)}")
+                self.block(2, indent + 1, names)
+                self.lines.append(f"{pad}end")
+
+            elif c < 0.7 and self.functions:
+                func_name, return_type = rng.choice(self.functions)
+                args = f"{self.expression(1, names)}, {self.expression(1, names)}"
+
+                if return_type == 'number':
+                    name = f"c{indent}_{k}"
+                    self.lines.append(f"{pad}var {name} = {func_name}({args}) + 1")
+                    names.append(name)
+                elif return_type == 'void':
+                    self.lines.append(f"{pad}{func_name}({args})")
+                else:
+                    self.lines.append(f"{pad}say({func_name}({args}) & \"!\")")
+
+            elif c < 0.75:
+                name = f"p{indent}_{k}"
+                self.lines.append(f"{pad}var {name} = number*(malloc(4))")
+                self.lines.append(f"{pad}{name}[1] = {self.expression(1, names)}")
+                self.lines.append(f"{pad}say(\"v: \" & {name}[1])")
+                self.lines.append(f"{pad}free(void*({name}))")
+
+            elif c < 0.8:
+                self.lines.append(f"{pad}say_wait(\"x\\n\" & {self.expression(depth, names)}, 0.1) # comment")
+
+            else:
+                self.lines.append(f"{pad}goto_xy({self.expression(depth, names)}, {self.expression(depth, names)})")
+
+    def function(self, number):
+        name = f"f{self.index}_{number}"
+        return_type = self.rng.choice(['number', 'void', 'string'])
+        names = ['a', 'b']
+
+        self.lines.append(f"func {name}(a: number, b: number): {return_type}")
+        self.block(self.statements, 1, names)
+
+        if return_type == 'number':
+            self.lines.append(f"    return {self.expression(self.depth, names)}")
+        elif return_type == 'string':
+            self.lines.append(f"    return \"s\" & a")
+
+        self.lines.append("end")
+        self.lines.append('')
+        self.functions.append((name, return_type))
+
+# a sprite with random functions. functions only call functions defined
+# before them, and sprite variables are only used from the event handler
+def make_sprite(rng, index, functions=20, statements=10, depth=3, statics=5):
+    gen = SpriteGenerator(rng, index, statements, depth)
+    gen.lines += ['costume "../alien-in-suit.png"', '']
+
+    static_names = []
+    for i in range(statics):
+        static_names.append(f"s{index}_{i}")
+        gen.lines.append(f"var s{index}_{i} = {rng.randint(0, 9)}")
+    gen.lines.append('')
+
+    for i in range(functions):
+        gen.function(i)
+
+    gen.lines.append("when flag")
+    for func_name, return_type in gen.functions[-3:]:
+        if return_type == 'void':
+            gen.lines.append(f"    {func_name}(1, 2)")
+    for name in static_names:
+        gen.lines.append(f"    {name} += {name} * 2")
+    gen.lines.append("    say(\"done\")")
+    gen.lines.append("end")
+
+    return '\n'.join(gen.lines) + '\n'
+
+def make_project(path, sprites=2, functions=20, statements=10, depth=3, statics=5, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, 'stage.nano'), 'w') as f:
+        f.write('costume "../blank.svg"\nvar stage_score = 0\n')
+
+    for i in range(sprites):
+        with open(os.path.join(path, f'sprite{i}.nano'), 'w') as f:
+            f.write(make_sprite(rng, i, functions, statements, depth, statics))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic nanolang project")
+    parser.add_argument('dir', help="Directory to write the project to.")
+    parser.add_argument('sprites', type=int, nargs='?', default=2, help="Number of sprites. Defaults to 2.")
+    parser.add_argument('functions', type=int, nargs='?', default=20, help="Functions per sprite. Defaults to 20.")
+    parser.add_argument('statements', type=int, nargs='?', default=10, help="Statements per block. Defaults to 10.")
+    parser.add_argument('depth', type=int, nargs='?', default=3, help="How deep blocks nest. Defaults to 3.")
+    parser.add_argument('statics', type=int, nargs='?', default=5, help="Static variables per sprite. Defaults to 5.")
+    parser.add_argument('seed', type=int, nargs='?', default=0, help="Random seed. Defaults to 0.")
+    args = parser.parse_args()
+
+    make_project(args.dir, args.sprites, args.functions, args.statements, args.depth, args.statics, args.seed)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_DIR_NAME = '.nanocache'
+
+# mkstemp creates files only readable by the owner; written files get
+# the permissions open() would have given them instead
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# writes a file so that readers either see the old content or the new content,
+# never a partially written file. used for anything that concurrent builds
+# may read or write at the same time
+def write_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+# hash of the compiler's own source, so entries made by an older version
+# of the compiler are never reused
+def compiler_hash():
+    compiler_dir = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+
+    for filename in sorted(os.listdir(compiler_dir)):
+        if not filename.endswith('.py'):
+            continue
+
+        h.update(filename.encode('utf-8') + b'\0')
+        with open(os.path.join(compiler_dir, filename), 'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+# hash of everything a sprite can see of the stage: the declared variables
+# and their types, and where the stage's generated code keeps them
+def stage_exports_hash(stage, stage_gen):
+    exports = []
+    for var_name, stage_var in stage_gen.static_variables.items():
+        exports.append([var_name, str(stage['variables'][var_name]['type']), stage_var])
+
+    return hashlib.sha256(json.dumps(exports).encode('utf-8')).hexdigest()
+
+# on-disk cache of generated sprites, stored under the output directory.
+# an entry is keyed by the sprite's source, the stage exports it was compiled
+# against, the compiler version and the salt, which holds the build options
+# that change the output. so it never needs to be invalidated; entries that a
+# build didn't use are removed by prune
+class BuildCache:
+    def __init__(self, output_dir, salt=''):
+        self.path = os.path.join(output_dir, CACHE_DIR_NAME)
+        self.salt = compiler_hash() + salt
+        self.used = set()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, source, stage_hash):
+        h = hashlib.sha256()
+        h.update(self.salt.encode('utf-8') + b'\0')
+        h.update(stage_hash.encode('utf-8') + b'\0')
+        h.update(source)
+        return h.hexdigest()
+
+    def get(self, key):
+        self.used.add(key)
+
+        try:
+            with open(os.path.join(self.path, key), 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return entry
+
+    def put(self, key, entry):
+        self.used.add(key)
+        write_atomic(os.path.join(self.path, key), json.dumps(entry).encode('utf-8'))
+
+    def prune(self):
+        for filename in os.listdir(self.path):
+            if filename in self.used or filename.startswith('.tmp-'):
+                continue
+
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,96 @@
+import time
+import tracemalloc
+
+from astgen import Block, ExpressionNode
+
+# records the wall time of a phase into stats[name], along with how far memory
+# use rose above where it started during the phase, if tracemalloc is running
+class Phase:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phase = {'time': time.perf_counter() - self.start}
+        if self.tracing:
+            phase['peak_memory'] = tracemalloc.get_traced_memory()[1] - self.start_memory
+
+        self.stats[self.name] = phase
+
+# number of statements and expression nodes in a parsed program
+def count_ast_nodes(program):
+    count = 0
+    stack = [func.definition for func in program['functions'].values()]
+    stack.extend(event['definition'] for event in program['events'])
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, Block):
+            stack.extend(node.statements)
+        elif isinstance(node, ExpressionNode):
+            count += 1
+            stack.extend(vars(node).values())
+        elif isinstance(node, dict):
+            if isinstance(node.get('type'), str):
+                count += 1
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+
+    return count
+
+def format_time(seconds):
+    return f"{(seconds * 1000):.1f}ms"
+
+def format_memory(size):
+    if size == None:
+        return "-"
+    return f"{(size / 1024):.0f}KiB"
+
+# turns the stats of a detailed build into a human readable report
+def format_report(summary):
+    lines = []
+
+    lines.append("phase       time")
+    for name, seconds in summary['timings'].items():
+        lines.append(f"{name:<11} {format_time(seconds)}")
+
+    lines.append("")
+    lines.append(f"{'file':<20} {'lex':>9} {'parse':>9} {'codegen':>9} {'tokens':>8} {'nodes':>8} {'lines':>8} {'peak mem':>9}")
+
+    for file_stats in summary['file_stats']:
+        name = file_stats['file']
+        if file_stats['cached']:
+            lines.append(f"{name:<20} (cached)")
+            continue
+
+        phases = file_stats['phases']
+        times = [format_time(phases[phase]['time']) if phase in phases else "-" for phase in ('lex', 'parse', 'codegen')]
+        peaks = [phase['peak_memory'] for phase in phases.values() if 'peak_memory' in phase]
+        peak = max(peaks) if peaks else None
+
+        lines.append(f"{name:<20} {times[0]:>9} {times[1]:>9} {times[2]:>9} {file_stats['tokens']:>8} {file_stats['ast_nodes']:>8} {file_stats['lines']:>8} {format_memory(peak):>9}")
+
+    if summary['passes']:
+        lines.append("")
+        lines.append(f"{'pass':<20} {'time':>9} {'nodes':>8} {'stack ops':>10}")
+
+        for name, pass_stats in summary['passes'].items():
+            lines.append(f"{name:<20} {format_time(pass_stats['time']):>9} {pass_stats['nodes_removed']:>8} {pass_stats['stack_ops_saved']:>10}")
+
+    return "\n".join(lines)
+
+# one line summing up what the optimization passes did
+def format_pass_totals(totals):
+    return f"optimized: {totals['nodes_removed']} nodes removed, {totals['stack_ops_saved']} stack ops saved"
+
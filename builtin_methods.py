@@ -1,12 +1,13 @@
 from compilertypes import ValueType
 
 class BuiltinFunction:
-    def __init__(self, name, type, params, generate, generate_return=None):
+    def __init__(self, name, type, params, generate, generate_return=None, yields=False):
         self.name = name
         self.type = ValueType.from_string(type)
         self.parameters = [{'name': '', 'type': ValueType.from_string(x)} for x in params]
         self.generate = generate
         self.generate_return = generate_return
+        self.yields = yields # whether other scripts can run before it finishes
 
 def _func(arr):
     dic = {}
@@ -112,7 +113,8 @@ BUILTIN_METHODS = _func([
         name='say_wait',
         type='void',
         params=['string', 'number'],
-        generate=lambda args: f"say {(args[0])}, {(args[1])};"
+        generate=lambda args: f"say {(args[0])}, {(args[1])};",
+        yields=True
     ),
 
     BuiltinFunction(
@@ -126,7 +128,8 @@ BUILTIN_METHODS = _func([
         name='think_wait',
         type='void',
         params=['string', 'number'],
-        generate=lambda args: f"think {(args[0])}, {(args[1])};"
+        generate=lambda args: f"think {(args[0])}, {(args[1])};",
+        yields=True
     ),
 
     BuiltinFunction(
@@ -168,7 +171,7 @@ BUILTIN_METHODS = _func([
         name='next_costume',
         type='void',
         params=[],
-        generate=lambda args: f"next_costume {(args[0])};"
+        generate=lambda args: f"next_costume;"
     ),
 
     BuiltinFunction(
@@ -213,7 +216,8 @@ BUILTIN_METHODS = _func([
         name='wait',
         type='void',
         params=['number'],
-        generate=lambda args: f"wait {(args[0])};"
+        generate=lambda args: f"wait {(args[0])};",
+        yields=True
     ),
 
     BuiltinFunction(
@@ -236,7 +240,8 @@ BUILTIN_METHODS = _func([
         type='string',
         params=['string'],
         generate=lambda args: f"ask ({args[0]});",
-        generate_return=lambda: "answer()"
+        generate_return=lambda: "answer()",
+        yields=True
     ),
 
     BuiltinFunction(
@@ -278,7 +283,7 @@ BUILTIN_METHODS = _func([
         name='reset_timer',
         type='void',
         params=[],
-        generate=lambda args: f"reset_timer"
+        generate=lambda args: f"reset_timer;"
     ),
 
     BuiltinFunction(
@@ -0,0 +1,141 @@
+# call graph analysis
+# the graph is built once per program from the function references collected
+# by the parser. strongly connected components are found with tarjan's algorithm,
+# from which per-function facts are worked out for the code generator.
+from builtin_methods import BUILTIN_METHODS
+
+class CallGraph:
+    def __init__(self, program):
+        functions = program['functions']
+
+        # function name -> names of called non-builtin functions
+        # (sorted, so that the analysis doesn't depend on set ordering)
+        self.calls = {}
+        for name, func in functions.items():
+            self.calls[name] = sorted(ref for ref in func.func_references if not ref in BUILTIN_METHODS and ref in functions)
+        
+        self.event_calls = set()
+        for event in program['events']:
+            for ref in event['func_references']:
+                if not ref in BUILTIN_METHODS and ref in functions:
+                    self.event_calls.add(ref)
+
+        self.components = self._find_components()
+
+        # function name -> index into self.components
+        self.component_of = {}
+        for i, component in enumerate(self.components):
+            for name in component:
+                self.component_of[name] = i
+        
+        self.recursive = set()
+        for component in self.components:
+            if len(component) > 1 or component[0] in self.calls[component[0]]:
+                self.recursive.update(component)
+        
+        self.reachable = self._find_reachable()
+        self.max_call_depth = self._find_call_depths()
+    
+    # tarjan's strongly connected components algorithm, done iteratively
+    # so that long call chains don't run into the recursion limit.
+    # components come out in reverse topological order: callees before callers.
+    def _find_components(self):
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in self.calls:
+            if root in index:
+                continue
+
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.calls[root]))]
+
+            while work:
+                node, callees = work[-1]
+                descended = False
+
+                for callee in callees:
+                    if not callee in index:
+                        index[callee] = lowlink[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(self.calls[callee])))
+                        descended = True
+                        break
+                    elif callee in on_stack:
+                        lowlink[node] = min(lowlink[node], index[callee])
+                
+                if descended:
+                    continue
+                
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[node])
+
+                # node is the root of a component
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        name = stack.pop()
+                        on_stack.remove(name)
+                        component.append(name)
+                        if name == node: break
+                    
+                    components.append(component)
+        
+        return components
+    
+    def _find_reachable(self):
+        reachable = set(self.event_calls)
+        work = list(self.event_calls)
+
+        while work:
+            for callee in self.calls[work.pop()]:
+                if not callee in reachable:
+                    reachable.add(callee)
+                    work.append(callee)
+        
+        return reachable
+    
+    # the longest chain of calls a function can make, or None if it's unbounded
+    # because of recursion somewhere along the way.
+    # leaf functions have a depth of 0.
+    def _find_call_depths(self):
+        depths = {}
+
+        for component in self.components:
+            for name in component:
+                if name in self.recursive:
+                    depths[name] = None
+                    continue
+
+                depth = 0
+                for callee in self.calls[name]:
+                    callee_depth = depths[callee]
+                    if callee_depth == None:
+                        depth = None
+                        break
+                    depth = max(depth, callee_depth + 1)
+                
+                depths[name] = depth
+        
+        return depths
+
+    def is_recursive(self, name):
+        return name in self.recursive
+    
+    def is_leaf(self, name):
+        return not self.calls[name]
+    
+    def is_reachable(self, name):
+        return name in self.reachable
+    
+    # true if a and b can (indirectly) call each other
+    def same_component(self, a, b):
+        return self.component_of[a] == self.component_of[b]
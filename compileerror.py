@@ -1,7 +1,19 @@
 class CompilationException(Exception):
     def __init__(self, lineno, linecol, message):
         super().__init__(f"{lineno}:{linecol}: " + message)
+        self.lineno = lineno
+        self.linecol = linecol
+        self.message = message
+    
+    # lets errors raised in worker processes reach the main process
+    def __reduce__(self):
+        return (CompilationException, (self.lineno, self.linecol, self.message))
     
     @staticmethod
     def from_token(token, message):
-        return CompilationException(token.lineno, token.linecol, message)
\ No newline at end of file
+        return CompilationException(token.lineno, token.linecol, message)
+    
+    @staticmethod
+    def from_source(source, offset, message):
+        lineno, linecol = source.position(offset)
+        return CompilationException(lineno, linecol, message)
\ No newline at end of file
@@ -6,9 +6,31 @@ class ValueType:
 
     POINTER = 4
 
-    def __init__(self, type, base_type=None):
-        self.type = type
-        self.base_type = base_type
+    # value types are interned: there is only ever one instance per distinct type,
+    # pointer chains included. this means types can be compared by identity,
+    # and cast checks only need to be worked out once per pair of types.
+    __slots__ = ('type', 'base_type', '_str', '_casts', '_implicit_casts')
+    _interned = {}
+    _from_string_cache = {}
+
+    def __new__(cls, type, base_type=None):
+        key = (type, base_type)
+        inst = cls._interned.get(key)
+
+        if inst == None:
+            inst = object.__new__(cls)
+            inst.type = type
+            inst.base_type = base_type
+            inst._str = None
+            inst._casts = {}
+            inst._implicit_casts = {}
+            cls._interned[key] = inst
+        
+        return inst
+    
+    # keep instances interned when they are copied or sent to another process
+    def __reduce__(self):
+        return (ValueType, (self.type, self.base_type))
     
     @staticmethod
     def pointer_to(base_type):
@@ -16,6 +38,10 @@ class ValueType:
     
     @staticmethod
     def from_string(str):
+        cached = ValueType._from_string_cache.get(str)
+        if cached != None:
+            return cached
+
         base_len = str.find('*')
         if base_len == -1:
             base_len = len(str)
@@ -36,9 +62,15 @@ class ValueType:
             out_type = ValueType.pointer_to(out_type)
             base_len += 1
         
+        ValueType._from_string_cache[str] = out_type
         return out_type
     
     def __str__(self):
+        if self._str == None:
+            self._str = self._to_string()
+        return self._str
+    
+    def _to_string(self):
         if self.type == ValueType.POINTER:
             return str(self.base_type) + "*"
         if self.type == ValueType.NUMBER:
@@ -59,10 +91,7 @@ class ValueType:
         return self.type == type_id
     
     def is_same(self, other):
-        if self.type == ValueType.POINTER and other.type == ValueType.POINTER:
-            return self.base_type.is_same(other.base_type)
-        else:
-            return self.type == other.type
+        return self is other
     
     # returns true if it is a pointer or an array
     def is_pointer(self):
@@ -79,6 +108,14 @@ class ValueType:
         if not isinstance(to_type, ValueType):
             to_type = ValueType(to_type)
         
+        can_cast = self._casts.get(to_type)
+        if can_cast == None:
+            can_cast = self._can_cast(to_type)
+            self._casts[to_type] = can_cast
+        
+        return can_cast
+
+    def _can_cast(self, to_type):
         if self.is_a(ValueType.POINTER) and to_type.is_a(ValueType.POINTER):
             return True
         
@@ -100,6 +137,14 @@ class ValueType:
         if not isinstance(to_type, ValueType):
             to_type = ValueType(to_type)
         
+        can_cast = self._implicit_casts.get(to_type)
+        if can_cast == None:
+            can_cast = self._can_cast_implicit(to_type)
+            self._implicit_casts[to_type] = can_cast
+        
+        return can_cast
+
+    def _can_cast_implicit(self, to_type):
         if self.is_same(to_type): return True
         
         can_cast = False
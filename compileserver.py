@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# long-running compile server for editor integrations.
+#
+# the server listens on a unix socket. every request and response is a single
+# line of json. requests look like {"id": 1, "method": "diagnose", "params": {...}}
+# and are answered with {"id": 1, "result": ...} or {"id": 1, "error": "..."}.
+#
+# methods:
+#   open, update   {path, text}          use text instead of the file's contents on disk
+#   close          {path}                go back to the contents on disk
+#   diagnose       {path}                errors in a file, as a list of diagnostics
+#   parse          {path}                functions and variables declared in a file
+#   compile        {project, output, j, O}
+#                                        compile a project, like running the compiler
+#   shutdown       {}                    stop the server
+#
+# paths are absolute. the stage of a file is the stage.nano next to it.
+#
+# every connection is served on its own thread, so a client that keeps its
+# connection open doesn't lock out the others. requests still run one at a time,
+# since they share the compiler state.
+
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+import nanoproject
+from astgen import parse_program
+from buildcache import stage_exports_hash
+from compileerror import CompilationException
+from gbgen import generate_program
+from lexer import tokenize, decode_source, TokenQueue
+
+class CompileServerError(Exception):
+    pass
+
+def diagnostic(e):
+    if isinstance(e, CompilationException):
+        return {'line': e.lineno, 'column': e.linecol, 'message': e.message}
+    return {'line': None, 'column': None, 'message': str(e) or type(e).__name__}
+
+# compiler state that is kept between requests. tokens are kept for as long as
+# a file's contents stay the same, and asts for as long as the file's tokens and
+# its stage do, so a request only redoes the work for what changed since the last one
+class CompileServer:
+    def __init__(self):
+        self.documents = {} # path -> contents of files open in an editor
+        self.tokens = {} # path -> (contents, token list or the exception lexing raised)
+        self.stages = {} # stage path -> stage info
+        self.files = {} # path -> file info
+        self.running = True
+        self.lock = threading.Lock() # held while a request is handled
+
+    def read(self, path):
+        if path in self.documents:
+            return self.documents[path]
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def lex(self, path):
+        data = self.read(path)
+
+        cached = self.tokens.get(path)
+        if cached == None or cached[0] != data:
+            try:
+                cached = (data, tokenize(decode_source(data)))
+            except CompilationException as e:
+                cached = (data, e)
+            self.tokens[path] = cached
+
+        if isinstance(cached[1], Exception):
+            raise cached[1]
+        return cached[1]
+
+    # parses and generates the stage of a project.
+    # the stage info is rebuilt only when the stage's source changes
+    def stage(self, stage_path):
+        tokens = self.lex(stage_path)
+
+        info = self.stages.get(stage_path)
+        if info == None or info['tokens'] is not tokens:
+            ast = parse_program(TokenQueue(tokens), '.')
+            info = {
+                'tokens': tokens,
+                'ast': ast
+            }
+            self.stages[stage_path] = info
+            self.generate_stage(info)
+
+        return info
+
+    def generate_stage(self, info):
+        info['gen'] = generate_program(info['ast'], io.StringIO())
+        info['hash'] = stage_exports_hash(info['ast'], info['gen'])
+
+    # lexes, parses and generates a file, collecting its errors
+    def check(self, path):
+        tokens = self.lex(path)
+        stage_path = os.path.join(os.path.dirname(path), 'stage.nano')
+        is_stage = path == stage_path
+
+        stage = None
+        if not is_stage:
+            try:
+                stage = self.stage(stage_path)
+            except Exception as e:
+                error = diagnostic(e)
+                return {
+                    'ast': None,
+                    'diagnostics': [{'line': None, 'column': None, 'message': "stage.nano: " + error['message']}]
+                }
+
+        stage_hash = None if is_stage else stage['hash']
+
+        info = self.files.get(path)
+        if info != None and info['tokens'] is tokens and info['stage_hash'] == stage_hash:
+            return info
+
+        info = {
+            'tokens': tokens,
+            'stage_hash': stage_hash,
+            'ast': None,
+            'diagnostics': []
+        }
+
+        try:
+            info['ast'] = parse_program(TokenQueue(tokens), '.', None if is_stage else stage['ast'])
+
+            if is_stage:
+                generate_program(info['ast'], io.StringIO())
+            else:
+                # same fix-up as a full build does
+                stale = nanoproject.stale_stage_variables(info['ast'], stage['gen'])
+                if stale:
+                    for var_name in stale:
+                        stage['ast']['variables'][var_name]['metadata']['needs_ref'] = True
+                    self.generate_stage(stage)
+                    info['stage_hash'] = stage['hash']
+
+                generate_program(info['ast'], io.StringIO(), stage['gen'])
+        except Exception as e:
+            info['diagnostics'].append(diagnostic(e))
+
+        self.files[path] = info
+        return info
+
+    def open(self, path, text):
+        self.documents[path] = text.encode('utf-8')
+        return None
+
+    def close(self, path):
+        self.documents.pop(path, None)
+        return None
+
+    def diagnose(self, path):
+        try:
+            return self.check(path)['diagnostics']
+        except Exception as e:
+            return [diagnostic(e)]
+
+    def parse(self, path):
+        info = self.check(path)
+        ast = info['ast']
+
+        if ast == None:
+            raise CompileServerError(info['diagnostics'][0]['message'])
+
+        return {
+            'functions': [{
+                'name': func.name,
+                'type': str(func.type),
+                'parameters': [{'name': param['name'], 'type': str(param['type'])} for param in func.parameters],
+                'line': func.idtok.lineno
+            } for func in ast['functions'].values()],
+            'variables': [{
+                'name': var['name'],
+                'type': str(var['type'])
+            } for var in ast['variables'].values()]
+        }
+
+    def compile(self, project, output, j=1, O=0):
+        project = os.path.abspath(project)
+        sources = {path: data for path, data in self.documents.items() if os.path.dirname(path) == project}
+
+        try:
+            summary = nanoproject.compile(project, output, jobs=j, sources=sources, opt_level=O)
+        except Exception as e:
+            return {'diagnostics': [diagnostic(e)]}
+
+        # the ir is only there for building an sb3, and doesn't need to go to the client
+        del summary['programs']
+        summary['diagnostics'] = []
+        return summary
+
+    def shutdown(self):
+        self.running = False
+        return None
+
+    def handle(self, request):
+        method = request.get('method')
+        params = request.get('params') or {}
+
+        if method not in METHODS:
+            raise CompileServerError(f"unknown method {method}")
+
+        if 'path' in params:
+            params['path'] = os.path.abspath(params['path'])
+
+        return METHODS[method](self, **params)
+
+METHODS = {
+    'open': CompileServer.open,
+    'update': CompileServer.open,
+    'close': CompileServer.close,
+    'diagnose': CompileServer.diagnose,
+    'parse': CompileServer.parse,
+    'compile': CompileServer.compile,
+    'shutdown': CompileServer.shutdown,
+}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        compile_server = self.server.compile_server
+
+        for line in self.rfile:
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                with compile_server.lock:
+                    response = {'id': request_id, 'result': compile_server.handle(request)}
+            except Exception as e:
+                response = {'id': request_id, 'error': str(e) or type(e).__name__}
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+            if not compile_server.running:
+                # shutdown waits for serve_forever to return, which runs on another thread
+                self.server.shutdown()
+                break
+
+class ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # clients that are still connected don't keep the server from stopping
+    daemon_threads = True
+
+def serve(socket_path):
+    # a socket left over from a server that didn't shut down cleanly
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.remove(socket_path)
+
+    compile_server = CompileServer()
+
+    with ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        server.compile_server = compile_server
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+# minimal client, for editor plugins written in python and for testing
+class CompileClient:
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 0
+
+    def request(self, method, **params):
+        self.next_id += 1
+        self.file.write(json.dumps({'id': self.next_id, 'method': method, 'params': params}).encode('utf-8') + b'\n')
+        self.file.flush()
+
+        response = json.loads(self.file.readline())
+        if 'error' in response:
+            raise CompileServerError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='nanolang-server',
+        description='Nanolang compile server',
+    )
+    parser.add_argument('socket', help="Path of the unix socket to listen on.")
+
+    args = parser.parse_args()
+    serve(args.socket)
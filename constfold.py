@@ -0,0 +1,249 @@
+# constant folding and propagation over the ir
+#
+# constant subtrees are evaluated with scratch's semantics (see scratchvalues)
+# and replaced by their result, as long as the result can be written as a
+# literal. booleans can't be: a literal true would be "true" to join but 0 to
+# arithmetic, while scratch's true is 1. a comparison is only folded away when
+# whatever uses it folds too, like the "+ 0" of a condition.
+#
+# values are propagated from
+#   - temp, from where it is set to a constant to where it is read in the
+#     same straight-line code. temp is shared by every script of the sprite,
+#     so anything that can yield or call a procedure forgets it.
+#   - locals kept in goboscript variables (see FunctionContext.new_variable)
+#     that are set exactly once, to a constant.
+#
+# ifs with a constant condition are replaced by the branch that runs, untils
+# that never run are dropped, and so are repeats with a count below one.
+
+import math
+
+import ir
+from ir import const
+import scratchvalues
+
+NUMERIC_OPERATORS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+}
+
+# comparison operator -> whether it holds for a given result of compare
+COMPARISON_OPERATORS = {
+    '==': lambda c: c == 0,
+    '!=': lambda c: c != 0,
+    '<': lambda c: c < 0,
+    '>': lambda c: c > 0,
+    '<=': lambda c: c <= 0,
+    '>=': lambda c: c >= 0,
+}
+
+# scratch value of a literal. numbers reach scratch as numbers, whatever
+# gs_literal printed them as
+def literal_value(value):
+    if isinstance(value, str):
+        return value
+    return float(value)
+
+# literal for a value, or None if there isn't one that scratch would read back
+# as exactly this value. numbers are limited to what python and javascript
+# both print without an exponent
+def value_literal(value):
+    if isinstance(value, str):
+        return const(value)
+    if isinstance(value, bool) or not math.isfinite(value):
+        return None
+    if value == 0:
+        return const(0.0)
+    if 1e-4 <= abs(value) < 1e16:
+        return const(value)
+    return None
+
+def binop_value(op, a, b):
+    if op in NUMERIC_OPERATORS or op == '/':
+        a = scratchvalues.to_number(a)
+        b = scratchvalues.to_number(b)
+        if a == None or b == None:
+            return None
+        if op == '/':
+            return a / b if b != 0 else None
+        return NUMERIC_OPERATORS[op](a, b)
+
+    if op == '&':
+        return scratchvalues.to_string(a) + scratchvalues.to_string(b)
+
+    if op in COMPARISON_OPERATORS:
+        c = scratchvalues.compare(a, b)
+        return None if c == None else COMPARISON_OPERATORS[op](c)
+
+    if op == 'and':
+        return scratchvalues.to_boolean(a) and scratchvalues.to_boolean(b)
+    if op == 'or':
+        return scratchvalues.to_boolean(a) or scratchvalues.to_boolean(b)
+
+    return None
+
+# folds an expression, returning the new expression and its value,
+# or None as the value if it isn't constant
+def fold_expr(expr):
+    op = expr[0]
+
+    if op == 'const':
+        return expr, literal_value(expr[1])
+
+    if op == 'binop':
+        a, a_value = fold_expr(expr[2])
+        b, b_value = fold_expr(expr[3])
+
+        value = None
+        if a_value != None and b_value != None:
+            value = binop_value(expr[1], a_value, b_value)
+            if value != None:
+                literal = value_literal(value)
+                if literal != None:
+                    return literal, value
+
+        return ('binop', expr[1], a, b), value
+
+    if op == 'neg':
+        a, a_value = fold_expr(expr[1])
+
+        value = None
+        if a_value != None:
+            value = binop_value('-', 0.0, a_value)
+            if value != None:
+                literal = value_literal(value)
+                if literal != None:
+                    return literal, value
+
+        return ('neg', a), value
+
+    if op == 'builtin_value':
+        return (op, expr[1], [fold_expr(arg)[0] for arg in expr[2]]), None
+
+    indices = ir.EXPR_CHILDREN[op]
+    if not indices:
+        return expr, None
+
+    node = list(expr)
+    for i in indices:
+        node[i] = fold_expr(expr[i])[0]
+    return tuple(node), None
+
+# replaces reads of variables with known values
+def substitute(expr, known):
+    if not known:
+        return expr
+    return ir.map_expr(expr, lambda node: known.get(node[1], node) if node[0] == 'var' else node)
+
+# folds blocks, substituting the given locals and whatever temp is known to hold
+class BlockFolder:
+    def __init__(self, locals):
+        self.locals = locals # local variable -> literal
+
+    def fold(self, expr, temp):
+        known = self.locals
+        if temp != None:
+            known = dict(known)
+            known['temp'] = temp
+        return fold_expr(substitute(expr, known))
+
+    # folds a block. temp is what temp holds when the block starts, if known
+    def fold_block(self, statements, temp=None):
+        out = []
+        pending = list(reversed(statements))
+
+        while pending:
+            stmt = pending.pop()
+            op = stmt[0]
+
+            if op == 'if':
+                cond, value = self.fold(stmt[1], temp)
+                if value != None:
+                    branch = stmt[2] if scratchvalues.to_boolean(value) else stmt[3]
+                    if branch:
+                        pending.extend(reversed(branch))
+                    continue
+
+                else_body = None if stmt[3] == None else self.fold_block(stmt[3], temp)
+                out.append(('if', cond, self.fold_block(stmt[2], temp), else_body))
+                temp = None
+                continue
+
+            if op == 'until':
+                # the condition is evaluated again after every iteration,
+                # when temp may hold anything
+                cond, value = self.fold(stmt[1], None)
+                if value != None and scratchvalues.to_boolean(value):
+                    continue
+
+                body = self.fold_block(stmt[2])
+                out.append(('forever', body) if value != None else ('until', cond, body))
+                temp = None
+                continue
+
+            if op == 'repeat':
+                count, value = self.fold(stmt[1], temp)
+                if value != None:
+                    number = scratchvalues.to_number(value)
+                    if number != None and math.floor(number + 0.5) < 1:
+                        continue
+
+                out.append(('repeat', count, self.fold_block(stmt[2])))
+                temp = None
+                continue
+
+            if op == 'forever':
+                out.append(('forever', self.fold_block(stmt[1])))
+                temp = None
+                continue
+
+            if op == 'set' and stmt[1] == 'temp':
+                # a constant without a literal, like a comparison, is
+                # remembered as its expression and folds where it's used
+                value, value_const = self.fold(stmt[2], temp)
+                out.append(('set', 'temp', value))
+                temp = value if value_const != None else None
+                continue
+
+            out.append(ir.map_stmt_exprs(stmt, lambda expr: self.fold(expr, temp)[0]))
+
+            if op == 'change' and stmt[1] == 'temp':
+                temp = None
+            elif op == 'call' or op == 'builtin':
+                temp = None
+
+        return out
+
+# locals that are set once, to a constant, and never changed
+def constant_locals(program):
+    sets = {}
+    changed = set()
+
+    for body in ir.program_bodies(program):
+        stack = [body]
+        while stack:
+            for stmt in stack.pop():
+                if stmt[0] == 'set' and stmt[1] in program['locals']:
+                    sets.setdefault(stmt[1], []).append(stmt[2])
+                elif stmt[0] == 'change':
+                    changed.add(stmt[1])
+                stack.extend(ir.stmt_blocks(stmt))
+
+    return {name: values[0] for name, values in sets.items() if len(values) == 1 and values[0][0] == 'const' and name not in changed}
+
+def const_fold_pass(program):
+    locals = {}
+
+    # folding can turn the value a local is set to into a constant, which can
+    # then be propagated to make more constants, so fold until nothing changes
+    while True:
+        folder = BlockFolder(locals)
+        program['static_init'] = folder.fold_block(program['static_init'])
+        for proc in program['procs']:
+            proc['body'] = folder.fold_block(proc['body'])
+
+        new_locals = constant_locals(program)
+        if new_locals == locals:
+            break
+        locals = new_locals
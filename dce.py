@@ -0,0 +1,134 @@
+# dead code elimination over the ir
+#
+# unused-functions removes the procedures of functions that can't be reached
+# from any event handler. the calls are taken from the ir rather than from the
+# parser's call graph, so calls that other passes removed don't count.
+#
+# dead-code removes
+#   - statements after a forever loop, which never run
+#   - ifs with nothing in them
+#   - assignments to locals (see ir.py) that nothing ever reads
+#   - assignments to temp or a local that are overwritten before anything
+#     reads them, like the "" a declaration without a value is set to
+
+import ir
+
+def reads_var(expr, name):
+    if expr[0] == 'var':
+        return expr[1] == name
+    return any(reads_var(child, name) for child in ir.expr_children(expr))
+
+def stmt_reads_var(stmt, name):
+    if any(reads_var(expr, name) for expr in ir.stmt_exprs(stmt)):
+        return True
+    return any(stmt_reads_var(nested, name) for block in ir.stmt_blocks(stmt) for nested in block)
+
+def collect_expr_reads(expr, reads):
+    op = expr[0]
+    if op == 'var':
+        reads.add(expr[1])
+    elif op == 'binop':
+        collect_expr_reads(expr[2], reads)
+        collect_expr_reads(expr[3], reads)
+    elif op == 'load' or op == 'neg':
+        collect_expr_reads(expr[1], reads)
+    elif op == 'builtin_value':
+        for arg in expr[2]:
+            collect_expr_reads(arg, reads)
+
+# names of all variables read by a list of statements
+def collect_reads(statements, reads):
+    for stmt in statements:
+        for expr in ir.stmt_exprs(stmt):
+            collect_expr_reads(expr, reads)
+
+        for block in ir.stmt_blocks(stmt):
+            collect_reads(block, reads)
+
+    return reads
+
+# whether the value set at statements[index] is never read. procedures never
+# read temp or the caller's locals before setting them, so calls don't count
+# as reads. temp is only ever read in the block that set it, so its value is
+# dead at the end of the block as well
+def is_unused_value(statements, index):
+    name = statements[index][1]
+
+    for stmt in statements[index + 1:]:
+        if stmt_reads_var(stmt, name):
+            return False
+        if stmt[0] == 'change' and stmt[1] == name:
+            return False
+        if stmt[0] == 'set' and stmt[1] == name:
+            return True
+
+    return name == 'temp'
+
+class DeadCodeRemover:
+    def __init__(self, locals, reads):
+        self.locals = locals
+        self.reads = reads
+        self.removed = False
+
+    def is_dead(self, statements, index):
+        stmt = statements[index]
+        op = stmt[0]
+
+        if op == 'set' or op == 'change':
+            name = stmt[1]
+            if name in self.locals and not name in self.reads:
+                return True
+            return op == 'set' and (name == 'temp' or name in self.locals) and is_unused_value(statements, index)
+
+        if op == 'if':
+            return not stmt[2] and not stmt[3]
+
+        return False
+
+    def remove(self, statements):
+        count = len(statements)
+
+        for i, stmt in enumerate(statements):
+            if stmt[0] == 'forever':
+                statements = statements[:i + 1]
+                break
+
+        statements = [stmt for i, stmt in enumerate(statements) if not self.is_dead(statements, i)]
+        if len(statements) != count:
+            self.removed = True
+        return statements
+
+def dead_code_pass(program):
+    # removing the only read of a variable can make assignments to it dead too
+    while True:
+        reads = set()
+        for body in ir.program_bodies(program):
+            collect_reads(body, reads)
+
+        remover = DeadCodeRemover(program['locals'], reads)
+        ir.map_program_blocks(program, remover.remove)
+        if not remover.removed:
+            break
+
+# names of the procedures called by a list of statements
+def collect_calls(statements, calls):
+    for stmt in statements:
+        if stmt[0] == 'call':
+            calls.add(stmt[1])
+        for block in ir.stmt_blocks(stmt):
+            collect_calls(block, calls)
+    return calls
+
+def unused_functions_pass(program):
+    calls = {proc['name']: collect_calls(proc['body'], set()) for proc in program['procs']}
+
+    reachable = set()
+    stack = [proc['name'] for proc in program['procs'] if proc['event'] != None]
+    while stack:
+        name = stack.pop()
+        if name in reachable or not name in calls:
+            continue
+        reachable.add(name)
+        stack.extend(calls[name])
+
+    program['procs'] = [proc for proc in program['procs'] if proc['name'] in reachable]
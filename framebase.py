@@ -0,0 +1,181 @@
+# caching the frame base in a procedure local
+#
+# every access to a stack frame slot reads the frame base first, which is
+# memory[stack_ptrs[$stack_id]]: three list lookups for what is one. this
+# pass keeps the frame base in the local fb instead, so slots are
+# memory[fb + k].
+#
+# the local belongs to the procedure, not to the call. it is loaded again
+#   - after the frame base is set, by the frame enter and exit of the
+#     procedure and of the inlined copies in it
+#   - after calls, which can run this procedure again recursively
+#   - after anything that yields, since another script can run this
+#     procedure in the meantime. that's the builtins that wait and the end
+#     of every loop iteration, so until conditions read the frame base
+#     directly, and loop bodies load fb again before using it
+# a load costs list lookups of its own, so fb is only loaded where enough
+# accesses follow it to make up for that. the others stay as they are.
+
+import ir
+from ir import const, binop
+from builtin_methods import BUILTIN_METHODS
+from dce import reads_var
+
+FB = ('var', 'fb')
+LOOPS = ('until', 'repeat', 'forever')
+
+def frame_addr(offset):
+    if offset < 0:
+        return binop("-", FB, const(-offset))
+    return binop("+", FB, const(offset))
+
+# frame slots and addresses in an expression
+def count_frame(expr):
+    count = 1 if expr[0] == 'frame_slot' or expr[0] == 'frame_addr' else 0
+    return count + sum(count_frame(child) for child in ir.expr_children(expr))
+
+# frame accesses of a statement itself, not counting nested blocks
+def stmt_frame_accesses(stmt):
+    count = sum(count_frame(expr) for expr in ir.stmt_exprs(stmt))
+    return count + 1 if stmt[0] == 'frame_store' else count
+
+def cached_expr(expr):
+    def replace(node):
+        if node[0] == 'frame_slot':
+            return ('load', frame_addr(node[1]))
+        if node[0] == 'frame_addr':
+            return frame_addr(node[1])
+        return node
+
+    return ir.map_expr(expr, replace)
+
+def cached_stmt(stmt):
+    if stmt[0] == 'frame_store':
+        return ('store', frame_addr(stmt[1]), cached_expr(stmt[2]))
+    return ir.map_stmt_exprs(stmt, cached_expr)
+
+# the value fb is loaded with after a statement that makes it stale, or None
+# if the statement doesn't
+def reload_value(stmt):
+    op = stmt[0]
+
+    if op == 'set_frame_base':
+        # the new frame base, unless reading it again is cheaper
+        if stmt[1][0] in ('stack_head', 'var'):
+            return stmt[1]
+        return ('frame_base',)
+
+    if op == 'call' or op == 'set_stack_ptr':
+        return ('frame_base',)
+    if op == 'builtin' and BUILTIN_METHODS[stmt[1]].yields:
+        return ('frame_base',)
+
+    return None
+
+def makes_stale(stmt):
+    if stmt[0] in LOOPS or reload_value(stmt) != None:
+        return True
+    return any(makes_stale(nested) for block in ir.stmt_blocks(stmt) for nested in block)
+
+# how many frame accesses fb would serve if it was loaded before a block,
+# counting the branch with more of them for ifs
+def accesses_ahead(statements):
+    count = 0
+
+    for stmt in statements:
+        if stmt[0] == 'until' or stmt[0] == 'forever':
+            break
+
+        count += stmt_frame_accesses(stmt)
+        if stmt[0] == 'repeat' or reload_value(stmt) != None:
+            break
+
+        if stmt[0] == 'if':
+            blocks = ir.stmt_blocks(stmt)
+            if any(makes_stale(nested) for block in blocks for nested in block):
+                break
+            count += max(accesses_ahead(block) for block in blocks)
+
+    return count
+
+# list operations a load of fb with a value costs. every access it serves
+# saves two
+def load_cost(value):
+    return ir.expr_stats(value)[1]
+
+# rewrites a block to use fb wherever that's cheaper, given whether fb holds
+# the frame base at its start. returns the new block and whether fb still
+# holds it at the end
+def cache_block(statements, loaded):
+    out = []
+
+    for i, stmt in enumerate(statements):
+        op = stmt[0]
+
+        if not loaded and stmt_frame_accesses(stmt) > 0 and 2 * accesses_ahead(statements[i:]) > load_cost(('frame_base',)):
+            out.append(('set', FB[1], ('frame_base',)))
+            loaded = True
+
+        if op == 'if':
+            body, body_loaded = cache_block(stmt[2], loaded)
+            else_body, else_loaded = None, loaded
+            if stmt[3] != None:
+                else_body, else_loaded = cache_block(stmt[3], loaded)
+
+            cond = cached_expr(stmt[1]) if loaded else stmt[1]
+            out.append(('if', cond, body, else_body))
+            loaded = body_loaded and else_loaded
+
+        elif op in LOOPS:
+            # every iteration starts after a yield
+            body_index = ir.STMT_CHILDREN[op][1][0]
+            body, _ = cache_block(stmt[body_index], False)
+
+            if op == 'until':
+                out.append(('until', stmt[1], body))
+            elif op == 'repeat':
+                out.append(('repeat', cached_expr(stmt[1]) if loaded else stmt[1], body))
+            else:
+                out.append(('forever', body))
+            loaded = False
+
+        else:
+            out.append(cached_stmt(stmt) if loaded else stmt)
+
+            value = reload_value(stmt)
+            if value != None:
+                loaded = 2 * accesses_ahead(statements[i + 1:]) > load_cost(value)
+                if loaded:
+                    out.append(('set', FB[1], value))
+
+    return out, loaded
+
+def mentions_fb(statements):
+    for stmt in statements:
+        if stmt[0] == 'set' and stmt[1] == FB[1]:
+            return True
+        if any(reads_var(expr, FB[1]) for expr in ir.stmt_exprs(stmt)):
+            return True
+        if any(mentions_fb(block) for block in ir.stmt_blocks(stmt)):
+            return True
+    return False
+
+# declares fb where it's first set, if that is before anything else uses it.
+# otherwise it's declared at the start of the procedure, with a value nothing
+# reads since every use is after a load
+def declare_fb(body):
+    for i, stmt in enumerate(body):
+        if stmt[0] == 'set' and stmt[1] == FB[1]:
+            body[i] = ('local', FB[1], stmt[2])
+            return body
+        if mentions_fb([stmt]):
+            break
+    else:
+        return body
+
+    return [('local', FB[1], const(0))] + body
+
+def frame_base_pass(program):
+    for proc in program['procs']:
+        body, _ = cache_block(proc['body'], False)
+        proc['body'] = declare_fb(body)
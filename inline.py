@@ -0,0 +1,239 @@
+# inlining of small non-recursive functions
+#
+# a call to a function is replaced by a copy of the function's procedure body.
+# the copy still sets up its own stack frame, so arguments, the return value
+# and stack variables are found where the procedure would have found them,
+# and a return behaves exactly like it does in the procedure. a copy that
+# doesn't use its frame leaves out the frame enter and exit. what's saved is
+# the procedure call itself, and the copies give the constant folder a body
+# per call site to work with.
+#
+# locals are renamed in every copy, so that a local is still only set by one
+# copy of the code that declared it. a constant or a parameter of the caller
+# passed as a parameter is used as it is, neither can change while the copy
+# runs. other arguments are set to new locals at the start of the copy, since
+# the call evaluated them there. those locals are shared by every script
+# running the copy, so a copy that binds them is only inlined where it can't
+# yield to another script in the middle.
+#
+# a function is inlined if it isn't recursive and either
+#   - it has the inline attribute
+#   - it's small, at most INLINE_THRESHOLD ir nodes
+#   - it's only called from one place
+# unless it has the noinline attribute. functions are inlined into each other
+# callees first, so what's measured is the size with their own calls inlined.
+#
+# the code of a warp function runs without screen refresh. copied into a
+# function that isn't warp it wouldn't, so those are only inlined when they
+# neither loop nor call anything.
+
+import ir
+from builtin_methods import BUILTIN_METHODS
+from dce import collect_calls
+
+INLINE_THRESHOLD = 40
+
+# how irgen's procedures enter and leave their stack frame
+FRAME_ENTER = [('comment', "stack frame enter")] + ir.push(('frame_base',)) + [('set_frame_base', ('stack_head',))]
+FRAME_EXIT = [('comment', "stack frame end"), ('set', 'temp', ('frame_slot', 0)), ir.pop(1), ('set_frame_base', ir.TEMP)]
+FRAME_NODES = ('frame_slot', 'frame_addr', 'stack_ref', 'return_ref')
+
+def count_calls(statements, counts):
+    for stmt in statements:
+        if stmt[0] == 'call':
+            counts[stmt[1]] = counts.get(stmt[1], 0) + 1
+        for block in ir.stmt_blocks(stmt):
+            count_calls(block, counts)
+    return counts
+
+def has_loops_or_calls(statements):
+    for stmt in statements:
+        if stmt[0] in ('until', 'repeat', 'forever', 'call'):
+            return True
+        if any(has_loops_or_calls(block) for block in ir.stmt_blocks(stmt)):
+            return True
+    return False
+
+# whether another script can run in the middle of a block, when it runs in
+# code that is warp or not
+def can_yield(statements, warp):
+    for stmt in statements:
+        if stmt[0] == 'call' or (stmt[0] == 'builtin' and BUILTIN_METHODS[stmt[1]].yields):
+            return True
+        if not warp and stmt[0] in ('until', 'repeat', 'forever'):
+            return True
+        if any(can_yield(block, warp) for block in ir.stmt_blocks(stmt)):
+            return True
+    return False
+
+def expr_uses_frame(expr):
+    return expr[0] in FRAME_NODES or any(expr_uses_frame(child) for child in ir.expr_children(expr))
+
+def uses_frame(statements):
+    for stmt in statements:
+        if stmt[0] == 'frame_store' or any(expr_uses_frame(expr) for expr in ir.stmt_exprs(stmt)):
+            return True
+        if any(uses_frame(block) for block in ir.stmt_blocks(stmt)):
+            return True
+    return False
+
+# a procedure body without its stack frame enter and exit, if it doesn't use
+# the frame in between
+def without_frame(body):
+    if body[:len(FRAME_ENTER)] != FRAME_ENTER:
+        return body
+    inner = body[len(FRAME_ENTER):]
+    if inner[-len(FRAME_EXIT):] == FRAME_EXIT:
+        inner = inner[:-len(FRAME_EXIT)]
+    return body if uses_frame(inner) else inner
+
+# whether an argument is used in the copy as it is rather than through a local
+def passed_as_is(value):
+    return value[0] == 'const' or value[0] == 'param'
+
+def collect_assigned(statements, names):
+    for stmt in statements:
+        if stmt[0] == 'set' or stmt[0] == 'change':
+            names.add(stmt[1])
+        for block in ir.stmt_blocks(stmt):
+            collect_assigned(block, names)
+    return names
+
+# names of procedures in the order they are inlined in, callees before their
+# callers, and the set of the ones that take part in recursion
+def callees_first(procs, calls):
+    order = []
+    recursive = set()
+    state = {} # name -> 'active' while its callees are visited, then 'done'
+
+    for root in procs:
+        if root in state:
+            continue
+
+        state[root] = 'active'
+        work = [(root, iter(sorted(calls[root])))]
+
+        while work:
+            name, callees = work[-1]
+            descended = False
+
+            for callee in callees:
+                if not callee in procs:
+                    continue
+                if state.get(callee) == 'active':
+                    # every function on the call chain from callee down to
+                    # here is part of a cycle
+                    for caller, _ in reversed(work):
+                        recursive.add(caller)
+                        if caller == callee:
+                            break
+                elif not callee in state:
+                    state[callee] = 'active'
+                    work.append((callee, iter(sorted(calls[callee]))))
+                    descended = True
+                    break
+
+            if descended:
+                continue
+
+            work.pop()
+            state[name] = 'done'
+            order.append(name)
+
+    return order, recursive
+
+class Inliner:
+    def __init__(self, program, procs):
+        self.program = program
+        self.procs = procs
+        self.inlinable = set()
+        self.copies = 0
+
+    def can_inline(self, caller, callee, args):
+        if not callee in self.inlinable:
+            return False
+        proc = self.procs[callee]
+        if not (caller['warp'] or not proc['warp'] or not has_loops_or_calls(proc['body'])):
+            return False
+        if all(passed_as_is(value) for value in args[1:]):
+            return True
+        return not can_yield(proc['body'], caller['warp'])
+
+    # a copy of a procedure body for a call with the given parameter values,
+    # with its locals renamed
+    def copy_body(self, proc, args):
+        self.copies += 1
+        renames = {}
+        for name in collect_assigned(proc['body'], set()):
+            if name in self.program['locals']:
+                renames[name] = f"{name}_{self.copies}"
+                self.program['locals'].add(renames[name])
+
+        bindings = []
+        params = {} # parameter -> what it's replaced by
+        for param, value in zip(proc['params'], args[1:]):
+            if passed_as_is(value):
+                params[param] = value
+                continue
+            name = f"{proc['name']}_{param}_{self.copies}"
+            self.program['locals'].add(name)
+            bindings.append(('set', name, value))
+            params[param] = ('var', name)
+
+        def rename_expr(node):
+            if node[0] == 'var':
+                return ('var', renames.get(node[1], node[1]))
+            if node[0] == 'param' and node[1] in params:
+                return params[node[1]]
+            return node
+
+        def rename_block(statements):
+            out = []
+            for stmt in statements:
+                stmt = ir.map_stmt_exprs(stmt, lambda expr: ir.map_expr(expr, rename_expr))
+                if stmt[0] == 'set' or stmt[0] == 'change':
+                    stmt = (stmt[0], renames.get(stmt[1], stmt[1]), stmt[2])
+                out.append(stmt)
+            return out
+
+        body = without_frame(proc['body'])
+        if renames or params:
+            body = ir.map_blocks(body, rename_block)
+
+        return [('comment', f"inlined {proc['name']}")] + bindings + body + [('comment', f"end of inlined {proc['name']}")]
+
+    def inline_into(self, caller):
+        def inline_block(statements):
+            out = []
+            for stmt in statements:
+                if stmt[0] == 'call' and self.can_inline(caller, stmt[1], stmt[2]):
+                    out.extend(self.copy_body(self.procs[stmt[1]], stmt[2]))
+                else:
+                    out.append(stmt)
+            return out
+
+        caller['body'] = ir.map_blocks(caller['body'], inline_block)
+
+def inline_pass(program):
+    procs = {proc['name']: proc for proc in program['procs'] if proc['event'] == None}
+    calls = {proc['name']: collect_calls(proc['body'], set()) for proc in program['procs']}
+    call_counts = {}
+    for body in ir.program_bodies(program):
+        count_calls(body, call_counts)
+
+    order, recursive = callees_first(procs, calls)
+    inliner = Inliner(program, procs)
+
+    for name in order:
+        proc = procs[name]
+        inliner.inline_into(proc)
+
+        # functions calling into a cycle are fine to inline, the cycle isn't
+        if name in recursive or proc['inline'] == False:
+            continue
+        if proc['inline'] or call_counts.get(name, 0) == 1 or ir.block_stats(proc['body'])[0] <= INLINE_THRESHOLD:
+            inliner.inlinable.add(name)
+
+    for proc in program['procs']:
+        if proc['event'] != None:
+            inliner.inline_into(proc)
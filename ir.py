@@ -0,0 +1,278 @@
+# intermediate representation between astgen and gbgen
+#
+# irgen lowers a parsed program into this ir, passes optimizes it and gbgen
+# prints it as goboscript. the ir is already lowered to the runtime model
+# described at the top of irgen: values live in goboscript variables, in
+# stack slots or elsewhere in memory, and every access to them is explicit.
+#
+# nodes are tuples whose first item is the opcode.
+#
+# expressions:
+#   ('const', value)              literal, printed with gs_literal
+#   ('var', name)                 goboscript variable (temp, statics, runtime variables)
+#   ('param', name)               custom block parameter, $name
+#   ('load', addr)                memory[addr]
+#   ('binop', op, a, b)           a op b, op being a goboscript operator
+#   ('neg', a)                    -(a)
+#   ('builtin_value', name, args) builtin reporter
+#   ('builtin_return', name)      where a builtin statement leaves its result
+#   ('frame_base',)               base of the current stack frame
+#   ('frame_addr', offset)        address of a slot in the current stack frame
+#   ('frame_slot', offset)        value of a slot in the current stack frame
+#   ('stack_head',)               address of the top of the stack
+#   ('stack_read', depth)         value depth cells below the top of the stack
+#   ('stack_ptr',)                address of the stack itself
+#   ('stack_ref', index)          only used inside irgen, see ExpressionStack
+#   ('return_ref', index)         same
+#
+# statements:
+#   ('set', name, value)          name = value
+#   ('local', name, value)        declares the procedure local name = value
+#   ('change', name, value)       name += value
+#   ('store', addr, value)        memory[addr] = value
+#   ('frame_store', offset, value)
+#   ('stack_store', depth, value)
+#   ('stack_adjust', delta)       move the top of the stack by delta cells
+#   ('set_frame_base', value)
+#   ('set_stack_ptr', value)
+#   ('call', proc name, args)     procedure call
+#   ('builtin', name, args)       builtin statement
+#   ('if', cond, body, else_body) else_body is None if there is no else
+#   ('until', cond, body)
+#   ('repeat', count, body)
+#   ('forever', body)
+#   ('delete_clone',)
+#   ('comment', text)
+#
+# a program is a dict:
+#   {'costumes', 'sounds', 'is_stage',
+#    'static_init': statements run on "nanoinit",
+#    'procs': [{'name', 'warp', 'inline', 'params', 'body', 'event'}],
+#    'locals': names of the variables that hold function locals}
+# where event is None for functions, or (event name, event parameter) for
+# the procedure of an event handler. inline is True or False for functions
+# with the inline or noinline attribute, None for the others. params are the
+# names of the procedure's parameters after stack_id, which calls pass in
+# order. locals are only ever used by the function that declared them, unlike
+# static variables and the runtime's variables.
+
+TEMP = ('var', 'temp')
+RETURN = ('var', 'nano_ret')
+STACK_ID = ('param', 'stack_id')
+
+# expression opcodes -> indices of their subexpressions
+EXPR_CHILDREN = {
+    'const': (),
+    'var': (),
+    'param': (),
+    'load': (1,),
+    'binop': (2, 3),
+    'neg': (1,),
+    'builtin_value': (),
+    'builtin_return': (),
+    'frame_base': (),
+    'frame_addr': (),
+    'frame_slot': (),
+    'stack_head': (),
+    'stack_read': (),
+    'stack_ptr': (),
+    'stack_ref': (),
+    'return_ref': (),
+}
+
+# statement opcodes -> (indices of expressions, indices of nested blocks)
+STMT_CHILDREN = {
+    'set': ((2,), ()),
+    'local': ((2,), ()),
+    'change': ((2,), ()),
+    'store': ((1, 2), ()),
+    'frame_store': ((2,), ()),
+    'stack_store': ((2,), ()),
+    'stack_adjust': ((), ()),
+    'set_frame_base': ((1,), ()),
+    'set_stack_ptr': ((1,), ()),
+    'call': ((), ()),
+    'builtin': ((), ()),
+    'if': ((1,), (2, 3)),
+    'until': ((1,), (2,)),
+    'repeat': ((1,), (2,)),
+    'forever': ((), (1,)),
+    'delete_clone': ((), ()),
+    'comment': ((), ()),
+}
+
+# statements whose expressions are in a list (the arguments) at index 2
+ARGS_STATEMENTS = ('call', 'builtin')
+
+def const(value):
+    return ('const', value)
+
+def binop(op, a, b):
+    return ('binop', op, a, b)
+
+# memory[addr], using the dedicated node for stack frame slots
+def load(addr):
+    if addr[0] == 'frame_addr':
+        return ('frame_slot', addr[1])
+    return ('load', addr)
+
+def store(addr, value):
+    if addr[0] == 'frame_addr':
+        return ('frame_store', addr[1], value)
+    return ('store', addr, value)
+
+# the ir for pushing a value onto the stack
+def push(value):
+    return [('stack_adjust', 1), ('stack_store', 0, value)]
+
+def pop(num):
+    return ('stack_adjust', -num)
+
+# subexpressions of an expression, including builtin arguments
+def expr_children(expr):
+    op = expr[0]
+    if op == 'builtin_value':
+        return expr[2]
+    return [expr[i] for i in EXPR_CHILDREN[op]]
+
+# rebuilds an expression bottom-up, replacing every node by fn(node)
+def map_expr(expr, fn):
+    op = expr[0]
+
+    if op == 'builtin_value':
+        return fn((op, expr[1], [map_expr(arg, fn) for arg in expr[2]]))
+
+    indices = EXPR_CHILDREN[op]
+    if not indices:
+        return fn(expr)
+
+    node = list(expr)
+    for i in indices:
+        node[i] = map_expr(expr[i], fn)
+    return fn(tuple(node))
+
+# expressions directly used by a statement
+def stmt_exprs(stmt):
+    op = stmt[0]
+    if op in ARGS_STATEMENTS:
+        return stmt[2]
+    return [stmt[i] for i in STMT_CHILDREN[op][0]]
+
+# nested blocks of a statement, skipping a missing else
+def stmt_blocks(stmt):
+    return [stmt[i] for i in STMT_CHILDREN[stmt[0]][1] if stmt[i] != None]
+
+# rebuilds a statement with fn applied to each of its expressions
+def map_stmt_exprs(stmt, fn):
+    op = stmt[0]
+    if op in ARGS_STATEMENTS:
+        return (op, stmt[1], [fn(arg) for arg in stmt[2]])
+
+    indices = STMT_CHILDREN[op][0]
+    if not indices:
+        return stmt
+
+    node = list(stmt)
+    for i in indices:
+        node[i] = fn(stmt[i])
+    return tuple(node)
+
+# rebuilds a statement with fn applied to each of its nested blocks
+def map_stmt_blocks(stmt, fn):
+    indices = STMT_CHILDREN[stmt[0]][1]
+    if not indices:
+        return stmt
+
+    node = list(stmt)
+    for i in indices:
+        if stmt[i] != None:
+            node[i] = fn(stmt[i])
+    return tuple(node)
+
+# applies fn to a block and every block nested in it, innermost first.
+# fn takes a list of statements and returns the new list
+def map_blocks(statements, fn):
+    return fn([map_stmt_blocks(stmt, lambda block: map_blocks(block, fn)) for stmt in statements])
+
+# every statement list in a program: static initialization and procedure bodies
+def program_bodies(program):
+    bodies = [program['static_init']]
+    bodies.extend(proc['body'] for proc in program['procs'])
+    return bodies
+
+# applies fn to every block of every body in the program
+def map_program_blocks(program, fn):
+    program['static_init'] = map_blocks(program['static_init'], fn)
+    for proc in program['procs']:
+        proc['body'] = map_blocks(proc['body'], fn)
+
+# == STATISTICS ==
+# what a pass achieved is measured by the number of ir nodes, and by the number
+# of list operations on memory, stack_heads and stack_ptrs. these are the
+# "stack ops" that make up most of the work of generated code in scratch.
+
+# list operations done by each node itself, not counting its children
+EXPR_STACK_OPS = {
+    'load': 1,
+    'frame_base': 2,
+    'frame_addr': 2,
+    'frame_slot': 3,
+    'stack_head': 1,
+    'stack_read': 2,
+    'stack_ptr': 1,
+}
+
+STMT_STACK_OPS = {
+    'store': 1,
+    'frame_store': 3,
+    'stack_store': 2,
+    'stack_adjust': 2,
+    'set_frame_base': 2,
+    'set_stack_ptr': 1,
+}
+
+def expr_stats(expr):
+    nodes = 0
+    stack_ops = 0
+    stack = [expr]
+
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        stack_ops += EXPR_STACK_OPS.get(node[0], 0)
+        stack.extend(expr_children(node))
+
+    return nodes, stack_ops
+
+# (nodes, stack ops) of a list of statements
+def block_stats(statements):
+    nodes = 0
+    stack_ops = 0
+
+    for stmt in statements:
+        if stmt[0] == 'comment':
+            continue
+
+        nodes += 1
+        stack_ops += STMT_STACK_OPS.get(stmt[0], 0)
+
+        for expr in stmt_exprs(stmt):
+            expr_nodes, expr_stack_ops = expr_stats(expr)
+            nodes += expr_nodes
+            stack_ops += expr_stack_ops
+
+        for block in stmt_blocks(stmt):
+            block_nodes, block_stack_ops = block_stats(block)
+            nodes += block_nodes
+            stack_ops += block_stack_ops
+
+    return nodes, stack_ops
+
+def program_stats(program):
+    nodes = 0
+    stack_ops = 0
+    for body in program_bodies(program):
+        body_nodes, body_stack_ops = block_stats(body)
+        nodes += body_nodes
+        stack_ops += body_stack_ops
+    return nodes, stack_ops
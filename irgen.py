@@ -0,0 +1,1088 @@
+# lowers parsed programs to the ir described in ir.py
+#
+# == STACK MECHANISM ==
+# nano will use a stack to store the values of variables.
+# each stack frame corresponds to a single function call.
+#
+# there can be multiple stacks allocated simultaneously, since
+# scratch is "multithreaded", so each custom block generated from
+# a function has an added first argument named "stack_id". this is
+# the id of the stack the custom block will be using.
+#
+# the list stack_ptrs stores the pointers to the beginning of each stack.
+# the list stack_heads stores the pointers to the head of each stack.
+#
+# the first item of each stack (aka the item directly at a stack's stack_ptr)
+# is a special value. it represents the pointer to the start of a current stack frame.
+# functionally inspired by the usage of the EBP register on x86 architecture.
+#
+# == STACK FRAMES ==
+# one stack frame stores the data for a single function call.
+# 
+# item 0 of each stack frame is the base of the previous stack frame,
+# followed by values of declared variables,
+# then finally followed by any temporary stack frame.
+#
+# -- Return values --
+# return values are handled by first allocating some memory by the caller
+# that's equivalent to the size of the returned value. (changing the stack ptr)
+# then, when the callee wants to return the value, it sets the data starting from the address
+# at the pointer of its stack base, minus the total size of function arguments, minus the size of the returned value,
+# thus matching up with the space allocated by the caller before the function call.
+#
+# values that fit in a single cell are returned in the nano_ret variable instead. the caller
+# uses it directly, unless something that could overwrite it runs first (see spill_return).
+#
+# -- Function arguments --
+# function arguments are passed to called functions by pushing values to the stack after the
+# return value allocation. arguments will then be accessed by the caller from negative offsets of its
+# stack base. arguments will be cleaned up by the caller.
+#
+# arguments that don't need to be in memory are passed as parameters of the custom block
+# instead (see is_parameter_argument), and only the rest go on the stack.
+
+import ir
+from ir import TEMP, RETURN, STACK_ID, const, binop, load, store, push, pop
+from compilertypes import ValueType
+from astgen import BinaryOperator
+from builtin_methods import BUILTIN_METHODS
+from callgraph import CallGraph
+
+class SpriteContext:
+    def __init__(self, program):
+        self.program = program
+        self.out = None # statement list currently being generated into
+        self.function_block_names = {}
+        self.static_variables = {}
+        self.local_ids = set() # ids of locals kept in goboscript variables
+        self.call_graph = None
+        self.pending_return = None # expression stack with a call result still in nano_ret
+        self._next_id = 0
+        self.staticalloc = "nano_staticalloc" # name of staticalloc variable - different for stage
+
+    def new_var_id(self):
+        id = self._next_id
+        self._next_id = self._next_id + 1
+        return "_" + str(id)
+
+    def emit(self, *statements):
+        self.out.extend(statements)
+
+    # pushes the result of a call that is still in nano_ret, before code that
+    # could overwrite it: another call, or a builtin that can yield
+    def spill_return(self):
+        stack = self.pending_return
+        self.pending_return = None
+
+        if stack != None and stack.pending_return != None:
+            self.emit(*push(RETURN))
+            stack.spilled[stack.pending_return] = stack.push()
+            stack.pending_return = None
+
+    # generates into a new statement list, which is returned
+    def generate_into(self, fn, *args):
+        out = self.out
+        self.out = []
+        fn(*args)
+        block = self.out
+        self.out = out
+        return block
+
+# whether every way through a block ends with a return, or never ends
+def ends_in_return(statements):
+    if not statements:
+        return False
+
+    last = statements[-1]
+    if last['type'] in ('return', 'forever', 'deleteclone'):
+        return True
+
+    if last['type'] == 'if' and last['else_branch'] != None:
+        return all(branch_ends_in_return(branch) for branch in (last['branch'], last['else_branch']))
+
+    return False
+
+def branch_ends_in_return(branch):
+    if branch['single']:
+        return ends_in_return([branch['branch']])
+    return ends_in_return(branch['branch'].statements)
+
+# whether a function returns its value in nano_ret rather than on the stack.
+# a return doesn't leave the function, so this needs every way through the
+# function to end with one. otherwise a call after the last return that ran
+# could overwrite nano_ret before the caller reads it. the loop tail calls
+# compile to yields after its last return unless the function is warp, and
+# another script can overwrite nano_ret then too
+def returns_in_register(func):
+    if func.type.is_void() or func.type.size() != 1:
+        return False
+    if func.tail_calls and not 'warp' in func.attributes:
+        return False
+    return ends_in_return(func.definition.statements)
+
+# cells the caller reserves on the stack for a function's return value
+def stack_return_size(func):
+    if func.type.is_void() or returns_in_register(func):
+        return 0
+    return func.type.size()
+
+# whether an argument is passed as a custom block parameter instead of on the
+# stack. arguments whose address is taken have to be in memory, and so do ones
+# a recursive function assigns to, since the variable they would be copied
+# into is shared by every call
+def is_parameter_argument(param, recursive):
+    metadata = param['metadata']
+    if param['type'].size() != 1 or metadata['needs_ref']:
+        return False
+    return not (recursive and metadata['assigned'])
+
+class FunctionContext:
+    class Tempvar:
+        def __init__(self, size, offset):
+            self.size = size
+            self.offset = offset
+
+    def __init__(self, sprite_ctx, paramlist, return_type, recursive=False, return_register=False):
+        self.sprite_ctx = sprite_ctx
+        self.warp = False
+        self.does_return = False
+        self.tail_calls = False
+        self.tail_flag = None # 1 once a tail call runs the function again, see generate_tail_loop
+        self.active_tempvars = []
+        self.recursive = recursive
+        self._offset = 0
+
+        # name -> stack of active variables with that name, innermost on top
+        self._variables = {}
+        # summed size of all active variables
+        self.active_variables_size = 0
+
+        # arguments
+        argoffset = 0
+        self.arguments = []
+        self._argument_index = {}
+
+        for param in reversed(paramlist):
+            if is_parameter_argument(param, recursive):
+                self.arguments.insert(0, {
+                    'name': param['name'],
+                    'size': 1,
+                    'offset': None,
+                    'id': None,
+                    'param': "_" + param['name']
+                })
+            else:
+                argoffset -= param['type'].size()
+                self.arguments.insert(0, {
+                    'name': param['name'],
+                    'size': param['type'].size(),
+                    'offset': argoffset,
+                    'id': None,
+                    'param': None
+                })
+
+        # parameters can't be assigned to, so assigned ones are copied into a variable
+        for arg, param in zip(self.arguments, paramlist):
+            if arg['param'] != None and param['metadata']['assigned']:
+                arg['id'] = sprite_ctx.new_var_id() + "_" + arg['name']
+                sprite_ctx.local_ids.add(arg['id'])
+
+        for arg in self.arguments:
+            if not arg['name'] in self._argument_index:
+                self._argument_index[arg['name']] = arg
+
+        # calculate return value location
+        self.return_register = return_register
+        if not return_type.is_void() and not self.return_register:
+            self.return_offset = argoffset - return_type.size()
+        else:
+            self.return_offset = 0
+
+    def new_variable(self, var_name, size, nostack=False):
+        assert(size > 0)
+
+        if nostack:
+            assert(size == 1)
+
+            var = {
+                'name': var_name,
+                'size': size,
+                'offset': None,
+                'id': self.sprite_ctx.new_var_id() + "_" + var_name
+            }
+            self.sprite_ctx.local_ids.add(var['id'])
+        else:
+            var = {
+                'name': var_name,
+                'size': size,
+                'offset': self._offset,
+                'id': None
+            }
+            self._offset += size
+
+        self._variables.setdefault(var_name, []).append(var)
+        self.active_variables_size += size
+
+    # non-temporal location on the stack unassociated
+    # with a variable
+    def new_tempvar(self, size):
+        assert(size > 0)
+        tempvar = FunctionContext.Tempvar(size, self._offset + 1) # add one to account for the internal data at item 0 of each stack base
+        self._offset += size
+        self.active_tempvars.append(tempvar)
+
+        return tempvar
+
+    def remove_tempvar(self, tempvar):
+        if not tempvar in self.active_tempvars:
+            raise Exception('could not find tempvar ' + str(tempvar))
+
+        self.active_tempvars.remove(tempvar)
+        self._offset -= tempvar.size
+
+    def remove_variable(self, var_name):
+        stack = self._variables.get(var_name)
+        if not stack:
+            raise Exception('could not find variable ' + var_name)
+
+        v = stack.pop()
+        if not stack:
+            del self._variables[var_name]
+
+        if v['offset'] != None:
+            self._offset -= v['size']
+        self.active_variables_size -= v['size']
+
+    ## Get address of variable in memory.
+    def get_variable_location(self, var_name):
+        stack = self._variables.get(var_name)
+        if stack:
+            # add one to account for the internal data at item 0 of each stack base
+            return ('frame_addr', stack[-1]['offset'] + 1)
+
+        v = self._argument_index.get(var_name)
+        if v != None:
+            return ('frame_addr', v['offset'])
+
+        v = self.sprite_ctx.static_variables.get(var_name)
+        if v != None:
+            return v['location']
+
+    ## Get name of the custom block parameter holding a variable.
+    def get_parameter(self, var_name):
+        if var_name in self._variables:
+            return None
+
+        v = self._argument_index.get(var_name)
+        if v != None and v['id'] == None:
+            return v['param']
+
+    ## Whether a name refers to an argument, rather than a variable hiding it.
+    def is_argument(self, var_name):
+        return not var_name in self._variables and var_name in self._argument_index
+
+    ## Get id of variable optimized to not be in memory.
+    def get_variable_id(self, var_name):
+        stack = self._variables.get(var_name)
+        if stack:
+            return stack[-1]['id']
+
+        v = self._argument_index.get(var_name)
+        if v != None:
+            return v['id']
+
+        v = self.sprite_ctx.static_variables.get(var_name)
+        if v != None:
+            return v['id']
+
+class Scope:
+    def __init__(self):
+        self.declared_variables = []
+        self.size = 0
+
+    def register_variable(self, var_name, var_size, nostack):
+        self.declared_variables.append(var_name)
+
+        if not nostack:
+            self.size += var_size
+
+# values left on the stack while an expression is being evaluated are
+# referred to with ('stack_ref', index) nodes. they can only be turned into
+# stack reads once the expression's final stack size is known, which is what
+# finalize_stack_references does.
+#
+# call results in nano_ret are referred to with ('return_ref', index) nodes.
+# only the latest one can still be in nano_ret, the ones before it have been
+# pushed to the stack by SpriteContext.spill_return
+class ExpressionStack:
+    def __init__(self):
+        self.stack_size = 0
+        self.returns = 0
+        self.pending_return = None # index of the return_ref still in nano_ret
+        self.spilled = {} # return_ref index -> stack_ref index
+
+    def push(self):
+        v = self.stack_size
+        self.stack_size += 1
+        return v
+
+    def push_return(self, sprite_ctx):
+        self.pending_return = self.returns
+        self.returns += 1
+        sprite_ctx.pending_return = self
+        return ('return_ref', self.pending_return)
+
+    def clear(self, ctx):
+        if self.stack_size > 0:
+            ctx.emit(pop(self.stack_size))
+
+    def finalize_stack_references(self, expr):
+        # without anything on the stack or in nano_ret there's nothing to replace
+        if self.stack_size == 0 and self.returns == 0:
+            return expr
+
+        top = self.stack_size - 1
+        def finalize(node):
+            if node[0] == 'stack_ref':
+                return ('stack_read', top - node[1])
+            if node[0] == 'return_ref':
+                if node[1] in self.spilled:
+                    return ('stack_read', top - self.spilled[node[1]])
+                self.pending_return = None
+                return RETURN
+            return node
+
+        return ir.map_expr(expr, finalize)
+
+class ExpressionLvalue:
+    def __init__(self, memloc):
+        self.value = load(memloc)
+        self.memloc = memloc
+
+def expression_children(expr):
+    if expr.op in ('func_call', 'builtin_func_call'):
+        return expr.data
+    elif expr.op in ('op_cast', 'op_neg', 'op_bnot', 'op_addr', 'op_indirect'):
+        return [expr.expr]
+    elif expr.op == 'op_index':
+        return [expr.data]
+    elif isinstance(expr, BinaryOperator):
+        return [expr.left, expr.right]
+    return []
+
+# whether an expression reads the variable with the given name
+def expression_reads(expr, var_name):
+    if expr.op in ('var_get', 'op_index') and expr.id == var_name:
+        return True
+    return any(expression_reads(child, var_name) for child in expression_children(expr))
+
+# whether evaluating an expression emits statements, like function calls
+def expression_has_calls(expr):
+    if expr.op == 'func_call':
+        return True
+    elif expr.op == 'builtin_func_call':
+        if BUILTIN_METHODS[expr.id].generate_return != None:
+            return True
+        return any(expression_has_calls(arg) for arg in expr.data)
+    elif expr.op in ('op_cast', 'op_neg', 'op_bnot', 'op_addr', 'op_indirect'):
+        return expression_has_calls(expr.expr)
+    elif expr.op == 'op_index':
+        return expression_has_calls(expr.data)
+    elif isinstance(expr, BinaryOperator):
+        return expression_has_calls(expr.left) or expression_has_calls(expr.right)
+    return False
+
+def generate_func_call(ctx, func_data, func_args):
+    sprite_ctx = ctx.sprite_ctx
+    block_name = sprite_ctx.function_block_names[func_data.name]
+    sprite_ctx.spill_return()
+
+    recursive = sprite_ctx.call_graph.is_recursive(func_data.name)
+    is_param = [is_parameter_argument(param, recursive) for param in func_data.parameters]
+
+    if any(is_param) and any(expression_has_calls(arg) for arg in func_args):
+        generate_stacked_func_call(ctx, block_name, stack_return_size(func_data), func_args, is_param)
+        return
+
+    # allocate space for return value, if needed
+    return_size = stack_return_size(func_data)
+    if return_size > 0:
+        sprite_ctx.emit(('stack_adjust', return_size))
+
+    # parse arguments
+    total_arg_size = 0
+    params = []
+    for arg, param in zip(func_args, is_param):
+        if param:
+            params.append(generate_expression(ctx, arg, ExpressionStack()))
+        else:
+            total_arg_size += arg.type.size()
+            push_expression_result(ctx, arg)
+
+    # proc call
+    sprite_ctx.emit(('call', block_name, [STACK_ID] + params))
+
+    # clean up arguments
+    if total_arg_size > 0:
+        sprite_ctx.emit(pop(total_arg_size))
+
+    # leaves return value on the stack or in nano_ret
+
+# a call whose arguments emit statements of their own. those could change what
+# an earlier argument evaluates to, so every argument is pushed in order first.
+# the ones passed on the stack are then copied to the top, above the return
+# value, where the function expects them
+def generate_stacked_func_call(ctx, block_name, return_size, func_args, is_param):
+    sprite_ctx = ctx.sprite_ctx
+
+    total_arg_size = 0
+    copy_size = 0
+    arg_starts = []
+    for arg, param in zip(func_args, is_param):
+        push_expression_result(ctx, arg)
+        arg_starts.append(total_arg_size)
+        total_arg_size += arg.type.size()
+        if not param:
+            copy_size += arg.type.size()
+
+    if return_size > 0:
+        sprite_ctx.emit(('stack_adjust', return_size))
+
+    # depth of cell k of argument i once the copies are pushed
+    def arg_depth(i, k=0):
+        return total_arg_size - 1 - arg_starts[i] - k + return_size + copy_size
+
+    if copy_size > 0:
+        sprite_ctx.emit(('stack_adjust', copy_size))
+        copy_depth = copy_size
+        for i, (arg, param) in enumerate(zip(func_args, is_param)):
+            if not param:
+                for k in range(arg.type.size()):
+                    copy_depth -= 1
+                    sprite_ctx.emit(('stack_store', copy_depth, ('stack_read', arg_depth(i, k))))
+
+    params = [('stack_read', arg_depth(i)) for i, param in enumerate(is_param) if param]
+    sprite_ctx.emit(('call', block_name, [STACK_ID] + params))
+
+    if copy_size > 0:
+        sprite_ctx.emit(pop(copy_size))
+
+    # move the return value down to where the arguments started
+    for depth in reversed(range(return_size)):
+        sprite_ctx.emit(('stack_store', depth + total_arg_size, ('stack_read', depth)))
+    sprite_ctx.emit(pop(total_arg_size))
+
+def set_argument(ctx, arg, value):
+    if arg['id'] != None:
+        ctx.sprite_ctx.emit(('set', arg['id'], value))
+    else:
+        assert(arg['param'] == None)
+        ctx.sprite_ctx.emit(('frame_store', arg['offset'], value))
+
+def set_tail_flag(ctx, value):
+    return ('frame_store', ctx.tail_flag[1], const(value))
+
+# a call a function makes to itself in tail position. the arguments are set
+# to their new values, and the function starts over in the same stack frame
+# once the blocks around the call have ended. tail calls count as assignments
+# to the parameters, so every argument is in the stack frame.
+def generate_tail_call(ctx, func_data, func_args):
+    sprite_ctx = ctx.sprite_ctx
+    sprite_ctx.emit(('comment', "tail call"))
+
+    # arguments passed on unchanged are left alone
+    pending = []
+    for arg, value in zip(ctx.arguments, func_args):
+        if not (value.op == 'var_get' and value.id == arg['name'] and ctx.is_argument(arg['name'])):
+            pending.append((arg, value))
+
+    # an argument can be set once none of the other new values read it. calls
+    # and pointers could read any of them, so then all values are pushed first
+    stacked = any(expression_has_calls(value) for _, value in pending) \
+        or any(param['metadata']['needs_ref'] for param in func_data.parameters)
+
+    while pending and not stacked:
+        for i, (arg, value) in enumerate(pending):
+            if not any(expression_reads(other, arg['name']) for j, (_, other) in enumerate(pending) if j != i):
+                break
+        else:
+            # the arguments swap values
+            stacked = True
+            break
+
+        expr_stack = ExpressionStack()
+        set_argument(ctx, arg, expr_stack.finalize_stack_references(generate_expression(ctx, value, expr_stack)))
+        expr_stack.clear(sprite_ctx)
+        del pending[i]
+
+    if pending:
+        for _, value in pending:
+            push_expression_result(ctx, value)
+        for depth, (arg, _) in enumerate(reversed(pending)):
+            set_argument(ctx, arg, ('stack_read', depth))
+        sprite_ctx.emit(pop(len(pending)))
+
+    sprite_ctx.emit(set_tail_flag(ctx, 1))
+
+BINARY_OPERATOR_SYMBOLS = {
+    'op_add': "+",
+    'op_sub': "-",
+    'op_mul': "*",
+    'op_div': "/",
+    'op_join': "&",
+    'op_bor': "or",
+    'op_band': "and",
+    'op_eq': "==",
+    'op_neq': "!=",
+    'op_lt': "<",
+    'op_gt': ">",
+    'op_lte': "<=",
+    'op_gte': ">=",
+}
+
+def generate_expression(ctx, expr, stack, prefer_lvalue=False):
+    if expr.op == 'const':
+        return const(expr.value)
+
+    elif expr.op == 'var_get':
+        param = ctx.get_parameter(expr.id)
+        if param != None:
+            return ('param', param)
+
+        var_id = ctx.get_variable_id(expr.id)
+
+        if var_id != None:
+            return ('var', var_id)
+        else:
+            memloc = ctx.get_variable_location(expr.id)
+            return ExpressionLvalue(memloc) if prefer_lvalue else load(memloc)
+
+    elif expr.op == 'func_call':
+        func_data = ctx.sprite_ctx.program['functions'][expr.id]
+        generate_func_call(ctx, func_data, expr.data)
+
+        if returns_in_register(func_data):
+            return stack.push_return(ctx.sprite_ctx)
+        return ('stack_ref', stack.push())
+
+    elif expr.op == 'builtin_func_call':
+        func_data = BUILTIN_METHODS[expr.id]
+
+        # builtins that report through a statement can wait
+        if func_data.generate_return != None:
+            ctx.sprite_ctx.spill_return()
+
+        expr_stack = ExpressionStack()
+        arg_exprs = []
+
+        for arg in expr.data:
+            arg_exprs.append(generate_expression(ctx, arg, expr_stack))
+
+        args = [expr_stack.finalize_stack_references(x) for x in arg_exprs]
+
+        if func_data.generate_return != None:
+            ctx.sprite_ctx.emit(('builtin', expr.id, args))
+            expr_stack.clear(ctx.sprite_ctx)
+            ctx.sprite_ctx.emit(*push(('builtin_return', expr.id)))
+            return ('stack_ref', stack.push())
+        else:
+            expr_stack.clear(ctx.sprite_ctx)
+            return ('builtin_value', expr.id, args)
+
+    elif expr.op == 'op_cast':
+        value = generate_expression(ctx, expr.expr, stack)
+
+        if expr.type.is_a(ValueType.STRING):
+            return binop("&", value, const(""))
+        else:
+            return binop("+", value, const(0))
+
+    elif expr.op == 'op_neg':
+        value = generate_expression(ctx, expr.expr, stack)
+        return ('neg', value)
+
+    elif expr.op == 'op_bnot':
+        value = generate_expression(ctx, expr.expr, stack)
+        return binop("==", value, const(0)) # for some reason, not (expr) breaks project and !(expr) doesn't emit a not statement.
+
+    elif expr.op == 'op_addr':
+        subexpr = generate_expression(ctx, expr.expr, stack, prefer_lvalue=True)
+        if not isinstance(subexpr, ExpressionLvalue):
+            raise Exception("op_addr error")
+
+        return subexpr.memloc
+
+    elif expr.op == 'op_indirect':
+        memloc = generate_expression(ctx, expr.expr, stack)
+        return ExpressionLvalue(memloc) if prefer_lvalue else load(memloc)
+
+    elif expr.op == 'op_index':
+        value = generate_expression(ctx, expr.data, stack)
+
+        param = ctx.get_parameter(expr.id)
+        var_id = ctx.get_variable_id(expr.id)
+        if param != None:
+            var_value = ('param', param)
+        elif var_id != None:
+            var_value = ('var', var_id)
+        else:
+            var_value = load(ctx.get_variable_location(expr.id))
+
+        return load(binop("+", var_value, value))
+
+    elif isinstance(expr, BinaryOperator):
+        val_a = generate_expression(ctx, expr.left, stack)
+        val_b = generate_expression(ctx, expr.right, stack)
+
+        op_symbol = BINARY_OPERATOR_SYMBOLS.get(expr.op)
+        if op_symbol == None:
+            raise Exception('unknown opcode ' + expr.op)
+
+        return binop(op_symbol, val_a, val_b)
+
+    else:
+        raise Exception('unknown opcode ' + expr.op)
+
+def push_expression_result(ctx, expr, to_temp=False):
+    sprite_ctx = ctx.sprite_ctx
+
+    expr_stack = ExpressionStack()
+    expr = expr_stack.finalize_stack_references(generate_expression(ctx, expr, expr_stack))
+
+    # set variable to expression result and clear
+    # values added to the stack by the expression (if present)
+    if expr_stack.stack_size > 0:
+        sprite_ctx.emit(('set', 'temp', expr))
+        expr_stack.clear(sprite_ctx)
+
+        if not to_temp:
+            sprite_ctx.emit(*push(TEMP))
+    else:
+        if to_temp:
+            sprite_ctx.emit(('set', 'temp', expr))
+        else:
+            sprite_ctx.emit(*push(expr))
+
+def generate_branch(ctx, scope, branch):
+    if branch['single']: generate_statement(ctx, branch['branch'], scope)
+    else: generate_block(ctx, branch['branch'])
+
+def generate_branch_block(ctx, scope, branch):
+    return ctx.sprite_ctx.generate_into(generate_branch, ctx, scope, branch)
+
+def get_assignment_location(ctx, loc, expr_stack, assignment):
+    if assignment['type'] == 'set' or assignment['type'] == 'inc':
+        return [loc, assignment['type'], assignment['value']]
+
+    elif assignment['type'] == 'index':
+        expr = generate_expression(ctx, assignment['index'], expr_stack)
+        res = get_assignment_location(ctx, binop("+", load(loc), expr), expr_stack, assignment['assignment'])
+        return res
+    else:
+        raise Exception("unknown assignment type " + assignment['type'])
+
+# for nostack variables
+# tbh i don't really know what i'm doing lmao
+def get_assignment_location2(ctx, ptr, expr_stack, assignment):
+    if assignment['type'] == 'set' or assignment['type'] == 'inc':
+        return [ptr, assignment['type'], assignment['value']]
+
+    elif assignment['type'] == 'index':
+        expr = generate_expression(ctx, assignment['index'], expr_stack)
+        res = get_assignment_location(ctx, binop("+", ptr, expr), expr_stack, assignment['assignment'])
+        return res
+    else:
+        raise Exception("unknown assignment type " + assignment['type'])
+
+# memory[location] = value, or memory[location] += value
+def generate_memory_assignment(ctx, expr_stack, location, assign_type, assign_value):
+    expr = generate_expression(ctx, assign_value, expr_stack)
+    location = expr_stack.finalize_stack_references(location)
+    expr = expr_stack.finalize_stack_references(expr)
+
+    if assign_type == 'inc':
+        ctx.sprite_ctx.emit(store(location, binop("+", load(location), expr)))
+    else: # type == 'set'
+        assert(assign_type == 'set')
+        ctx.sprite_ctx.emit(store(location, expr))
+
+def generate_statement(ctx, statement, scope):
+    sprite_ctx = ctx.sprite_ctx
+    opcode = statement['type']
+
+    # opcode var_declare
+    if opcode == 'var_declare':
+        var_name = statement['var_name']
+        var_size = statement['var_type'].size()
+        nostack = not (ctx.recursive or statement['metadata']['needs_ref'] or var_size != 1)
+        ctx.new_variable(var_name, var_size, nostack)
+        scope.register_variable(var_name, var_size, nostack)
+
+        sprite_ctx.emit(('comment', f"{var_name} declaration"))
+
+        if nostack:
+            if statement['init'] != None:
+                push_expression_result(ctx, statement['init'], to_temp=True)
+                sprite_ctx.emit(('set', ctx.get_variable_id(var_name), TEMP))
+            else:
+                sprite_ctx.emit(('set', ctx.get_variable_id(var_name), const("")))
+        else:
+
+            # write initialization expression if present
+            if statement['init'] != None:
+                push_expression_result(ctx, statement['init'])
+
+            # no initialization expression; initialize to an empty string
+            else:
+                sprite_ctx.emit(*push(const("")))
+
+    # opcode var_assign
+    elif opcode == 'var_assign':
+        var_name = statement['var_name']
+        expr_stack = ExpressionStack()
+
+        param = ctx.get_parameter(var_name)
+        var_id = ctx.get_variable_id(var_name)
+
+        # parameters are never assigned to, only indexed
+        if param != None:
+            location, assign_type, assign_value = get_assignment_location2(ctx, ('param', param), expr_stack, statement['assignment'])
+            generate_memory_assignment(ctx, expr_stack, location, assign_type, assign_value)
+
+        elif var_id != None: # variable is not in memory
+            assignment = statement['assignment']
+
+            if assignment['type'] == 'index':
+                location, assign_type, assign_value = get_assignment_location2(ctx, ('var', var_id), expr_stack, assignment)
+                generate_memory_assignment(ctx, expr_stack, location, assign_type, assign_value)
+
+            else:
+                assert(assignment['type'] == 'set' or assignment['type'] == 'inc')
+
+                assign_type = assignment['type']
+                assign_value = assignment['value']
+
+                expr = expr_stack.finalize_stack_references(generate_expression(ctx, assign_value, expr_stack))
+
+                if assign_type == 'inc':
+                    sprite_ctx.emit(('change', var_id, expr))
+                else:
+                    sprite_ctx.emit(('set', var_id, expr))
+
+        else:
+            var_loc = ctx.get_variable_location(var_name)
+            location, assign_type, assign_value = get_assignment_location(ctx, var_loc, expr_stack, statement['assignment'])
+            generate_memory_assignment(ctx, expr_stack, location, assign_type, assign_value)
+
+        expr_stack.clear(sprite_ctx)
+
+    # opcode func_call
+    elif opcode == 'func_call':
+        func_data = sprite_ctx.program['functions'][statement['func_name']]
+        if statement['tail_call']:
+            generate_tail_call(ctx, func_data, statement['args'])
+            return
+
+        generate_func_call(ctx, func_data, statement['args'])
+
+        # drop return value if it's on the stack
+        return_size = stack_return_size(func_data)
+        if return_size > 0:
+            sprite_ctx.emit(pop(return_size))
+
+    # opcode builtin_func_call
+    elif opcode == 'builtin_func_call':
+        expr_stack = ExpressionStack()
+        arg_exprs = []
+
+        for arg in statement['args']:
+            arg_exprs.append(generate_expression(ctx, arg, expr_stack))
+
+        sprite_ctx.emit(('builtin', statement['func_name'], [expr_stack.finalize_stack_references(x) for x in arg_exprs]))
+        expr_stack.clear(sprite_ctx)
+
+    # opcode return
+    elif opcode == 'return':
+        if statement['tail_call']:
+            func_data = sprite_ctx.program['functions'][statement['value'].id]
+            generate_tail_call(ctx, func_data, statement['value'].data)
+            return
+
+        sprite_ctx.emit(('comment', "return"))
+
+        if statement['value']:
+            expr_stack = ExpressionStack()
+            expr = expr_stack.finalize_stack_references(generate_expression(ctx, statement['value'], expr_stack))
+
+            # set variable to expression result and clear
+            # values added to the stack by the expression (if present)
+            if ctx.return_register:
+                if expr != RETURN:
+                    sprite_ctx.emit(('set', RETURN[1], expr))
+                expr_stack.clear(sprite_ctx)
+            elif expr_stack.stack_size > 0:
+                sprite_ctx.emit(('set', 'temp', expr))
+                expr_stack.clear(sprite_ctx)
+                sprite_ctx.emit(('frame_store', ctx.return_offset, TEMP))
+            else:
+                sprite_ctx.emit(('frame_store', ctx.return_offset, expr))
+
+        # free all variables
+        sprite_ctx.emit(pop(ctx.active_variables_size))
+
+    elif opcode == 'deleteclone':
+        sprite_ctx.emit(*free_stack())
+        sprite_ctx.emit(('delete_clone',))
+
+    # opcode if
+    elif opcode == 'if':
+        push_expression_result(ctx, statement['cond'], True)
+        cond = binop("!=", binop("+", TEMP, const(0)), const(0))
+
+        body = generate_branch_block(ctx, scope, statement['branch'])
+        else_body = None
+        if (statement['else_branch']):
+            else_body = generate_branch_block(ctx, scope, statement['else_branch'])
+
+        sprite_ctx.emit(('if', cond, body, else_body))
+
+    # opcode while
+    elif opcode == 'while':
+        # create tempvar for the while condition
+        # (can't use temp directly due to screen refresh at the end of loop)
+        tempvar = ctx.new_tempvar(1)
+        sprite_ctx.emit(*push(const("")))
+
+        push_expression_result(ctx, statement['cond'], True)
+        sprite_ctx.emit(('frame_store', tempvar.offset, TEMP))
+        cond = binop("==", binop("+", ('frame_slot', tempvar.offset), const(0)), const(0))
+
+        def generate_body():
+            # while inner loop
+            generate_branch(ctx, scope, statement['branch'])
+
+            # re-evaluate while condition again at the end of the loop
+            push_expression_result(ctx, statement['cond'], True)
+            sprite_ctx.emit(('frame_store', tempvar.offset, TEMP))
+
+        sprite_ctx.emit(('until', cond, sprite_ctx.generate_into(generate_body)))
+
+        ctx.remove_tempvar(tempvar)
+
+    # opcode repeat
+    elif opcode == 'repeat':
+        push_expression_result(ctx, statement['count'], True)
+        sprite_ctx.emit(('repeat', TEMP, generate_branch_block(ctx, scope, statement['branch'])))
+
+    # opcode forever
+    elif opcode == 'forever':
+        sprite_ctx.emit(('forever', generate_branch_block(ctx, scope, statement['branch'])))
+
+    else:
+        raise Exception("unknown statement opcode " + opcode)
+
+# frees the stack of the current thread
+def free_stack():
+    return [
+        ('call', "nano_free", [('stack_ptr',)]),
+        ('set_stack_ptr', const(""))
+    ]
+
+# assumes that there is a argument named stack_id
+def generate_block(ctx, block):
+    sprite_ctx = ctx.sprite_ctx
+    sprite_ctx.emit(('comment', "block start"))
+
+    # parse statement
+    scope = Scope()
+    did_return = False
+    in_forever = False
+
+    for statement in block.statements:
+        # unlike a return, a tail call leaves freeing the variables to the
+        # blocks around it
+        if statement['type'] == 'return' and not statement['tail_call']:
+            did_return = True
+        elif statement['type'] == 'forever':
+            did_return = True # doesn't actually return, but whether or not it does no longer matters
+            in_forever = True
+
+        generate_statement(ctx, statement, scope)
+
+    # end of block
+    if not did_return:
+        if scope.declared_variables:
+            for var_name in scope.declared_variables:
+                ctx.remove_variable(var_name)
+
+            sprite_ctx.emit(pop(scope.size))
+
+        sprite_ctx.emit(('comment', "block end"))
+
+    return {
+        'unescapable': in_forever
+    }
+
+# assumes that there is a argument named stack_id
+def generate_procedure(func_ctx, definition):
+    sprite_ctx = func_ctx.sprite_ctx
+
+    # stack frame enter
+    sprite_ctx.emit(('comment', "stack frame enter"))
+    sprite_ctx.emit(*push(('frame_base',))) # push old frame body
+    sprite_ctx.emit(('set_frame_base', ('stack_head',))) # set current frame body to stack head
+
+    # copy parameters that get assigned to into their variables
+    for arg in func_ctx.arguments:
+        if arg['param'] != None and arg['id'] != None:
+            sprite_ctx.emit(('set', arg['id'], ('param', arg['param'])))
+
+    sprite_ctx.emit(('comment', "function definition follows"))
+    if func_ctx.tail_calls:
+        block_info = generate_tail_loop(func_ctx, definition)
+    else:
+        block_info = generate_block(func_ctx, definition)
+
+    # stack frame end
+    if not block_info['unescapable']:
+        sprite_ctx.emit(('comment', "stack frame end"))
+        sprite_ctx.emit(('set', 'temp', ('frame_slot', 0)))
+        sprite_ctx.emit(pop(1)) # pop base of current stack frame
+        sprite_ctx.emit(('set_frame_base', TEMP)) # restore base of old stack frame
+
+# the body of a function with tail calls, in a loop that runs it again for as
+# long as it ends in one. functions with tail calls are recursive, so the flag
+# saying so is in the stack frame, like the function's locals. the loop yields
+# when the function isn't warp, and another script can call the function then
+def generate_tail_loop(ctx, definition):
+    sprite_ctx = ctx.sprite_ctx
+
+    tempvar = ctx.new_tempvar(1)
+    sprite_ctx.emit(*push(const(1)))
+    ctx.tail_flag = ('frame_slot', tempvar.offset)
+
+    block_info = {}
+    def generate_body():
+        sprite_ctx.emit(set_tail_flag(ctx, 0))
+        block_info.update(generate_block(ctx, definition))
+
+    sprite_ctx.emit(('until', binop("==", ctx.tail_flag, const(0)), sprite_ctx.generate_into(generate_body)))
+
+    ctx.remove_tempvar(tempvar)
+    if not block_info['unescapable']:
+        sprite_ctx.emit(pop(1))
+
+    return block_info
+
+# static memory initialization
+def static_memory_init(ctx, stage_ctx):
+    program = ctx.program
+
+    # get size required to store static variables
+    static_alloc_size = 0
+    for var_name in program['static_order']:
+        static_var = program['variables'][var_name]
+        if static_var['metadata']['needs_ref']:
+            static_alloc_size += static_var['type'].size()
+
+    # allocate space for static variables
+    if static_alloc_size > 0:
+        ctx.emit(('call', "nano_malloc", [const(static_alloc_size)]))
+        ctx.emit(('set', ctx.staticalloc, ('var', "nano_malloc_return")))
+    else:
+        ctx.emit(('set', ctx.staticalloc, const(0)))
+
+    # initialize static variables
+    static_variables = ctx.static_variables
+    static_offset = 0
+
+    if stage_ctx:
+        for var_name in stage_ctx.static_variables:
+            static_variables[var_name] = stage_ctx.static_variables[var_name]
+
+    for var_name in program['static_order']:
+        static_var = program['variables'][var_name]
+
+        if static_var['metadata']['needs_ref']:
+            location = binop("+", ('var', ctx.staticalloc), const(static_offset))
+            ctx.emit(store(location, const(static_var['init'])))
+
+            var_size = static_var['type'].size()
+            static_variables[var_name] = {
+                'name': var_name,
+                'size': var_size,
+                'location': location,
+                'id': None,
+            }
+            static_offset += var_size
+
+        else:
+            var_id = ctx.new_var_id() + "_" + var_name
+            ctx.emit(('set', var_id, const(static_var['init'])))
+
+            static_variables[var_name] = {
+                'name': var_name,
+                'size': 1,
+                'location': None,
+                'id': var_id
+            }
+
+# lowers a parsed program to ir. stage is the sprite context returned
+# when lowering the stage, or None if the program is the stage itself.
+# returns the sprite context and the ir program
+def lower_program(program, stage=None):
+    sprite_ctx = SpriteContext(program)
+    sprite_ctx.call_graph = CallGraph(program)
+    sprite_ctx.staticalloc = "nano_stagestaticalloc" if stage == None else "nano_staticalloc"
+
+    ir_program = {
+        'costumes': program['costumes'],
+        'sounds': program['sounds'],
+        'is_stage': stage == None,
+        'static_init': None,
+        'procs': [],
+        'locals': sprite_ctx.local_ids
+    }
+
+    # static variable initialization
+    ir_program['static_init'] = sprite_ctx.generate_into(static_memory_init, sprite_ctx, stage)
+
+    for func in program['functions'].values():
+        block_name = "_" + func.name
+        sprite_ctx.function_block_names[func.name] = block_name
+
+    for func in program['functions'].values():
+        func_ctx = FunctionContext(sprite_ctx, func.parameters, func.type, sprite_ctx.call_graph.is_recursive(func.name), returns_in_register(func))
+        func_ctx.warp = 'warp' in func.attributes
+        func_ctx.does_return = not func.type.is_void()
+        func_ctx.tail_calls = len(func.tail_calls) > 0
+
+        ir_program['procs'].append({
+            'name': sprite_ctx.function_block_names[func.name],
+            'warp': func_ctx.warp,
+            'inline': True if 'inline' in func.attributes else False if 'noinline' in func.attributes else None,
+            'params': [arg['param'] for arg in func_ctx.arguments if arg['param'] != None],
+            'body': sprite_ctx.generate_into(generate_procedure, func_ctx, func.definition),
+            'event': None
+        })
+
+    event_id = 0
+    for event_handler in program['events']:
+        func_ctx = FunctionContext(sprite_ctx, [], ValueType(ValueType.VOID))
+        func_ctx.warp = 'warp' in event_handler['attributes']
+        func_ctx.does_return = False
+
+        body = sprite_ctx.generate_into(generate_procedure, func_ctx, event_handler['definition'])
+        body.extend(free_stack())
+
+        ir_program['procs'].append({
+            'name': "event" + str(event_id),
+            'warp': func_ctx.warp,
+            'inline': False,
+            'params': [],
+            'body': body,
+            'event': (event_handler['event_name'], event_handler['event_param'])
+        })
+        event_id += 1
+
+    return sprite_ctx, ir_program
@@ -1,5 +1,72 @@
+import io
+import re
+from array import array
+from bisect import bisect_left, bisect_right
 from compileerror import CompilationException
 
+# source text of a file, along with the tables needed to turn an offset into a
+# line and column. they are only built once a position is needed
+class SourceText:
+    __slots__ = ('text', '_line_offsets', '_columns')
+
+    def __init__(self, text):
+        self.text = text
+        self._line_offsets = None
+        self._columns = None
+
+    # returns the line and column of the character at the given offset, numbered
+    # the way the lexer always has: every character advances the column by one,
+    # except that symbols advance it by one more than their length and the
+    # second character of an escape sequence does not advance it at all.
+    # the end of the file counts as one last newline
+    def position(self, offset):
+        if self._line_offsets == None:
+            line_offsets = [0]
+            text = self.text
+            i = text.find('\n')
+            while i != -1:
+                line_offsets.append(i + 1)
+                i = text.find('\n', i + 1)
+            self._line_offsets = line_offsets
+
+        # which characters are symbols and escape sequences is only known after
+        # lexing, so the source is scanned again. a position asked for while
+        # that scan raises an error uses what it found up to there
+        if self._columns == None:
+            self._columns = columns = ColumnDrift()
+            try:
+                for _ in scan_tokens(self, columns):
+                    pass
+            except CompilationException:
+                pass
+
+        columns = self._columns
+        if offset >= len(self.text):
+            return len(self._line_offsets) + 1 + columns.trailing_comment, 0
+
+        line = bisect_right(self._line_offsets, offset) - 1
+        line_start = self._line_offsets[line]
+        return line + 1, offset - line_start + 1 + columns.drift(line_start, offset)
+
+# how far the column numbering has drifted from the character position, as a
+# running total at every symbol and escape sequence in the source
+class ColumnDrift:
+    def __init__(self):
+        self.offsets = array('i')
+        self.totals = array('i')
+        self.trailing_comment = 0 # 1 if the file ends in a comment without a newline
+
+    def add(self, offset, amount):
+        self.offsets.append(offset)
+        self.totals.append((self.totals[-1] if self.totals else 0) + amount)
+
+    # drift of the characters in [start, end) on the column of the one at end
+    def drift(self, start, end):
+        def total_before(offset):
+            i = bisect_left(self.offsets, offset)
+            return self.totals[i - 1] if i > 0 else 0
+        return total_before(end) - total_before(start)
+
 class Token:
     TYPE_KEYWORD = 0
     TYPE_SYMBOL = 1 
@@ -10,12 +77,24 @@ class Token:
 
     KEYWORD_TYPES = ['void', 'string', 'number', 'bool']
     EVENT_NAMES = ['flag', 'keypress', 'click', 'broadcast']
+
+    # tokens are kept as small as possible, since a file produces a lot of them.
+    # the line and column are only computed from the source offset when asked for.
+    __slots__ = ('type', 'value', 'offset', 'source')
     
-    def __init__(self, lineno, linecol, token_type, value):
+    def __init__(self, source, offset, token_type, value):
         self.type = token_type
         self.value = value
-        self.lineno = lineno
-        self.linecol = linecol
+        self.offset = offset
+        self.source = source
+
+    @property
+    def lineno(self):
+        return self.source.position(self.offset)[0]
+
+    @property
+    def linecol(self):
+        return self.source.position(self.offset)[1]
     
     def __str__(self):
         if self.type == Token.TYPE_KEYWORD:
@@ -46,48 +125,93 @@ class Token:
             raise CompilationException.from_token(self, "expected identifier")
         return self.value
 
+# tokens of a file, stored as parallel arrays of type codes and source offsets.
+# Token objects are only created when a token is accessed, and their values are
+# sliced out of the source text then. string literals are the exception, since
+# their escape sequences have to be decoded, so their values are kept aside.
+class TokenList:
+    def __init__(self, source):
+        self.source = source
+        self.types = array('b')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.strings = {}
+    
+    def append(self, token_type, start, end, value=None):
+        if value != None:
+            self.strings[len(self.types)] = value
+
+        self.types.append(token_type)
+        self.starts.append(start)
+        self.ends.append(end)
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+
+        token_type = self.types[index]
+        start = self.starts[index]
+
+        if token_type == Token.TYPE_STRING:
+            value = self.strings[index]
+        elif token_type == Token.TYPE_EOF:
+            value = None
+        else:
+            value = self.source.text[start:self.ends[index]]
+        
+        return Token(self.source, start, token_type, value)
+
+# pulls tokens from a TokenList or a token generator through a small ring buffer,
+# so that only the lookahead the parser needs is ever held by the queue.
 class TokenQueue:
-    def __init__(self, p_list):
-        self.list = p_list
-        self.index = 0
+    LOOKAHEAD = 1
+
+    def __init__(self, tokens, lookahead=LOOKAHEAD):
+        self._source = iter(tokens)
+        self._buffer = [None] * lookahead
+        self._head = 0
+        self._eof_token = None
+
+        for i in range(lookahead):
+            self._buffer[i] = self._next_token()
+    
+    def _next_token(self):
+        # once the eof token is reached, keep handing it out
+        if self._eof_token != None:
+            return self._eof_token
+
+        token = next(self._source)
+        if token.type == Token.TYPE_EOF:
+            self._eof_token = token
+        
+        return token
     
     def eof(self):
-        return self.index >= len(self.list) - 1
+        return self._buffer[self._head].type == Token.TYPE_EOF
     
     def pop(self):
-        value = self.list[self.index]
+        head = self._head
+        value = self._buffer[head]
 
         if value.type == Token.TYPE_EOF:
             raise CompilationException.from_token(value, 'unexpected eof')
 
-        self.index += 1
+        self._buffer[head] = self._next_token()
+        self._head = (head + 1) % len(self._buffer)
         return value
     
-    def peek(self):
-        return self.list[self.index]
+    # look at the token n places after the head of the queue
+    def peek(self, n=0):
+        if n >= len(self._buffer):
+            raise Exception(f"internal: token lookahead of {n} exceeds queue lookahead of {len(self._buffer)}")
+        
+        return self._buffer[(self._head + n) % len(self._buffer)]
     
     def __bool__(self):
-        return self.index < len(self.list)
-
-class CharacterQueue:
-    def __init__(self, file):
-        self.file = file
-        self.queue = []
-    
-    def _read_single(self):
-        if self.queue:
-            v = self.queue[0]
-            del self.queue[0]
-            return v
-
-        return self.file.read(1)
-
-    def read(self, n):
-        assert(n == 1)
-        return self._read_single()
-    
-    def push(self, ch):
-        self.queue.append(ch)
+        return True
 
 SYMBOLS = [
     '@', ';', ':', ',',
@@ -100,179 +224,183 @@ SYMBOLS = [
     '+=', '-=', '*=', '/=',
 ]
 
-def get_symbol(file, char, lineno, linecol):
-    if not any(x[0] == char for x in SYMBOLS):
-        return None
-    
-    # filter out the specific symbol
-    candidates = SYMBOLS
-    i = 0
-    sym = ""
+# symbols indexed by their first character, longest first,
+# so that the first match is the maximal munch
+SYMBOL_TABLE = {}
+for _sym in sorted(SYMBOLS, key=len, reverse=True):
+    SYMBOL_TABLE.setdefault(_sym[0], []).append(_sym)
 
-    while True:
-        candidates = [x for x in candidates if (i < len(x) and x[i] == char)]
+KEYWORDS = frozenset(Token.KEYWORD_TYPES + [
+    'func', 'var',
 
-        if not candidates:
-            if not sym in SYMBOLS:
-                raise CompilationException(lineno, linecol, "unknown symbol")
-            file.push(char)
+    'if', 'else', 'elseif', 'while', 'repeat', 'forever', 'for', 'block', 'drop', 'end', 'return',
+    'true', 'false',
 
-            return Token(lineno, linecol, Token.TYPE_SYMBOL, sym)
-        
-        if len(candidates) == 1:
-            sym += char
-            while len(sym) < len(candidates[0]):
-                sym += file.read(1)
-            
-            if sym != candidates[0]:
-                for ch in sym[1:]: # cancel symbol read...
-                    file.push(ch)
-                return None
-            else:
-                return Token(lineno, linecol, Token.TYPE_SYMBOL, candidates[0])
+    # asset links
+    'costume', 'sound',
 
-        if char == '\n' or not char:
-            raise CompilationException(lineno, linecol, "unknown symbol")
-        
-        sym += char
-        char = file.read(1)
+    # events
+    'when',
 
-        i += 1    
+    'deleteclone',
+])
 
-def parse_tokens(file_path):
-    KEYWORDS = Token.KEYWORD_TYPES + [
-        'func', 'var',
+NUMERIC_CHARS = frozenset('.0123456789')
+WORD_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890_")
+QUOTE_CHARS = frozenset('"\'')
+
+# a '.' followed by another '.' is the start of a '..' symbol, not part of the number
+NUMBER_PATTERN = re.compile(r"(?:[0-9]|\.(?!\.))+")
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+STRING_CHUNK_PATTERN = re.compile(r"[^\\\"'\n]+")
 
-        'if', 'else', 'elseif', 'while', 'repeat', 'forever', 'for', 'block', 'drop', 'end', 'return',
-        'true', 'false',
+STRING_ESCAPES = {
+    'n': '\n',
+    't': '\t',
+    'r': '\r',
+    '"': '\"',
+    '\'': '\'',
+}
 
-        # asset links
-        'costume', 'sound',
+def match_symbol(text, i):
+    candidates = SYMBOL_TABLE.get(text[i])
+    if candidates:
+        for sym in candidates:
+            if text.startswith(sym, i):
+                return sym
+    return None
 
-        # events
-        'when',
+def is_delimiter(text, i):
+    char = text[i]
+    return char.isspace() or char == '#' or char in QUOTE_CHARS or match_symbol(text, i) != None
 
-        'deleteclone',
-    ]
+# yields (type, start offset, end offset, value) for every token in the source.
+# value is only set for string literals, everything else is sliced from the source text.
+# columns, if given, is a ColumnDrift that collects where the column numbering drifts
+def scan_tokens(source, columns=None):
+    text = source.text
+    length = len(text)
+    i = 0
 
-    NUMERIC_CHARS = ['.', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
-    WORD_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890_"
+    while i < length:
+        char = text[i]
 
-    tokens = []
+        if char.isspace():
+            i += 1
 
-    with open(file_path, 'r') as _f:
-        file = CharacterQueue(_f)
-        str_buf = []
-        line_begin = True
-        is_number = False
+        # comment
+        elif char == '#':
+            newline = text.find('\n', i)
+            i = length if newline == -1 else newline + 1
+            if newline == -1 and columns != None:
+                columns.trailing_comment = 1
 
-        lineno = 1
-        linecol = 0
+        # read entirety of string
+        elif char in QUOTE_CHARS:
+            # for error handling
+            token_offset = i
 
-        # line number information for potential error messages
-        token_lineno = 0
-        token_linecol = 0
+            str_buf = []
+            i += 1
+            while True:
+                chunk = STRING_CHUNK_PATTERN.match(text, i)
+                if chunk:
+                    str_buf.append(chunk.group())
+                    i = chunk.end()
 
-        eof = False
-        while not eof:
-            char = file.read(1)
-            if not char:
-                eof = True
-                char = '\n'
+                if i >= length:
+                    raise CompilationException.from_source(source, token_offset, "unterminated string")
 
-            linecol += 1
-            
-            symbol = get_symbol(file, char, lineno, linecol)
-            if symbol or char.isspace() or char == '#' or char == '"' or char == '\'':
-                if str_buf:
-                    word = ''.join(str_buf)
-
-                    if is_number:
-                        tokens.append(Token(token_lineno, token_linecol, Token.TYPE_NUMBER, word))
-                        # print("NUMBER: " + word)
-                    elif word in KEYWORDS:
-                        tokens.append(Token(token_lineno, token_linecol, Token.TYPE_KEYWORD, word))
-                        # print("KEYWORD: " + word)
-                    else:
-                        tokens.append(Token(token_lineno, token_linecol, Token.TYPE_IDENTIFIER, word))
-                        # print("IDENTIFIER: " + word)
-                    
-                    str_buf.clear()
-                
-                # read entirety of string
-                if char == '"' or char == '\'':
-                    # for error handling
-                    token_lineno = lineno
-                    token_linecol = linecol
-
-                    while True:
-                        char = file.read(1)
-                        linecol += 1
-                        if not char:
-                            raise CompilationException(token_lineno, token_linecol, "unterminated string")
-                        
-                        # escape sequence
-                        if char == '\\':
-                            char = file.read(1)
-                            
-                            if char == 'n':
-                                str_buf.append('\n')
-                            elif char == 't':
-                                str_buf.append('\t')
-                            elif char == 'r':
-                                str_buf.append('\r')
-                            elif char == '"':
-                                str_buf.append('\"')
-                            elif char == '\'':
-                                str_buf.append('\'')
-                            else:
-                                raise CompilationException(lineno, linecol, "invalid escape sequence '\\" + char + "'")
-                        
-                        # end of string
-                        elif char == '"' or char == '\'':
-                            word = ''.join(str_buf)
-                            tokens.append(Token(lineno, linecol, Token.TYPE_STRING, word))
-                            # print("STRING: \"" + word + "\"")
-                            str_buf.clear()
-                            break
-                        
-                        # normal character
-                        else:
-                            str_buf.append(char)
-                        
-                        if char == '\n':
-                            lineno += 1
-                            linecol = 0
-                
-                elif symbol:                    
-                    linecol += len(symbol.value)
-                    tokens.append(symbol)
+                char = text[i]
+
+                # escape sequence
+                if char == '\\':
+                    esc = text[i+1:i+2]
+                    if not esc in STRING_ESCAPES:
+                        raise CompilationException.from_source(source, i, "invalid escape sequence '\\" + esc + "'")
+
+                    str_buf.append(STRING_ESCAPES[esc])
+                    if columns != None:
+                        columns.add(i, -1)
+                    i += 2
+
+                # end of string
+                elif char in QUOTE_CHARS:
+                    yield (Token.TYPE_STRING, i, i + 1, ''.join(str_buf))
+                    i += 1
+                    break
+
+                # newline
+                else:
+                    str_buf.append(char)
+                    i += 1
+
+        else:
+            sym = match_symbol(text, i)
+            if sym:
+                if columns != None:
+                    columns.add(i, 1)
+                yield (Token.TYPE_SYMBOL, i, i + len(sym), None)
+                i += len(sym)
+                continue
+
+            # determine if word is text or number at the start
+            is_number = char in NUMERIC_CHARS
+            m = (NUMBER_PATTERN if is_number else WORD_PATTERN).match(text, i)
+            end = i if m == None else m.end()
+
+            # the word has to be followed by a delimiter
+            if end < length and not is_delimiter(text, end):
+                if is_number:
+                    raise CompilationException.from_source(source, end, f"unexpected char {text[end]} in number")
+                else:
+                    raise CompilationException.from_source(source, end, f"unexpected char {text[end]} in keyword/identifier")
+
+            if is_number:
+                yield (Token.TYPE_NUMBER, i, end, None)
+            elif text[i:end] in KEYWORDS:
+                yield (Token.TYPE_KEYWORD, i, end, None)
             else:
-                # determine if word is text or number at the start
-                if not str_buf:
-                    is_number = char in NUMERIC_CHARS
-                    token_lineno = lineno
-                    token_linecol = linecol
-                
-                if is_number and not char in NUMERIC_CHARS:
-                    raise CompilationException(lineno, linecol, f"unexpected char {char} in number")
-                elif not is_number and not char in WORD_CHARS:
-                    raise CompilationException(lineno, linecol, f"unexpected char {char} in keyword/identifier")
-                
-                str_buf.append(char)
-
-            # special characters    
-            if char == '\n': # newline
-                line_begin = True
-                lineno += 1
-                linecol = 0
-            
-            elif char == '#': # comment
-                while char and char != '\n':
-                    char = file.read(1)
-                
-                lineno += 1
-                linecol = 0
+                yield (Token.TYPE_IDENTIFIER, i, end, None)
+
+            i = end
+
+    yield (Token.TYPE_EOF, length, length, None)
+
+# lexes the whole source into a TokenList
+def tokenize(source):
+    if not isinstance(source, SourceText):
+        source = SourceText(source)
+
+    tokens = TokenList(source)
+    for token_type, start, end, value in scan_tokens(source):
+        tokens.append(token_type, start, end, value)
     
-        tokens.append(Token(lineno, linecol, Token.TYPE_EOF, None))
-    return tokens
\ No newline at end of file
+    return tokens
+
+# lexes the source lazily, creating each Token as it is needed.
+# only the tokens the consumer is still holding on to are kept in memory.
+def iter_tokens(source):
+    if not isinstance(source, SourceText):
+        source = SourceText(source)
+
+    text = source.text
+    for token_type, start, end, value in scan_tokens(source):
+        if value == None and token_type != Token.TYPE_EOF:
+            value = text[start:end]
+        yield Token(source, start, token_type, value)
+
+def read_source(file_path):
+    with open(file_path, 'r') as f:
+        return SourceText(f.read())
+
+# decodes file contents that were already read as bytes,
+# the same way read_source would have
+def decode_source(data):
+    return SourceText(io.TextIOWrapper(io.BytesIO(data)).read())
+
+def parse_tokens(file_path):
+    return tokenize(read_source(file_path))
+
+def stream_tokens(file_path):
+    return iter_tokens(read_source(file_path))
@@ -1,22 +1,183 @@
+import concurrent.futures
+import io
 import os
 import shutil
+import subprocess
+import time
+import tracemalloc
 
-from lexer import parse_tokens, TokenQueue
+from lexer import stream_tokens, iter_tokens, tokenize, decode_source, TokenQueue
 from astgen import parse_program
-from gbgen import generate_program
+from irgen import lower_program
+from passes import optimize
+from gbgen import write_program
+from buildcache import BuildCache, stage_exports_hash, write_atomic
+from buildstats import Phase, count_ast_nodes
+import sb3gen
 
 class ProjectCompilationException(Exception):
     pass
 
-def file_ast(abspath, project_dir, output_dir, stage=None):
-    tokens = TokenQueue(parse_tokens(abspath))
+SB3_BACKENDS = ['goboscript', 'native']
+
+# builds an sb3 file from a compiled project, either by calling goboscript on
+# the output directory or with the builtin generator in sb3gen. the builtin one
+# works from the ir programs in the summary compile returned
+def build_sb3(output_dir, sb3_path, backend='goboscript', programs=None):
+    if backend == 'native':
+        sb3gen.build_sb3(programs, output_dir, sb3_path)
+        return True
+
+    proc = subprocess.run(['goboscript', 'build', '-i', output_dir, '-o', sb3_path])
+    if proc.returncode != 0:
+        print("errors occured when compiling goboscript project")
+    return proc.returncode == 0
+
+def file_ast(abspath, project_dir, output_dir, stage=None, data=None):
+    if data == None:
+        tokens = TokenQueue(stream_tokens(abspath))
+    else:
+        tokens = TokenQueue(iter_tokens(decode_source(data)))
     return parse_program(tokens, os.path.relpath(project_dir, output_dir), stage)
 
-def emit_ast(ast, sprite_name, output_dir, stage=None):
-    with open(os.path.join(output_dir, sprite_name + '.gs'), 'w') as f:
-        return generate_program(ast, f, None if stage == None else stage)
+# writes content to path, unless the file already holds exactly that content.
+# leaving unchanged files alone keeps their mtimes, so tools watching the
+# output directory don't rebuild for nothing. returns True if the file was written
+def write_if_changed(path, content):
+    data = content.encode('utf-8')
+
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+
+    write_atomic(path, data)
+    return True
+
+# generates the sprite into memory, optimized at opt_level. statistics of
+# the optimization passes are added to pass_stats if given, and what they
+# removed in total to totals.
+# returns the sprite context, the generated code and the optimized ir. the ir
+# is kept in a form the build cache can store as json
+def emit_ast(ast, stage=None, opt_level=0, pass_stats=None, totals=None):
+    gen, ir_program = lower_program(ast, None if stage == None else stage)
+    optimize(ir_program, opt_level, pass_stats, totals)
+
+    buffer = io.StringIO()
+    write_program(ir_program, buffer)
+
+    ir_program['locals'] = sorted(ir_program['locals'])
+    return gen, buffer.getvalue(), ir_program
+
+# stage variables that the sprite takes the address of, but that the
+# stage emitted as plain goboscript variables instead of memory
+def stale_stage_variables(ast, stage_gen):
+    stale = []
+    for var_name, stage_var in stage_gen.static_variables.items():
+        if var_name in ast['static_order'] or stage_var['location'] != None:
+            continue
+        if ast['variables'][var_name]['metadata']['needs_ref']:
+            stale.append(var_name)
+    return stale
+
+# absolute paths of the costumes and sounds a sprite uses
+def asset_paths(ast, output_dir):
+    return [os.path.normpath(os.path.join(output_dir, path)) for path in ast['costumes'] + ast['sounds']]
+
+# parses a file, recording into stats how long it took. with detailed stats,
+# the file is lexed up front instead of while parsing so that both can be
+# measured, and the tokens and ast nodes are counted
+def parse_file(abspath, data, project_dir, output_dir, stage, stats, detailed=False):
+    phases = stats['phases']
+
+    if not detailed:
+        with Phase(phases, 'parse'):
+            return file_ast(abspath, project_dir, output_dir, stage, data)
+
+    if data == None:
+        with open(abspath, 'rb') as f:
+            data = f.read()
+
+    with Phase(phases, 'lex'):
+        tokens = tokenize(decode_source(data))
+    stats['tokens'] = len(tokens)
+
+    with Phase(phases, 'parse'):
+        ast = parse_program(TokenQueue(tokens), os.path.relpath(project_dir, output_dir), stage)
+    stats['ast_nodes'] = count_ast_nodes(ast)
+
+    return ast
+
+# statistics of each optimization pass take time to collect, so they are
+# only kept for detailed stats. the totals of all passes are always kept
+def emit_file(ast, stage_gen, stats, opt_level=0, detailed=False):
+    stats['passes'] = {}
+    stats['optimized'] = new_pass_totals()
+    with Phase(stats['phases'], 'codegen'):
+        gen, content, ir_program = emit_ast(ast, stage_gen, opt_level, stats['passes'] if detailed else None, stats['optimized'])
+    stats['lines'] = content.count('\n')
+    return gen, content, ir_program
+
+def new_pass_totals():
+    return {'nodes_removed': 0, 'stack_ops_saved': 0}
+
+def new_file_stats(abspath, cached=False):
+    return {
+        'file': os.path.basename(abspath),
+        'cached': cached,
+        'phases': {},
+        'tokens': None,
+        'ast_nodes': None,
+        'lines': None,
+        'passes': {},
+        'optimized': new_pass_totals()
+    }
+
+# compiles a single sprite against an already generated stage.
+# returns the sprite's entry, which is what gets cached, and stats
+# on how long each phase took
+def compile_sprite(abspath, data, project_dir, output_dir, stage, stage_gen, detailed=False, opt_level=0):
+    stats = new_file_stats(abspath)
+    ast = parse_file(abspath, data, project_dir, output_dir, stage, stats, detailed)
+
+    entry = {
+        'content': None,
+        'ir': None,
+        'stale': stale_stage_variables(ast, stage_gen),
+        'assets': asset_paths(ast, output_dir)
+    }
+
+    # the sprite can't be generated against this stage
+    if entry['stale']:
+        return entry, stats
+
+    _, entry['content'], entry['ir'] = emit_file(ast, stage_gen, stats, opt_level, detailed)
+    return entry, stats
 
-def compile(project_dir, output_dir, output_file=None):
+# worker process state, set up once per process by init_worker
+worker_args = None
+
+def init_worker(project_dir, output_dir, stage, detailed, opt_level):
+    global worker_args
+
+    if detailed:
+        tracemalloc.start()
+
+    stage_gen, _, _ = emit_ast(stage, None, opt_level)
+    worker_args = (project_dir, output_dir, stage, stage_gen, detailed, opt_level)
+
+def compile_sprite_worker(sprite):
+    return compile_sprite(sprite[0], sprite[1], *worker_args)
+
+# sources maps absolute paths of .nano files to contents that should be
+# compiled instead of what is on disk, e.g. unsaved buffers in an editor
+# with detailed set, the summary also has stats for each file. memory
+# use is only measured if tracemalloc was started by the caller.
+# opt_level is one of passes.OPT_LEVELS
+def compile(project_dir, output_dir, output_file=None, jobs=1, use_cache=True, sources=None, detailed=False, opt_level=0):
     project_dir = os.path.abspath(project_dir)
     output_dir = os.path.abspath(output_dir)
 
@@ -46,23 +207,136 @@ def compile(project_dir, output_dir, output_file=None):
         raise ProjectCompilationException("no stage.nano")
     
 
-    # first, generate asts
-    targets = []
-    targets.append({
-        'ast': file_ast(os.path.join(project_dir, 'stage.nano'), project_dir, output_dir),
-        'name': 'stage'
-    })
-
-    for file_info in nano_files:
-        if file_info['filename'] == 'stage.nano': continue
-        targets.append({
-            'ast': file_ast(os.path.join(project_dir, file_info['filename']), project_dir, output_dir, targets[0]['ast']),
-            'name': file_info['extsplit'][0]
-        })
-
-    # then, emit files
-    stage_gen = None
-    for target in targets:
-        gen = emit_ast(target['ast'], target['name'], output_dir, stage_gen)
-        if target['name'] == 'stage':
-            stage_gen = gen
+    sprite_files = [x for x in nano_files if x['filename'] != 'stage.nano']
+    sprite_paths = [x['abspath'] for x in sprite_files]
+
+    # sprites are read up front, so that the cache key and the compiled
+    # output are guaranteed to come from the same contents
+    sources = sources or {}
+    sprite_data = []
+    for path in sprite_paths:
+        if path in sources:
+            sprite_data.append(sources[path])
+        else:
+            with open(path, 'rb') as f:
+                sprite_data.append(f.read())
+    
+    # output differs between optimization levels, and the asset paths in it are
+    # relative to the output directory, so both are part of the cache key
+    asset_dir = os.path.relpath(project_dir, output_dir)
+    cache = BuildCache(output_dir, salt=f"O{opt_level}\0{asset_dir}") if use_cache else None
+
+    # time spent in each phase of the build. parse and codegen are summed
+    # over all sprites, so with -j they can add up to more than the wall time
+    timings = {'stage': 0.0, 'cache': 0.0, 'parse': 0.0, 'codegen': 0.0, 'write': 0.0}
+
+    # the stage is compiled first, since every sprite needs its variables.
+    # sprites are then compiled independently of each other. if a sprite takes
+    # the address of a stage variable that the stage kept off the heap, the
+    # stage is fixed up and the sprites are compiled again
+    start = time.perf_counter()
+    stage_path = os.path.join(project_dir, 'stage.nano')
+    stage_stats = new_file_stats(stage_path)
+    stage = parse_file(stage_path, sources.get(stage_path), project_dir, output_dir, None, stage_stats, detailed)
+    timings['stage'] += time.perf_counter() - start
+
+    while True:
+        start = time.perf_counter()
+        stage_gen, stage_content, stage_ir = emit_file(stage, None, stage_stats, opt_level, detailed)
+        timings['stage'] += time.perf_counter() - start
+
+        entries = [None] * len(sprite_paths)
+        file_stats = [new_file_stats(path, cached=True) for path in sprite_paths]
+        pending = list(range(len(sprite_paths)))
+
+        # unchanged sprites compiled against the same stage exports are
+        # taken from the cache without being lexed or parsed
+        if cache:
+            start = time.perf_counter()
+            stage_hash = stage_exports_hash(stage, stage_gen)
+            keys = [cache.key(data, stage_hash) for data in sprite_data]
+            pending = []
+
+            for i, key in enumerate(keys):
+                entries[i] = cache.get(key)
+                if entries[i] == None:
+                    pending.append(i)
+            timings['cache'] += time.perf_counter() - start
+
+        cached = len(sprite_paths) - len(pending)
+        pending_sprites = [(sprite_paths[i], sprite_data[i]) for i in pending]
+
+        if jobs > 1 and len(pending_sprites) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(pending_sprites)),
+                initializer=init_worker,
+                initargs=(project_dir, output_dir, stage, detailed and tracemalloc.is_tracing(), opt_level)
+            ) as pool:
+                compiled = list(pool.map(compile_sprite_worker, pending_sprites))
+        else:
+            compiled = [compile_sprite(path, data, project_dir, output_dir, stage, stage_gen, detailed, opt_level) for path, data in pending_sprites]
+        
+        for i, (entry, stats) in zip(pending, compiled):
+            entries[i] = entry
+            file_stats[i] = stats
+            for phase_name, phase in stats['phases'].items():
+                timings['codegen' if phase_name == 'codegen' else 'parse'] += phase['time']
+            if cache:
+                cache.put(keys[i], entry)
+
+        stale = set()
+        for entry in entries:
+            stale.update(entry['stale'])
+        
+        if not stale:
+            break
+
+        for var_name in stale:
+            stage['variables'][var_name]['metadata']['needs_ref'] = True
+
+    # then, write files
+    start = time.perf_counter()
+    outputs = [('stage', stage_content)]
+    programs = [('stage', stage_ir)]
+    assets = set(asset_paths(stage, output_dir))
+    for file_info, entry in zip(sprite_files, entries):
+        outputs.append((file_info['extsplit'][0], entry['content']))
+        programs.append((file_info['extsplit'][0], entry['ir']))
+        assets.update(entry['assets'])
+
+    files_written = 0
+    for name, content in outputs:
+        if write_if_changed(os.path.join(output_dir, name + '.gs'), content):
+            files_written += 1
+    
+    if cache:
+        cache.prune()
+    timings['write'] += time.perf_counter() - start
+    
+    # what the optimization passes did, summed over every file that was compiled.
+    # passes is empty unless detailed
+    passes = {}
+    optimized = new_pass_totals()
+    for stats in [stage_stats] + file_stats:
+        for pass_name, pass_stats in stats['passes'].items():
+            total = passes.setdefault(pass_name, {'nodes_removed': 0, 'stack_ops_saved': 0, 'time': 0})
+            for key in total:
+                total[key] += pass_stats[key]
+        for key in optimized:
+            optimized[key] += stats['optimized'][key]
+
+    summary = {
+        'files': len(outputs),
+        'files_written': files_written,
+        'cached': cached,
+        'assets': sorted(assets),
+        'timings': timings,
+        'passes': passes,
+        'optimized': optimized,
+        'programs': programs
+    }
+
+    if detailed:
+        summary['file_stats'] = [stage_stats] + file_stats
+    
+    return summary
@@ -0,0 +1,104 @@
+# optimization passes over the ir (see ir.py)
+#
+# each pass rewrites an ir program in place. a pass runs at its optimization
+# level and above, in the order of PASSES:
+#   -O0  no passes, the ir is printed as irgen lowered it
+#   -O1  cheap local passes
+#   -O2  everything
+#
+# optimize records for every pass that ran how many ir nodes and stack ops
+# (see ir.program_stats) it removed, and how long it took.
+
+import time
+
+import ir
+from constfold import const_fold_pass
+from dce import dead_code_pass, unused_functions_pass
+from inline import inline_pass
+from framebase import frame_base_pass
+
+OPT_LEVELS = [0, 1, 2]
+
+class Pass:
+    def __init__(self, name, level, run):
+        self.name = name
+        self.level = level
+        self.run = run
+
+# == STACK ADJUST ==
+# pushes, pops, argument cleanup and frame exits each move the stack head on
+# their own, so lowered code is full of runs like "pop 2; pop 1" or
+# "pop 1; push". adjacent adjustments are merged into one and adjustments
+# that cancel out are dropped. comments in between don't count.
+
+def merge_stack_adjusts(statements):
+    out = []
+    pending = None # index in out of the last stack_adjust, if nothing but comments followed it
+
+    for stmt in statements:
+        if stmt[0] == 'stack_adjust':
+            if pending != None:
+                out[pending] = ('stack_adjust', out[pending][1] + stmt[1])
+                continue
+            pending = len(out)
+        elif stmt[0] != 'comment':
+            pending = None
+
+        out.append(stmt)
+
+    return [stmt for stmt in out if not (stmt[0] == 'stack_adjust' and stmt[1] == 0)]
+
+def stack_adjust_pass(program):
+    ir.map_program_blocks(program, merge_stack_adjusts)
+
+PASSES = [
+    Pass('const-fold', 1, const_fold_pass),
+    Pass('dead-code', 1, dead_code_pass),
+    Pass('unused-functions', 1, unused_functions_pass),
+    Pass('inline', 2, inline_pass),
+    Pass('unused-functions', 2, unused_functions_pass),
+    # removing dead code and inlining leave more locals that are only set once
+    Pass('const-fold', 2, const_fold_pass),
+    Pass('dead-code', 2, dead_code_pass),
+    Pass('stack-adjust', 1, stack_adjust_pass),
+    Pass('frame-base', 1, frame_base_pass),
+]
+
+# runs the passes of opt_level on program. if stats is given, the statistics of
+# each pass are added to stats[pass name], summing over repeated calls. if
+# totals is given, what the passes removed together is added to it, which only
+# needs the ir counted before and after them
+def optimize(program, opt_level, stats=None, totals=None):
+    nodes = None
+
+    if totals != None:
+        total_nodes, total_stack_ops = ir.program_stats(program)
+
+    for opt_pass in PASSES:
+        if opt_pass.level > opt_level:
+            continue
+
+        if stats == None:
+            opt_pass.run(program)
+            continue
+
+        if nodes == None:
+            nodes, stack_ops = ir.program_stats(program)
+
+        start = time.perf_counter()
+        opt_pass.run(program)
+        elapsed = time.perf_counter() - start
+        new_nodes, new_stack_ops = ir.program_stats(program)
+
+        pass_stats = stats.setdefault(opt_pass.name, {'nodes_removed': 0, 'stack_ops_saved': 0, 'time': 0})
+        pass_stats['nodes_removed'] += nodes - new_nodes
+        pass_stats['stack_ops_saved'] += stack_ops - new_stack_ops
+        pass_stats['time'] += elapsed
+        nodes, stack_ops = new_nodes, new_stack_ops
+
+    if totals != None:
+        new_nodes, new_stack_ops = ir.program_stats(program)
+        totals['nodes_removed'] += total_nodes - new_nodes
+        totals['stack_ops_saved'] += total_stack_ops - new_stack_ops
+
+    return program
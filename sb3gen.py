@@ -0,0 +1,1188 @@
+#!/usr/bin/env python3
+# Scratch 3 generator
+# builds an .sb3 directly from the ir programs of a compiled project,
+# without calling goboscript.
+#
+# the ir of every sprite (see ir.py) is lowered to a small tree, which is then
+# lowered to the blocks of a project.json. the runtime's procedures only exist
+# as the goboscript gbgen prints for them, so that text is parsed into the
+# same tree. only the subset of goboscript the runtime uses is understood;
+# anything else is an internal error.
+#
+# like goboscript, variables and lists used by the stage are global, and sprites
+# using a variable of the same name refer to the stage's. everything else a
+# sprite uses is local to that sprite.
+#
+# usage: python sb3gen.py <project dir> <output.sb3> [-O level] [--json path]
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import struct
+import wave
+import zipfile
+
+from buildcache import write_atomic
+import gbgen
+import scratchvalues
+
+# whitespace between tokens is skipped by finditer, comments match without a group
+TOKEN_REGEX = re.compile(r'''
+    \#[^\n]*
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<name>\$?[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<symbol>\+=|-=|==|!=|<=|>=|[{}()\[\];,=<>+\-*/%&])
+  | (?P<error>\S)
+''', re.VERBOSE)
+
+STRING_ESCAPES = {'"': '"', 'n': '\n', 't': '\t', 'r': '\r', '\\': '\\'}
+
+# binary operators, from loosest to tightest binding
+BINARY_OPERATORS = [
+    ['or'],
+    ['and'],
+    ['==', '!=', '<', '>', '<=', '>='],
+    ['&'],
+    ['+', '-'],
+    ['*', '/', '%'],
+]
+BINARY_PRECEDENCE = {op: level for level, ops in enumerate(BINARY_OPERATORS) for op in ops}
+
+HATS = ['onflag', 'on', 'onkey', 'onclick', 'onbackdrop', 'onloudness', 'ontimer', 'onclone']
+
+# reporters that goboscript writes without parentheses
+BARE_REPORTERS = ['costume_name', 'costume_number', 'timer']
+
+# primitive types of the shadow blocks behind inputs
+MATH_NUMBER = 4
+WHOLE_NUMBER = 6
+INTEGER = 7
+TEXT = 10
+VARIABLE = 12
+
+# builtin statements: name -> (opcode, [(input name, shadow type)])
+STATEMENT_BLOCKS = {
+    'move': ('motion_movesteps', [('STEPS', MATH_NUMBER)]),
+    'turn_right': ('motion_turnright', [('DEGREES', MATH_NUMBER)]),
+    'turn_left': ('motion_turnleft', [('DEGREES', MATH_NUMBER)]),
+    'goto': ('motion_gotoxy', [('X', MATH_NUMBER), ('Y', MATH_NUMBER)]),
+    'point_in_direction': ('motion_pointindirection', [('DIRECTION', MATH_NUMBER)]),
+    'set_x': ('motion_setx', [('X', MATH_NUMBER)]),
+    'set_y': ('motion_sety', [('Y', MATH_NUMBER)]),
+    'change_x': ('motion_changexby', [('DX', MATH_NUMBER)]),
+    'change_y': ('motion_changeyby', [('DY', MATH_NUMBER)]),
+    'if_on_edge_bounce': ('motion_ifonedgebounce', []),
+    'next_costume': ('looks_nextcostume', []),
+    'set_size': ('looks_setsizeto', [('SIZE', MATH_NUMBER)]),
+    'change_size': ('looks_changesizeby', [('CHANGE', MATH_NUMBER)]),
+    'show': ('looks_show', []),
+    'hide': ('looks_hide', []),
+    'wait': ('control_wait', [('DURATION', MATH_NUMBER)]),
+    'ask': ('sensing_askandwait', [('QUESTION', TEXT)]),
+    'reset_timer': ('sensing_resettimer', []),
+    'delete_this_clone': ('control_delete_this_clone', []),
+}
+
+# say and think take an optional duration
+TIMED_STATEMENT_BLOCKS = {
+    'say': ('looks_say', 'looks_sayforsecs'),
+    'think': ('looks_think', 'looks_thinkforsecs'),
+}
+
+# builtin reporters: name -> (opcode, [(input name, shadow type)])
+REPORTER_BLOCKS = {
+    'x_position': ('motion_xposition', []),
+    'y_position': ('motion_yposition', []),
+    'direction': ('motion_direction', []),
+    'size': ('looks_size', []),
+    'answer': ('sensing_answer', []),
+    'mouse_down': ('sensing_mousedown', []),
+    'mouse_x': ('sensing_mousex', []),
+    'mouse_y': ('sensing_mousey', []),
+    'timer': ('sensing_timer', []),
+    'random': ('operator_random', [('FROM', MATH_NUMBER), ('TO', MATH_NUMBER)]),
+}
+
+# binary operator -> (opcode, input names, shadow type)
+OPERATOR_BLOCKS = {
+    '+': ('operator_add', ('NUM1', 'NUM2'), MATH_NUMBER),
+    '-': ('operator_subtract', ('NUM1', 'NUM2'), MATH_NUMBER),
+    '*': ('operator_multiply', ('NUM1', 'NUM2'), MATH_NUMBER),
+    '/': ('operator_divide', ('NUM1', 'NUM2'), MATH_NUMBER),
+    '%': ('operator_mod', ('NUM1', 'NUM2'), MATH_NUMBER),
+    '&': ('operator_join', ('STRING1', 'STRING2'), TEXT),
+    '==': ('operator_equals', ('OPERAND1', 'OPERAND2'), TEXT),
+    '<': ('operator_lt', ('OPERAND1', 'OPERAND2'), TEXT),
+    '>': ('operator_gt', ('OPERAND1', 'OPERAND2'), TEXT),
+}
+
+# comparisons scratch doesn't have, as the negation of one it does have
+NEGATED_OPERATORS = {
+    '!=': '==',
+    '<=': '>',
+    '>=': '<',
+}
+
+META = {'semver': '3.0.0', 'vm': '0.2.0', 'agent': 'nanolang'}
+
+def parse_string(text):
+    out = []
+    i = 1
+    while i < len(text) - 1:
+        c = text[i]
+        if c == '\\':
+            i += 1
+            out.append(STRING_ESCAPES.get(text[i], '\\' + text[i]))
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out)
+
+def line_of(text, pos):
+    return text.count('\n', 0, pos) + 1
+
+# goboscript stores number literals as numbers, so "2.0" reaches scratch as 2
+def number_literal(text):
+    number = scratchvalues.js_number(text)
+    if number == None or math.isnan(number):
+        return text
+    return scratchvalues.js_string(number)
+
+# tokens are (kind, value, position in text)
+def gs_tokens(text):
+    tokens = []
+
+    for match in TOKEN_REGEX.finditer(text):
+        kind = match.lastgroup
+        if kind == 'string':
+            tokens.append((kind, parse_string(match.group()), match.start()))
+        elif kind == 'error':
+            raise Exception(f"internal: unexpected character {match.group()!r} in goboscript on line {line_of(text, match.start())}")
+        elif kind != None:
+            tokens.append((kind, match.group(), match.start()))
+
+    return tokens
+
+# parses goboscript, the runtime's, into
+#   {'costumes': [path], 'sounds': [path],
+#    'procs': {name: {'params', 'warp', 'body'}}, 'scripts': [{'hat', 'arg', 'body'}]}
+#
+# statements are tuples: ('set', var, expr), ('change', var, expr),
+# ('list_set', list, index, expr), ('list_add', list, expr), ('list_clear', list),
+# ('if', cond, body, else_body), ('repeat', expr, body), ('until', cond, body),
+# ('forever', body), ('command', name, [args])
+#
+# expressions are tuples as well: ('num', text), ('str', text), ('var', name),
+# ('arg', name), ('item', list, index), ('length', list), ('binop', op, a, b),
+# ('neg', expr), ('not', expr), ('call', name, [args])
+class GsParser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = gs_tokens(text)
+        self.pos = 0
+        self.locals = {}
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset][1]
+        return None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise Exception("internal: unexpected end of goboscript")
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def accept(self, value):
+        if self.peek() == value and self.tokens[self.pos][0] != 'string':
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value):
+        kind, tok_value, pos = self.next()
+        if tok_value != value or kind == 'string':
+            raise Exception(f"internal: expected {value} in goboscript on line {line_of(self.text, pos)}, got {tok_value!r}")
+
+    def expect_kind(self, kind):
+        tok_kind, value, pos = self.next()
+        if tok_kind != kind:
+            raise Exception(f"internal: expected {kind} in goboscript on line {line_of(self.text, pos)}, got {value!r}")
+        return value
+
+    def program(self):
+        program = {'costumes': [], 'sounds': [], 'procs': {}, 'scripts': []}
+
+        while self.pos < len(self.tokens):
+            kind, value, pos = self.next()
+
+            if value == 'costumes' or value == 'sounds':
+                program[value].append(self.expect_kind('string'))
+                while self.accept(','):
+                    program[value].append(self.expect_kind('string'))
+                self.expect(';')
+
+            elif value == 'proc' or value == 'nowarp':
+                warp = value == 'proc'
+                if not warp:
+                    self.expect('proc')
+
+                name = self.expect_kind('name')
+                params = []
+                if self.peek() != '{':
+                    params.append(self.expect_kind('name'))
+                    while self.accept(','):
+                        params.append(self.expect_kind('name'))
+
+                self.locals = {}
+                program['procs'][name] = {
+                    'params': params,
+                    'warp': warp,
+                    'body': self.block(name)
+                }
+
+            elif value in HATS:
+                arg = None
+                if value in ('on', 'onkey', 'onbackdrop'):
+                    arg = self.expect_kind('string')
+                elif value in ('onloudness', 'ontimer'):
+                    arg = self.expression()
+
+                self.locals = {}
+                program['scripts'].append({
+                    'hat': value,
+                    'arg': arg,
+                    'body': self.block(None)
+                })
+
+            else:
+                raise Exception(f"internal: unexpected {value!r} in goboscript on line {line_of(self.text, pos)}")
+
+        return program
+
+    def block(self, proc_name):
+        self.expect('{')
+        statements = []
+        while not self.accept('}'):
+            statements.append(self.statement(proc_name))
+        return statements
+
+    def statement(self, proc_name):
+        kind, value, pos = self.next()
+
+        if kind != 'name':
+            raise Exception(f"internal: unexpected {value!r} in goboscript on line {line_of(self.text, pos)}")
+
+        if value == 'if':
+            return self.if_statement(proc_name)
+
+        if value == 'repeat':
+            count = self.expression()
+            return ('repeat', count, self.block(proc_name))
+
+        if value == 'until':
+            cond = self.expression()
+            return ('until', cond, self.block(proc_name))
+
+        if value == 'forever':
+            return ('forever', self.block(proc_name))
+
+        if value == 'local':
+            name = self.expect_kind('name')
+            self.locals[name] = f"{proc_name}.{name}"
+            self.expect('=')
+            expr = self.expression()
+            self.expect(';')
+            return ('set', self.locals[name], expr)
+
+        if value == 'delete' and self.peek() != ';':
+            list_name = self.expect_kind('name')
+            self.expect(';')
+            return ('list_clear', list_name)
+
+        if value == 'add':
+            expr = self.expression()
+            self.expect('to')
+            list_name = self.expect_kind('name')
+            self.expect(';')
+            return ('list_add', list_name, expr)
+
+        if self.accept('['):
+            index = self.expression()
+            self.expect(']')
+            self.expect('=')
+            expr = self.expression()
+            self.expect(';')
+            return ('list_set', value, index, expr)
+
+        for op in ('=', '+=', '-='):
+            if self.accept(op):
+                name = self.locals.get(value, value)
+                expr = self.expression()
+                self.expect(';')
+
+                if op == '=':
+                    return ('set', name, expr)
+                if op == '-=':
+                    expr = ('neg', expr)
+                return ('change', name, expr)
+
+        # a builtin statement or a procedure call
+        args = []
+        if self.peek() == '(' and self.peek(1) == ')':
+            self.pos += 2
+        elif self.peek() != ';':
+            args.append(self.expression())
+            while self.accept(','):
+                args.append(self.expression())
+        self.expect(';')
+
+        return ('command', value, args)
+
+    def if_statement(self, proc_name):
+        cond = self.expression()
+        body = self.block(proc_name)
+        else_body = None
+
+        if self.accept('elif'):
+            else_body = [self.if_statement(proc_name)]
+        elif self.accept('else'):
+            else_body = self.block(proc_name)
+
+        return ('if', cond, body, else_body)
+
+    def expression(self, min_precedence=0):
+        left = self.unary()
+
+        while self.pos < len(self.tokens):
+            kind, op, _ = self.tokens[self.pos]
+            precedence = BINARY_PRECEDENCE.get(op)
+            if kind == 'string' or precedence == None or precedence < min_precedence:
+                break
+
+            self.pos += 1
+            right = self.expression(precedence + 1)
+            left = ('binop', op, left, right)
+
+        return left
+
+    def unary(self):
+        if self.accept('-'):
+            if self.tokens[self.pos][0] == 'number':
+                return ('num', number_literal('-' + self.next()[1]))
+            return ('neg', self.unary())
+
+        if self.accept('not'):
+            return ('not', self.unary())
+
+        return self.primary()
+
+    def primary(self):
+        kind, value, pos = self.next()
+
+        if kind == 'number':
+            return ('num', number_literal(value))
+
+        if kind == 'string':
+            return ('str', value)
+
+        if value == '(':
+            expr = self.expression()
+            self.expect(')')
+            return expr
+
+        if kind != 'name':
+            raise Exception(f"internal: unexpected {value!r} in goboscript expression on line {line_of(self.text, pos)}")
+
+        if value[0] == '$':
+            return ('arg', value[1:])
+
+        if value == 'length':
+            return ('length', self.expect_kind('name'))
+
+        if self.accept('['):
+            index = self.expression()
+            self.expect(']')
+            return ('item', value, index)
+
+        if self.accept('('):
+            args = []
+            if not self.accept(')'):
+                args.append(self.expression())
+                while self.accept(','):
+                    args.append(self.expression())
+                self.expect(')')
+            return ('call', value, args)
+
+        if value in BARE_REPORTERS:
+            return ('call', value, [])
+
+        return ('var', self.locals.get(value, value))
+
+# builtins -> the goboscript command gbgen prints for them, see builtin_methods
+BUILTIN_COMMANDS = {
+    'move_steps': 'move',
+    'turn_cw': 'turn_right',
+    'turn_ccw': 'turn_left',
+    'goto_xy': 'goto',
+    'point_in_direction': 'point_in_direction',
+    'set_x': 'set_x',
+    'set_y': 'set_y',
+    'change_x': 'change_x',
+    'change_y': 'change_y',
+    'bounce_on_edge': 'if_on_edge_bounce',
+    'say_wait': 'say',
+    'say': 'say',
+    'think_wait': 'think',
+    'think': 'think',
+    'set_costume_name': 'switch_costume',
+    'set_costume_number': 'switch_costume',
+    'next_costume': 'next_costume',
+    'set_size': 'set_size',
+    'change_size': 'change_size',
+    'show': 'show',
+    'hide': 'hide',
+    'wait': 'wait',
+    'create_clone': 'clone',
+    'create_clone_of': 'clone',
+    'ask': 'ask',
+    'reset_timer': 'reset_timer',
+    'malloc': 'nano_malloc',
+    'free': 'nano_free',
+}
+
+# builtins -> the goboscript reporter gbgen prints for them
+BUILTIN_REPORTERS = {
+    'get_x': 'x_position',
+    'get_y': 'y_position',
+    'get_direction': 'direction',
+    'get_costume_name': 'costume_name',
+    'get_costume_number': 'costume_number',
+    'get_size': 'size',
+    'last_answer': 'answer',
+    'key_pressed': 'key_pressed',
+    'mouse_down': 'mouse_down',
+    'mouse_x': 'mouse_x',
+    'mouse_y': 'mouse_y',
+    'timer': 'timer',
+    'random': 'random',
+}
+
+# reporters of booleans, which gbgen adds 0 to so that they are numbers
+BOOLEAN_BUILTINS = ['key_pressed', 'mouse_down']
+
+# where builtin statements leave their result
+BUILTIN_RETURNS = {
+    'ask': ('call', 'answer', []),
+    'malloc': ('var', 'nano_malloc_return'),
+}
+
+# event -> hat of the script that starts its procedure, see gbgen.event_hat
+EVENT_HATS = {
+    'flag': 'on',
+    'keypressed': 'onkey',
+    'clicked': 'onclick',
+    'backdrop_switched': 'onbackdrop',
+    'loudness_exceeds': 'onloudness',
+    'timer_exceeds': 'ontimer',
+    'broadcast': 'on',
+    'cloned': 'onclone',
+}
+
+STACK_ID = ('arg', 'stack_id')
+FRAME_BASE = ('item', 'memory', ('item', 'stack_ptrs', STACK_ID))
+STACK_HEAD = ('item', 'stack_heads', STACK_ID)
+
+def literal(value):
+    if isinstance(value, str):
+        return ('str', value)
+    return ('num', number_literal(gbgen.gs_literal(value)))
+
+def stack_cell(depth):
+    if depth == 0:
+        return STACK_HEAD
+    return ('binop', '-', STACK_HEAD, literal(depth))
+
+# lowers the ir of one program to the tree GsParser produces, the same one
+# parsing what gbgen prints for it would give. the ir may have been through
+# json, which leaves lists where it had tuples
+class IrLowering:
+    def __init__(self):
+        self.locals = {} # procedure local -> the variable it is kept in
+
+    def expression(self, expr):
+        op = expr[0]
+
+        if op == 'const':
+            return literal(expr[1])
+        if op == 'var':
+            return ('var', self.locals.get(expr[1], expr[1]))
+        if op == 'param':
+            return ('arg', expr[1])
+        if op == 'load':
+            return ('item', 'memory', self.expression(expr[1]))
+        if op == 'binop':
+            return ('binop', expr[1], self.expression(expr[2]), self.expression(expr[3]))
+        if op == 'neg':
+            return ('neg', self.expression(expr[1]))
+        if op == 'frame_base':
+            return FRAME_BASE
+        if op == 'frame_addr':
+            return ('binop', '+', FRAME_BASE, literal(expr[1]))
+        if op == 'frame_slot':
+            return ('item', 'memory', ('binop', '+', FRAME_BASE, literal(expr[1])))
+        if op == 'stack_head':
+            return STACK_HEAD
+        if op == 'stack_read':
+            return ('item', 'memory', stack_cell(expr[1]))
+        if op == 'stack_ptr':
+            return ('item', 'stack_ptrs', STACK_ID)
+
+        if op == 'builtin_value':
+            name = expr[1]
+            if name not in BUILTIN_REPORTERS:
+                raise Exception(f"internal: no reporter for builtin {name}")
+
+            value = ('call', BUILTIN_REPORTERS[name], [self.expression(arg) for arg in expr[2]])
+            if name in BOOLEAN_BUILTINS:
+                return ('binop', '+', value, ('num', "0"))
+            return value
+
+        if op == 'builtin_return':
+            if expr[1] not in BUILTIN_RETURNS:
+                raise Exception(f"internal: builtin {expr[1]} doesn't return anything")
+            return BUILTIN_RETURNS[expr[1]]
+
+        raise Exception(f"internal: unknown ir expression {op}")
+
+    def block(self, statements, proc_name):
+        return [self.statement(stmt, proc_name) for stmt in statements if stmt[0] != 'comment']
+
+    def statement(self, stmt, proc_name):
+        op = stmt[0]
+
+        if op == 'set':
+            return ('set', self.locals.get(stmt[1], stmt[1]), self.expression(stmt[2]))
+        if op == 'local':
+            self.locals[stmt[1]] = f"{proc_name}.{stmt[1]}"
+            return ('set', self.locals[stmt[1]], self.expression(stmt[2]))
+        if op == 'change':
+            return ('change', self.locals.get(stmt[1], stmt[1]), self.expression(stmt[2]))
+        if op == 'store':
+            return ('list_set', 'memory', self.expression(stmt[1]), self.expression(stmt[2]))
+        if op == 'frame_store':
+            return ('list_set', 'memory', ('binop', '+', FRAME_BASE, literal(stmt[1])), self.expression(stmt[2]))
+        if op == 'stack_store':
+            return ('list_set', 'memory', stack_cell(stmt[1]), self.expression(stmt[2]))
+        if op == 'stack_adjust':
+            delta = stmt[1]
+            if delta > 0:
+                return ('list_set', 'stack_heads', STACK_ID, ('binop', '+', STACK_HEAD, literal(delta)))
+            return ('list_set', 'stack_heads', STACK_ID, ('binop', '-', STACK_HEAD, literal(-delta)))
+        if op == 'set_frame_base':
+            return ('list_set', 'memory', ('item', 'stack_ptrs', STACK_ID), self.expression(stmt[1]))
+        if op == 'set_stack_ptr':
+            return ('list_set', 'stack_ptrs', STACK_ID, self.expression(stmt[1]))
+        if op == 'call':
+            return ('command', stmt[1], [self.expression(arg) for arg in stmt[2]])
+
+        if op == 'builtin':
+            if stmt[1] not in BUILTIN_COMMANDS:
+                raise Exception(f"internal: no command for builtin {stmt[1]}")
+            return ('command', BUILTIN_COMMANDS[stmt[1]], [self.expression(arg) for arg in stmt[2]])
+
+        if op == 'if':
+            else_body = None if stmt[3] == None else self.block(stmt[3], proc_name)
+            return ('if', self.expression(stmt[1]), self.block(stmt[2], proc_name), else_body)
+        if op == 'until':
+            return ('until', self.expression(stmt[1]), self.block(stmt[2], proc_name))
+        if op == 'repeat':
+            return ('repeat', self.expression(stmt[1]), self.block(stmt[2], proc_name))
+        if op == 'forever':
+            return ('forever', self.block(stmt[1], proc_name))
+        if op == 'delete_clone':
+            return ('command', 'delete_this_clone', [])
+
+        raise Exception(f"internal: unknown ir statement {op}")
+
+    # the tree of a whole program, runtime included, in the order gbgen prints it
+    def program(self, ir_program):
+        runtime = (gbgen.stage_boilerplate if ir_program['is_stage'] else "") + gbgen.program_boilerplate
+        program = GsParser(runtime).program()
+
+        program['costumes'] = list(ir_program['costumes'])
+        program['sounds'] = list(ir_program['sounds'])
+        program['scripts'].append({
+            'hat': 'on',
+            'arg': "nanoinit",
+            'body': self.block(ir_program['static_init'], None)
+        })
+
+        for proc in ir_program['procs']:
+            self.locals = {}
+            program['procs'][proc['name']] = {
+                'params': ['stack_id'] + list(proc['params']),
+                'warp': proc['warp'],
+                'body': self.block(proc['body'], proc['name'])
+            }
+
+            if proc['event'] != None:
+                event_name, event_param = proc['event']
+                hat = EVENT_HATS[event_name]
+                arg = None
+                if event_name == 'flag':
+                    arg = "nanostart"
+                elif hat in ('on', 'onkey', 'onbackdrop'):
+                    arg = event_param
+                elif hat in ('onloudness', 'ontimer'):
+                    arg = literal(event_param)
+
+                program['scripts'].append({
+                    'hat': hat,
+                    'arg': arg,
+                    'body': [('command', 'nano_alloc_stack', []), ('command', proc['name'], [('var', 'init_stack_ret')])]
+                })
+
+        self.locals = {}
+        return program
+
+# ids of blocks, variables and broadcasts, unique within the project
+class IdGenerator:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return "n" + format(self.count, 'x')
+
+# lowers one parsed goboscript file to a scratch target
+class TargetBuilder:
+    def __init__(self, name, program, new_id, stage=None, broadcasts=None):
+        self.name = name
+        self.program = program
+        self.new_id = new_id
+        self.stage = stage
+        self.is_stage = stage == None
+        self.broadcasts = {} if broadcasts == None else broadcasts # shared with the stage
+
+        self.blocks = {}
+        self.variables = {} # name -> id
+        self.lists = {} # name -> id
+        self.procs = {} # name -> (proccode, argument ids, warp)
+        self.script_y = 0
+
+        for proc_name, proc in program['procs'].items():
+            proccode = " ".join([proc_name] + ["%s"] * len(proc['params']))
+            arg_ids = [self.new_id() for _ in proc['params']]
+            self.procs[proc_name] = (proccode, arg_ids, proc['warp'])
+
+    def variable(self, name):
+        if self.stage != None and name in self.stage.variables:
+            return [name, self.stage.variables[name]]
+        if name not in self.variables:
+            self.variables[name] = self.new_id()
+        return [name, self.variables[name]]
+
+    def list(self, name):
+        if self.stage != None and name in self.stage.lists:
+            return [name, self.stage.lists[name]]
+        if name not in self.lists:
+            self.lists[name] = self.new_id()
+        return [name, self.lists[name]]
+
+    def broadcast(self, name):
+        if name not in self.broadcasts:
+            self.broadcasts[name] = self.new_id()
+        return [name, self.broadcasts[name]]
+
+    def add_block(self, opcode, parent, fields=None, shadow=False, mutation=None):
+        block_id = self.new_id()
+        block = {
+            'opcode': opcode,
+            'next': None,
+            'parent': parent,
+            'inputs': {},
+            'fields': fields or {},
+            'shadow': shadow,
+            'topLevel': parent == None
+        }
+        if parent == None:
+            block['x'] = 0
+            block['y'] = self.script_y
+        if mutation != None:
+            block['mutation'] = mutation
+
+        self.blocks[block_id] = block
+        return block_id
+
+    # an input holding a value. literals and variables are stored inline,
+    # anything else is a reporter block covering a shadow of the given type
+    def input(self, expr, parent, shadow_type):
+        if expr[0] == 'num' or expr[0] == 'str':
+            return [1, [shadow_type, expr[1]]]
+        if expr[0] == 'var':
+            return [3, [VARIABLE] + self.variable(expr[1]), [shadow_type, ""]]
+        return [3, self.reporter(expr, parent), [shadow_type, ""]]
+
+    # an input of a boolean slot. the operands of and/or can be plain values,
+    # which scratch casts to booleans when the block runs
+    def condition(self, expr, parent):
+        if expr[0] == 'num' or expr[0] == 'str':
+            return [2, [TEXT, expr[1]]]
+        if expr[0] == 'var':
+            return [2, [VARIABLE] + self.variable(expr[1])]
+        return [2, self.reporter(expr, parent)]
+
+    # an input of a dropdown menu, like a costume or a key
+    def menu_input(self, expr, parent, opcode, field, default):
+        if expr != None and expr[0] in ('num', 'str'):
+            return [1, self.add_block(opcode, parent, {field: [expr[1], None]}, shadow=True)]
+
+        menu_id = self.add_block(opcode, parent, {field: [default, None]}, shadow=True)
+        if expr == None:
+            return [1, menu_id]
+        return [3, self.reporter(expr, parent) if expr[0] != 'var' else [VARIABLE] + self.variable(expr[1]), menu_id]
+
+    def reporter(self, expr, parent):
+        kind = expr[0]
+
+        if kind == 'arg':
+            return self.add_block('argument_reporter_string_number', parent, {'VALUE': [expr[1], None]})
+
+        if kind == 'item':
+            block_id = self.add_block('data_itemoflist', parent, {'LIST': self.list(expr[1])})
+            self.blocks[block_id]['inputs']['INDEX'] = self.input(expr[2], block_id, INTEGER)
+            return block_id
+
+        if kind == 'length':
+            return self.add_block('data_lengthoflist', parent, {'LIST': self.list(expr[1])})
+
+        if kind == 'neg':
+            block_id = self.add_block('operator_subtract', parent)
+            self.blocks[block_id]['inputs']['NUM1'] = [1, [MATH_NUMBER, "0"]]
+            self.blocks[block_id]['inputs']['NUM2'] = self.input(expr[1], block_id, MATH_NUMBER)
+            return block_id
+
+        if kind == 'not':
+            block_id = self.add_block('operator_not', parent)
+            self.blocks[block_id]['inputs']['OPERAND'] = self.condition(expr[1], block_id)
+            return block_id
+
+        if kind == 'binop':
+            op = expr[1]
+
+            if op in NEGATED_OPERATORS:
+                return self.reporter(('not', ('binop', NEGATED_OPERATORS[op], expr[2], expr[3])), parent)
+
+            if op == 'and' or op == 'or':
+                block_id = self.add_block('operator_' + op, parent)
+                self.blocks[block_id]['inputs']['OPERAND1'] = self.condition(expr[2], block_id)
+                self.blocks[block_id]['inputs']['OPERAND2'] = self.condition(expr[3], block_id)
+                return block_id
+
+            opcode, input_names, shadow_type = OPERATOR_BLOCKS[op]
+            block_id = self.add_block(opcode, parent)
+            self.blocks[block_id]['inputs'][input_names[0]] = self.input(expr[2], block_id, shadow_type)
+            self.blocks[block_id]['inputs'][input_names[1]] = self.input(expr[3], block_id, shadow_type)
+            return block_id
+
+        if kind == 'call':
+            name, args = expr[1], expr[2]
+
+            if name == 'key_pressed':
+                block_id = self.add_block('sensing_keypressed', parent)
+                self.blocks[block_id]['inputs']['KEY_OPTION'] = self.menu_input(args[0], block_id, 'sensing_keyoptions', 'KEY_OPTION', "space")
+                return block_id
+
+            if name == 'costume_name' or name == 'costume_number':
+                opcode = 'looks_backdropnumbername' if self.is_stage else 'looks_costumenumbername'
+                return self.add_block(opcode, parent, {'NUMBER_NAME': [name[len('costume_'):], None]})
+
+            if name in REPORTER_BLOCKS:
+                opcode, inputs = REPORTER_BLOCKS[name]
+                return self.add_inputs(self.add_block(opcode, parent), inputs, args)
+
+        raise Exception(f"internal: can't lower goboscript expression {expr!r}")
+
+    def add_inputs(self, block_id, inputs, args):
+        if len(args) != len(inputs):
+            raise Exception(f"internal: {self.blocks[block_id]['opcode']} expects {len(inputs)} arguments, got {len(args)}")
+
+        for (input_name, shadow_type), arg in zip(inputs, args):
+            self.blocks[block_id]['inputs'][input_name] = self.input(arg, block_id, shadow_type)
+        return block_id
+
+    # lowers a list of statements, returning the id of the first block
+    def stack(self, statements, parent):
+        first = None
+        prev = None
+
+        for statement in statements:
+            block_id = self.statement(statement, parent if prev == None else prev)
+            if prev == None:
+                first = block_id
+            else:
+                self.blocks[prev]['next'] = block_id
+            prev = block_id
+
+        return first
+
+    def substack(self, block_id, input_name, statements):
+        first = self.stack(statements, block_id)
+        if first != None:
+            self.blocks[block_id]['inputs'][input_name] = [2, first]
+
+    def statement(self, statement, parent):
+        kind = statement[0]
+
+        if kind == 'set' or kind == 'change':
+            opcode = 'data_setvariableto' if kind == 'set' else 'data_changevariableby'
+            block_id = self.add_block(opcode, parent, {'VARIABLE': self.variable(statement[1])})
+            self.blocks[block_id]['inputs']['VALUE'] = self.input(statement[2], block_id, TEXT if kind == 'set' else MATH_NUMBER)
+            return block_id
+
+        if kind == 'list_set':
+            block_id = self.add_block('data_replaceitemoflist', parent, {'LIST': self.list(statement[1])})
+            self.blocks[block_id]['inputs']['INDEX'] = self.input(statement[2], block_id, INTEGER)
+            self.blocks[block_id]['inputs']['ITEM'] = self.input(statement[3], block_id, TEXT)
+            return block_id
+
+        if kind == 'list_add':
+            block_id = self.add_block('data_addtolist', parent, {'LIST': self.list(statement[1])})
+            self.blocks[block_id]['inputs']['ITEM'] = self.input(statement[2], block_id, TEXT)
+            return block_id
+
+        if kind == 'list_clear':
+            return self.add_block('data_deletealloflist', parent, {'LIST': self.list(statement[1])})
+
+        if kind == 'if':
+            block_id = self.add_block('control_if' if statement[3] == None else 'control_if_else', parent)
+            self.blocks[block_id]['inputs']['CONDITION'] = self.condition(statement[1], block_id)
+            self.substack(block_id, 'SUBSTACK', statement[2])
+            if statement[3] != None:
+                self.substack(block_id, 'SUBSTACK2', statement[3])
+            return block_id
+
+        if kind == 'repeat':
+            block_id = self.add_block('control_repeat', parent)
+            self.blocks[block_id]['inputs']['TIMES'] = self.input(statement[1], block_id, WHOLE_NUMBER)
+            self.substack(block_id, 'SUBSTACK', statement[2])
+            return block_id
+
+        if kind == 'until':
+            block_id = self.add_block('control_repeat_until', parent)
+            self.blocks[block_id]['inputs']['CONDITION'] = self.condition(statement[1], block_id)
+            self.substack(block_id, 'SUBSTACK', statement[2])
+            return block_id
+
+        if kind == 'forever':
+            block_id = self.add_block('control_forever', parent)
+            self.substack(block_id, 'SUBSTACK', statement[1])
+            return block_id
+
+        if kind == 'command':
+            return self.command(statement[1], statement[2], parent)
+
+        raise Exception(f"internal: can't lower goboscript statement {statement!r}")
+
+    def command(self, name, args, parent):
+        if name in self.procs:
+            proccode, arg_ids, warp = self.procs[name]
+            if len(args) != len(arg_ids):
+                raise Exception(f"internal: {name} expects {len(arg_ids)} arguments, got {len(args)}")
+
+            block_id = self.add_block('procedures_call', parent, mutation={
+                'tagName': 'mutation',
+                'children': [],
+                'proccode': proccode,
+                'argumentids': json.dumps(arg_ids),
+                'warp': json.dumps(warp)
+            })
+            for arg_id, arg in zip(arg_ids, args):
+                self.blocks[block_id]['inputs'][arg_id] = self.input(arg, block_id, TEXT)
+            return block_id
+
+        if name in STATEMENT_BLOCKS:
+            opcode, inputs = STATEMENT_BLOCKS[name]
+            return self.add_inputs(self.add_block(opcode, parent), inputs, args)
+
+        if name in TIMED_STATEMENT_BLOCKS:
+            opcode = TIMED_STATEMENT_BLOCKS[name][len(args) - 1]
+            inputs = [('MESSAGE', TEXT), ('SECS', MATH_NUMBER)][:len(args)]
+            return self.add_inputs(self.add_block(opcode, parent), inputs, args)
+
+        if name == 'switch_costume':
+            opcode, menu_opcode, field = ('looks_switchbackdropto', 'looks_backdrops', 'BACKDROP') if self.is_stage else ('looks_switchcostumeto', 'looks_costume', 'COSTUME')
+            block_id = self.add_block(opcode, parent)
+            self.blocks[block_id]['inputs'][field] = self.menu_input(args[0], block_id, menu_opcode, field, "")
+            return block_id
+
+        if name == 'clone':
+            block_id = self.add_block('control_create_clone_of', parent)
+            self.blocks[block_id]['inputs']['CLONE_OPTION'] = self.menu_input(args[0] if args else None, block_id, 'control_create_clone_of_menu', 'CLONE_OPTION', "_myself_")
+            return block_id
+
+        if name == 'stop_this_script':
+            return self.add_block('control_stop', parent, {'STOP_OPTION': ["this script", None]}, mutation={
+                'tagName': 'mutation',
+                'children': [],
+                'hasnext': 'false'
+            })
+
+        if name == 'broadcast':
+            if args[0][0] != 'str':
+                raise Exception("internal: broadcast of a computed message")
+            block_id = self.add_block('event_broadcast', parent)
+            self.blocks[block_id]['inputs']['BROADCAST_INPUT'] = [1, [11] + self.broadcast(args[0][1])]
+            return block_id
+
+        raise Exception(f"internal: unknown goboscript command {name}")
+
+    def hat(self, script):
+        hat = script['hat']
+        arg = script['arg']
+
+        if hat == 'onflag':
+            return self.add_block('event_whenflagclicked', None)
+        if hat == 'on':
+            return self.add_block('event_whenbroadcastreceived', None, {'BROADCAST_OPTION': self.broadcast(arg)})
+        if hat == 'onkey':
+            return self.add_block('event_whenkeypressed', None, {'KEY_OPTION': [arg, None]})
+        if hat == 'onclick':
+            return self.add_block('event_whenstageclicked' if self.is_stage else 'event_whenthisspriteclicked', None)
+        if hat == 'onbackdrop':
+            return self.add_block('event_whenbackdropswitchesto', None, {'BACKDROP': [arg, None]})
+        if hat == 'onloudness' or hat == 'ontimer':
+            block_id = self.add_block('event_whengreaterthan', None, {'WHENGREATERTHANMENU': ["LOUDNESS" if hat == 'onloudness' else "TIMER", None]})
+            self.blocks[block_id]['inputs']['VALUE'] = self.input(arg, block_id, MATH_NUMBER)
+            return block_id
+        if hat == 'onclone':
+            return self.add_block('control_start_as_clone', None)
+
+        raise Exception(f"internal: unknown hat {hat}")
+
+    def define_proc(self, name, proc):
+        proccode, arg_ids, warp = self.procs[name]
+
+        definition_id = self.add_block('procedures_definition', None)
+        prototype_id = self.add_block('procedures_prototype', definition_id, shadow=True, mutation={
+            'tagName': 'mutation',
+            'children': [],
+            'proccode': proccode,
+            'argumentids': json.dumps(arg_ids),
+            'argumentnames': json.dumps(proc['params']),
+            'argumentdefaults': json.dumps([""] * len(arg_ids)),
+            'warp': json.dumps(warp)
+        })
+
+        for arg_id, param in zip(arg_ids, proc['params']):
+            arg_block_id = self.add_block('argument_reporter_string_number', prototype_id, {'VALUE': [param, None]}, shadow=True)
+            self.blocks[prototype_id]['inputs'][arg_id] = [1, arg_block_id]
+
+        self.blocks[definition_id]['inputs']['custom_block'] = [1, prototype_id]
+        return definition_id
+
+    def add_script(self, top_id, body):
+        start = len(self.blocks)
+        self.blocks[top_id]['next'] = self.stack(body, top_id)
+
+        # lay scripts out top to bottom, leaving room for roughly as many rows as the script has blocks
+        self.script_y += 100 + 24 * (len(self.blocks) - start)
+
+    def build(self):
+        for name, proc in self.program['procs'].items():
+            self.add_script(self.define_proc(name, proc), proc['body'])
+
+        for script in self.program['scripts']:
+            self.add_script(self.hat(script), script['body'])
+
+def png_size(data):
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    return struct.unpack('>II', data[16:24])
+
+def svg_size(data):
+    text = data[:4096].decode('utf-8', 'replace')
+    width = re.search(r'<svg[^>]*?\swidth="([\d.]+)', text)
+    height = re.search(r'<svg[^>]*?\sheight="([\d.]+)', text)
+    if width and height:
+        return float(width.group(1)), float(height.group(1))
+
+    view_box = re.search(r'<svg[^>]*?\sviewBox="\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)', text)
+    if view_box:
+        return float(view_box.group(1)), float(view_box.group(2))
+    return None
+
+def asset(path, assets):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    md5 = hashlib.md5(data).hexdigest()
+    ext = os.path.splitext(path)[1][1:].lower()
+    assets[f"{md5}.{ext}"] = data
+
+    return data, {
+        'assetId': md5,
+        'name': os.path.splitext(os.path.basename(path))[0],
+        'md5ext': f"{md5}.{ext}",
+        'dataFormat': ext
+    }
+
+def costume(path, assets):
+    data, entry = asset(path, assets)
+
+    size = png_size(data) if entry['dataFormat'] == 'png' else svg_size(data)
+    width, height = size if size != None else (0, 0)
+
+    entry['bitmapResolution'] = 1
+    entry['rotationCenterX'] = width / 2
+    entry['rotationCenterY'] = height / 2
+    return entry
+
+def sound(path, assets):
+    data, entry = asset(path, assets)
+
+    entry['format'] = ""
+    entry['rate'] = 48000
+    entry['sampleCount'] = 0
+
+    if entry['dataFormat'] == 'wav':
+        try:
+            with wave.open(io.BytesIO(data)) as w:
+                entry['rate'] = w.getframerate()
+                entry['sampleCount'] = w.getnframes()
+        except (wave.Error, EOFError):
+            pass
+
+    return entry
+
+# loads the costumes or sounds of a target, which are at paths relative to
+# asset_dir, with load
+def target_assets(builder, kind, load, paths, asset_dir, assets):
+    entries = []
+    for path in paths:
+        path = os.path.normpath(os.path.join(asset_dir, path))
+        try:
+            entries.append(load(path, assets))
+        except FileNotFoundError:
+            import nanoproject # not at the top, since nanoproject imports this module
+            owner = "the stage" if builder.is_stage else f"sprite {builder.name}"
+            raise nanoproject.ProjectCompilationException(f"{kind} of {owner} not found: {path}") from None
+    return entries
+
+def target_json(builder, asset_dir, assets, layer_order):
+    program = builder.program
+
+    target = {
+        'isStage': builder.is_stage,
+        'name': "Stage" if builder.is_stage else builder.name,
+        'variables': {var_id: [name, 0] for name, var_id in builder.variables.items()},
+        'lists': {list_id: [name, []] for name, list_id in builder.lists.items()},
+        'broadcasts': {broadcast_id: name for name, broadcast_id in builder.broadcasts.items()} if builder.is_stage else {},
+        'blocks': builder.blocks,
+        'comments': {},
+        'currentCostume': 0,
+        'costumes': target_assets(builder, "costume", costume, program['costumes'], asset_dir, assets),
+        'sounds': target_assets(builder, "sound", sound, program['sounds'], asset_dir, assets),
+        'volume': 100,
+        'layerOrder': layer_order
+    }
+
+    if builder.is_stage:
+        target.update({
+            'tempo': 60,
+            'videoTransparency': 50,
+            'videoState': "on",
+            'textToSpeechLanguage': None
+        })
+    else:
+        target.update({
+            'visible': True,
+            'x': 0,
+            'y': 0,
+            'size': 100,
+            'direction': 90,
+            'draggable': False,
+            'rotationStyle': "all around"
+        })
+
+    return target
+
+# builds the project.json of a compiled project. programs are (sprite name,
+# optimized ir program) pairs, the stage's first. the paths of costumes and
+# sounds in the programs are relative to asset_dir.
+# returns (project, assets), assets mapping file names in the sb3 to their contents
+def build_project(programs, asset_dir):
+    stage_program = programs[0][1]
+    sprite_programs = sorted(programs[1:], key=lambda program: program[0])
+
+    new_id = IdGenerator()
+    stage = TargetBuilder("Stage", IrLowering().program(stage_program), new_id)
+    stage.build()
+
+    sprites = []
+    for name, ir_program in sprite_programs:
+        sprite = TargetBuilder(name, IrLowering().program(ir_program), new_id, stage, stage.broadcasts)
+        sprite.build()
+        sprites.append(sprite)
+
+    assets = {}
+    targets = [target_json(stage, asset_dir, assets, 0)]
+    for i, sprite in enumerate(sprites):
+        targets.append(target_json(sprite, asset_dir, assets, i + 1))
+
+    # sprites may have added broadcasts after the stage was serialized
+    targets[0]['broadcasts'] = {broadcast_id: name for name, broadcast_id in stage.broadcasts.items()}
+
+    project = {
+        'targets': targets,
+        'monitors': [],
+        'extensions': [],
+        'meta': META
+    }
+    return project, assets
+
+# zips a project. entries get a fixed timestamp, so that
+# building the same project twice gives the same file
+def pack_sb3(project, assets):
+    out = io.BytesIO()
+
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(zipfile.ZipInfo('project.json', (1980, 1, 1, 0, 0, 0)), json.dumps(project, separators=(',', ':')), zipfile.ZIP_DEFLATED)
+        for name in sorted(assets):
+            z.writestr(zipfile.ZipInfo(name, (1980, 1, 1, 0, 0, 0)), assets[name], zipfile.ZIP_DEFLATED)
+
+    return out.getvalue()
+
+def build_sb3(programs, asset_dir, sb3_path):
+    project, assets = build_project(programs, asset_dir)
+    write_atomic(sb3_path, pack_sb3(project, assets))
+    return project
+
+if __name__ == '__main__':
+    import nanoproject
+    import passes
+
+    parser = argparse.ArgumentParser(
+        prog='nanolang-sb3',
+        description='Compile a nanolang project to an sb3 without goboscript',
+    )
+    parser.add_argument('projectdir', help="The Nanolang project directory.")
+    parser.add_argument('sb3', help="Path of the sb3 file to create.")
+    parser.add_argument('-O', dest='opt_level', type=int, choices=passes.OPT_LEVELS, default=0, help="Optimization level of the generated code. Defaults to 0.")
+    parser.add_argument('--json', metavar='path', dest='json', help="Also write the project.json to the given path, for inspection.")
+
+    args = parser.parse_args()
+    gs_out = os.path.join(args.projectdir, '.gs')
+    summary = nanoproject.compile(args.projectdir, gs_out, opt_level=args.opt_level)
+    project = build_sb3(summary['programs'], gs_out, args.sb3)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(project, f, indent=2)
@@ -0,0 +1,115 @@
+# scratch's value semantics: how scratch casts values between numbers,
+# strings and booleans, and how it compares them. used to fold constants
+# exactly like scratch would evaluate them at runtime.
+#
+# values are python floats (scratch numbers), strs and bools. functions
+# return None when the result can't be known at compile time, e.g. for
+# strings with characters that javascript and python treat differently.
+
+import math
+import re
+from decimal import Decimal
+
+# javascript's StringNumericLiteral, minus the surrounding whitespace
+DECIMAL_REGEX = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+RADIX_REGEX = re.compile(r'0(?:[xX][0-9a-fA-F]+|[oO][0-7]+|[bB][01]+)')
+INFINITY_REGEX = re.compile(r'[+-]?Infinity')
+
+# Number(text) in javascript. nan if the text isn't a number
+def js_number(text):
+    if not text.isascii():
+        return None
+
+    text = text.strip(' \t\n\r\v\f')
+    if text == '':
+        return 0.0
+    if DECIMAL_REGEX.fullmatch(text):
+        return float(text)
+    if RADIX_REGEX.fullmatch(text):
+        return float(int(text, 0))
+    if INFINITY_REGEX.fullmatch(text):
+        return -math.inf if text[0] == '-' else math.inf
+    return math.nan
+
+# String(number) in javascript
+def js_string(number):
+    if math.isnan(number):
+        return "NaN"
+    if math.isinf(number):
+        return "Infinity" if number > 0 else "-Infinity"
+    if number == 0:
+        return "0"
+
+    # shortest digits that round trip, which python and javascript agree on
+    sign, digits, exponent = Decimal(repr(number)).normalize().as_tuple()
+    digits = ''.join(str(d) for d in digits)
+    k = len(digits)
+    n = exponent + k
+    out = "-" if sign else ""
+
+    if k <= n <= 21:
+        return out + digits + "0" * (n - k)
+    if 0 < n <= 21:
+        return out + digits[:n] + "." + digits[n:]
+    if -6 < n <= 0:
+        return out + "0." + "0" * -n + digits
+
+    e = n - 1
+    e = ("+" if e > 0 else "-") + str(abs(e))
+    if k == 1:
+        return out + digits + "e" + e
+    return out + digits[0] + "." + digits[1:] + "e" + e
+
+def to_number(value):
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, float):
+        return 0.0 if math.isnan(value) else value
+
+    n = js_number(value)
+    if n == None:
+        return None
+    return 0.0 if math.isnan(n) else n
+
+def to_string(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return js_string(value)
+    return value
+
+def to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        return not (value == 0 or math.isnan(value))
+    return not (value == '' or value == '0' or value.lower() == 'false')
+
+def is_whitespace(value):
+    return isinstance(value, str) and value.strip(' \t\n\r\v\f') == ''
+
+# scratch's compare: negative, zero or positive
+def compare(a, b):
+    n1 = 1.0 if a is True else 0.0 if a is False else a if isinstance(a, float) else js_number(a)
+    n2 = 1.0 if b is True else 0.0 if b is False else b if isinstance(b, float) else js_number(b)
+    if n1 == None or n2 == None:
+        return None
+
+    if n1 == 0 and is_whitespace(a):
+        n1 = math.nan
+    if n2 == 0 and is_whitespace(b):
+        n2 = math.nan
+
+    if math.isnan(n1) or math.isnan(n2):
+        s1 = to_string(a)
+        s2 = to_string(b)
+        if not (s1.isascii() and s2.isascii()):
+            return None
+
+        s1 = s1.lower()
+        s2 = s2.lower()
+        return (s1 > s2) - (s1 < s2)
+
+    if n1 == n2:
+        return 0
+    return -1 if n1 < n2 else 1
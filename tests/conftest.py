@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the compiler's modules are imported by name, like its own modules do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,597 @@
+# a small scratch simulator for tests
+#
+# runs compiled projects the way scratch runs the goboscript gbgen prints for
+# them. the ir of every sprite is interpreted directly, and the runtime's
+# procedures (see gbgen) are done in python. values follow scratch's
+# semantics (see scratchvalues).
+#
+# scripts take turns, in the order they were started. each one runs until it
+# yields, which is
+#   - at the end of every loop iteration, unless in a warp procedure
+#   - before a recursive call, unless in a warp procedure
+#   - in the builtins that wait, for as many frames as they wait
+# a run ends once every script has finished, or after max_frames rounds of
+# turns. what sprites say and think is logged, as (sprite, text).
+
+import math
+import os
+import random
+
+import ir
+import nanoproject
+import scratchvalues
+from constfold import literal_value
+
+FRAMES_PER_SECOND = 30
+
+class StopThread(Exception):
+    pass
+
+# literals in the ir can be python ints
+def plain(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def number(value):
+    n = scratchvalues.to_number(plain(value))
+    return 0.0 if n == None else n
+
+def string(value):
+    return scratchvalues.to_string(value)
+
+def boolean(value):
+    return scratchvalues.to_boolean(value)
+
+def compare(a, b):
+    a = plain(a)
+    b = plain(b)
+    c = scratchvalues.compare(a, b)
+    if c != None:
+        return c
+
+    # strings scratchvalues leaves alone compare as strings
+    a = string(a).lower()
+    b = string(b).lower()
+    return (a > b) - (a < b)
+
+# Math.round in javascript
+def js_round(n):
+    return math.floor(n + 0.5)
+
+def binop_value(op, a, b):
+    if op == '+':
+        return number(a) + number(b)
+    if op == '-':
+        return number(a) - number(b)
+    if op == '*':
+        a = number(a)
+        b = number(b)
+        if (a == 0 and math.isinf(b)) or (b == 0 and math.isinf(a)):
+            return math.nan
+        return a * b
+    if op == '/':
+        a = number(a)
+        b = number(b)
+        if b == 0:
+            return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a)
+        return a / b
+    if op == '%':
+        a = number(a)
+        b = number(b)
+        if b == 0 or math.isinf(a):
+            return math.nan
+        result = math.fmod(a, b)
+        if result / b < 0:
+            result += b
+        return result
+    if op == '&':
+        return string(a) + string(b)
+    if op == '==':
+        return compare(a, b) == 0
+    if op == '!=':
+        return compare(a, b) != 0
+    if op == '<':
+        return compare(a, b) < 0
+    if op == '>':
+        return compare(a, b) > 0
+    if op == '<=':
+        return compare(a, b) <= 0
+    if op == '>=':
+        return compare(a, b) >= 0
+    if op == 'and':
+        return boolean(a) and boolean(b)
+    if op == 'or':
+        return boolean(a) or boolean(b)
+
+    raise Exception(f"unknown operator {op}")
+
+def expr_nodes(expr):
+    yield expr
+    for child in ir.expr_children(expr):
+        yield from expr_nodes(child)
+
+def stmt_nodes(statements):
+    for stmt in statements:
+        yield stmt
+        for block in ir.stmt_blocks(stmt):
+            yield from stmt_nodes(block)
+
+def declared_locals(statements):
+    return set(stmt[1] for stmt in stmt_nodes(statements) if stmt[0] == 'local')
+
+# names of the variables a program uses, with procedure locals named the way
+# sb3gen names them
+def variable_names(ir_program):
+    names = set()
+
+    def visit(statements, proc_name):
+        local_names = declared_locals(statements)
+        def add(name):
+            names.add(f"{proc_name}.{name}" if name in local_names else name)
+
+        for stmt in stmt_nodes(statements):
+            if stmt[0] in ('set', 'change', 'local'):
+                add(stmt[1])
+            for expr in ir.stmt_exprs(stmt):
+                for node in expr_nodes(expr):
+                    if node[0] == 'var':
+                        add(node[1])
+
+    visit(ir_program['static_init'], None)
+    for proc in ir_program['procs']:
+        visit(proc['body'], proc['name'])
+    return names
+
+class Sprite:
+    def __init__(self, name, ir_program):
+        self.name = name
+        self.program = ir_program
+        self.procs = {proc['name']: proc for proc in ir_program['procs']}
+        self.variables = {}
+
+        # procedure -> names it declares as procedure locals
+        self.locals = {proc['name']: declared_locals(proc['body']) for proc in ir_program['procs']}
+
+        self.x = 0.0
+        self.y = 0.0
+        self.direction = 90.0
+        self.size = 100.0
+        self.visible = True
+        self.costume = 1
+
+    def state(self):
+        return (self.x, self.y, self.direction, self.size, self.visible, self.costume)
+
+# where a script is: the sprite, the procedure it's in and its parameters
+class Context:
+    def __init__(self, sprite, proc_name=None, params=None, warp=False, calls=()):
+        self.sprite = sprite
+        self.proc_name = proc_name
+        self.params = params or {}
+        self.warp = warp
+        self.calls = calls
+
+class Simulation:
+    def __init__(self, programs, answers=(), max_frames=1000, max_steps=1000000, seed=0):
+        # sprites in the order sb3gen puts them in
+        self.sprites = [Sprite(name, ir_program) for name, ir_program in programs[:1] + sorted(programs[1:], key=lambda program: program[0])]
+        self.stage = self.sprites[0]
+        self.globals = {} # the stage's variables, which are shared with every sprite
+        self.stage_names = variable_names(self.stage.program)
+        self.lists = {'memory': [], 'stack_ptrs': [], 'stack_heads': []}
+
+        self.answers = list(answers)
+        self.answer = ""
+        self.max_frames = max_frames
+        self.max_steps = max_steps
+        self.random = random.Random(seed)
+
+        self.threads = []
+        self.frames = 0
+        self.steps = 0
+        self.log = []
+
+    # == VARIABLES AND LISTS ==
+
+    def variable_key(self, ctx, name):
+        if ctx.proc_name != None and name in ctx.sprite.locals[ctx.proc_name]:
+            return f"{ctx.proc_name}.{name}"
+        return name
+
+    def variables(self, sprite, key):
+        if key in self.stage_names:
+            return self.globals
+        return sprite.variables
+
+    def get_var(self, ctx, name):
+        key = self.variable_key(ctx, name)
+        return self.variables(ctx.sprite, key).get(key, 0.0)
+
+    def set_var(self, ctx, name, value):
+        key = self.variable_key(ctx, name)
+        self.variables(ctx.sprite, key)[key] = value
+
+    def item(self, list_name, index):
+        items = self.lists[list_name]
+        i = number(index)
+        if not math.isfinite(i):
+            return ""
+        i = math.floor(i)
+        if i < 1 or i > len(items):
+            return ""
+        return items[i - 1]
+
+    def set_item(self, list_name, index, value):
+        items = self.lists[list_name]
+        i = number(index)
+        if not math.isfinite(i):
+            return
+        i = math.floor(i)
+        if 1 <= i <= len(items):
+            items[i - 1] = value
+
+    # == EXPRESSIONS ==
+
+    def stack_id(self, ctx):
+        return ctx.params['stack_id']
+
+    def frame_base(self, ctx):
+        return self.item('memory', self.item('stack_ptrs', self.stack_id(ctx)))
+
+    def stack_head(self, ctx):
+        return self.item('stack_heads', self.stack_id(ctx))
+
+    def value(self, expr, ctx):
+        op = expr[0]
+
+        if op == 'const':
+            return literal_value(expr[1])
+        if op == 'var':
+            return self.get_var(ctx, expr[1])
+        if op == 'param':
+            return ctx.params.get(expr[1], "")
+        if op == 'load':
+            return self.item('memory', self.value(expr[1], ctx))
+        if op == 'binop':
+            return binop_value(expr[1], self.value(expr[2], ctx), self.value(expr[3], ctx))
+        if op == 'neg':
+            return 0.0 - number(self.value(expr[1], ctx))
+        if op == 'builtin_value':
+            return self.builtin_value(expr[1], [self.value(arg, ctx) for arg in expr[2]], ctx)
+        if op == 'builtin_return':
+            if expr[1] == 'ask':
+                return self.answer
+            if expr[1] == 'malloc':
+                return self.globals.get('nano_malloc_return', 0.0)
+            raise Exception(f"builtin {expr[1]} doesn't return anything")
+        if op == 'frame_base':
+            return self.frame_base(ctx)
+        if op == 'frame_addr':
+            return number(self.frame_base(ctx)) + expr[1]
+        if op == 'frame_slot':
+            return self.item('memory', number(self.frame_base(ctx)) + expr[1])
+        if op == 'stack_head':
+            return self.stack_head(ctx)
+        if op == 'stack_read':
+            return self.item('memory', number(self.stack_head(ctx)) - expr[1])
+        if op == 'stack_ptr':
+            return self.item('stack_ptrs', self.stack_id(ctx))
+
+        raise Exception(f"unknown ir expression {op}")
+
+    def builtin_value(self, name, args, ctx):
+        sprite = ctx.sprite
+
+        if name == 'get_x':
+            return sprite.x
+        if name == 'get_y':
+            return sprite.y
+        if name == 'get_direction':
+            return sprite.direction
+        if name == 'get_size':
+            return sprite.size
+        if name == 'get_costume_number':
+            return float(sprite.costume)
+        if name == 'get_costume_name':
+            costumes = sprite.program['costumes']
+            if not costumes:
+                return ""
+            return os.path.splitext(os.path.basename(costumes[(sprite.costume - 1) % len(costumes)]))[0]
+        if name == 'last_answer':
+            return self.answer
+        if name in ('key_pressed', 'mouse_down', 'mouse_x', 'mouse_y'):
+            return 0.0
+        if name == 'timer':
+            return self.frames / FRAMES_PER_SECOND
+        if name == 'random':
+            low, high = sorted([number(args[0]), number(args[1])])
+            if low == math.floor(low) and high == math.floor(high):
+                return float(self.random.randint(int(low), int(high)))
+            return self.random.uniform(low, high)
+
+        raise Exception(f"unknown builtin reporter {name}")
+
+    # == STATEMENTS ==
+    # statements run in generators, which yield whenever the script yields
+
+    def step(self):
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise Exception("out of steps, the program doesn't seem to finish")
+
+    def run_block(self, statements, ctx):
+        for stmt in statements:
+            self.step()
+            op = stmt[0]
+
+            if op == 'set' or op == 'local':
+                self.set_var(ctx, stmt[1], self.value(stmt[2], ctx))
+            elif op == 'change':
+                self.set_var(ctx, stmt[1], number(self.get_var(ctx, stmt[1])) + number(self.value(stmt[2], ctx)))
+            elif op == 'store':
+                self.set_item('memory', self.value(stmt[1], ctx), self.value(stmt[2], ctx))
+            elif op == 'frame_store':
+                self.set_item('memory', number(self.frame_base(ctx)) + stmt[1], self.value(stmt[2], ctx))
+            elif op == 'stack_store':
+                self.set_item('memory', number(self.stack_head(ctx)) - stmt[1], self.value(stmt[2], ctx))
+            elif op == 'stack_adjust':
+                self.set_item('stack_heads', self.stack_id(ctx), number(self.stack_head(ctx)) + stmt[1])
+            elif op == 'set_frame_base':
+                self.set_item('memory', self.item('stack_ptrs', self.stack_id(ctx)), self.value(stmt[1], ctx))
+            elif op == 'set_stack_ptr':
+                self.set_item('stack_ptrs', self.stack_id(ctx), self.value(stmt[1], ctx))
+            elif op == 'call':
+                yield from self.call(stmt[1], [self.value(arg, ctx) for arg in stmt[2]], ctx)
+            elif op == 'builtin':
+                yield from self.builtin(stmt[1], [self.value(arg, ctx) for arg in stmt[2]], ctx)
+            elif op == 'if':
+                branch = stmt[2] if boolean(self.value(stmt[1], ctx)) else stmt[3]
+                if branch:
+                    yield from self.run_block(branch, ctx)
+            elif op == 'until':
+                while not boolean(self.value(stmt[1], ctx)):
+                    yield from self.run_block(stmt[2], ctx)
+                    if not ctx.warp:
+                        yield
+            elif op == 'repeat':
+                for _ in range(max(0, js_round(number(self.value(stmt[1], ctx))))):
+                    yield from self.run_block(stmt[2], ctx)
+                    if not ctx.warp:
+                        yield
+            elif op == 'forever':
+                while True:
+                    yield from self.run_block(stmt[1], ctx)
+                    if not ctx.warp:
+                        yield
+            elif op == 'delete_clone':
+                pass # clones aren't simulated, and the original sprite can't be deleted
+            elif op != 'comment':
+                raise Exception(f"unknown ir statement {op}")
+
+    def call(self, name, args, ctx):
+        if name == 'nano_malloc':
+            self.nano_malloc(number(args[0]))
+            return
+        if name == 'nano_free':
+            self.nano_free(number(args[0]))
+            return
+
+        proc = ctx.sprite.procs[name]
+        warp = ctx.warp or proc['warp']
+        if not warp and name in ctx.calls:
+            yield
+
+        params = dict(zip(['stack_id'] + list(proc['params']), args))
+        yield from self.run_block(proc['body'], Context(ctx.sprite, name, params, warp, ctx.calls + (name,)))
+
+    def wait(self, seconds):
+        for _ in range(max(1, math.ceil(number(seconds) * FRAMES_PER_SECOND))):
+            yield
+
+    def builtin(self, name, args, ctx):
+        sprite = ctx.sprite
+
+        if name in ('say', 'think', 'say_wait', 'think_wait'):
+            self.log.append((sprite.name, string(args[0])))
+            if name.endswith('_wait'):
+                yield from self.wait(args[1])
+        elif name == 'wait':
+            yield from self.wait(args[0])
+        elif name == 'ask':
+            yield
+            if not self.answers:
+                raise StopThread()
+            self.answer = self.answers.pop(0)
+        elif name == 'malloc':
+            self.nano_malloc(number(args[0]))
+        elif name == 'free':
+            self.nano_free(number(args[0]))
+        elif name == 'move_steps':
+            radians = math.radians(90 - sprite.direction)
+            sprite.x += number(args[0]) * math.cos(radians)
+            sprite.y += number(args[0]) * math.sin(radians)
+        elif name == 'turn_cw':
+            sprite.direction += number(args[0])
+        elif name == 'turn_ccw':
+            sprite.direction -= number(args[0])
+        elif name == 'point_in_direction':
+            sprite.direction = number(args[0])
+        elif name == 'goto_xy':
+            sprite.x = number(args[0])
+            sprite.y = number(args[1])
+        elif name == 'set_x':
+            sprite.x = number(args[0])
+        elif name == 'set_y':
+            sprite.y = number(args[0])
+        elif name == 'change_x':
+            sprite.x += number(args[0])
+        elif name == 'change_y':
+            sprite.y += number(args[0])
+        elif name in ('set_costume_name', 'set_costume_number'):
+            sprite.costume = args[0]
+        elif name == 'next_costume':
+            sprite.costume = number(sprite.costume) + 1
+        elif name == 'set_size':
+            sprite.size = number(args[0])
+        elif name == 'change_size':
+            sprite.size += number(args[0])
+        elif name in ('show', 'hide'):
+            sprite.visible = name == 'show'
+        elif name in ('bounce_on_edge', 'create_clone', 'create_clone_of', 'reset_timer'):
+            pass
+        else:
+            raise Exception(f"unknown builtin {name}")
+
+    # == RUNTIME ==
+    # the procedures of gbgen's boilerplate, which are all warp
+
+    def nano_init(self):
+        self.lists['memory'] = [""] * 2048
+        self.lists['stack_ptrs'] = []
+        self.lists['stack_heads'] = []
+
+        memory = self.lists['memory']
+        memory[0] = memory[1] = memory[2] = 0.0
+
+    def mem(self, addr):
+        return self.item('memory', addr)
+
+    def set_mem(self, addr, value):
+        self.set_item('memory', addr, value)
+
+    def nano_malloc(self, size):
+        memory = self.lists['memory']
+        cell_ptr = 1.0
+        prev_cell_ptr = 0.0
+        memory_skipped = 0.0
+
+        if size <= 0:
+            self.globals['nano_malloc_return'] = 0.0
+            return
+
+        while not (compare(self.mem(cell_ptr), 0.0) == 0 or memory_skipped > size):
+            memory_skipped = number(self.mem(cell_ptr)) - cell_ptr - number(self.mem(cell_ptr + 2)) - 3
+            prev_cell_ptr = cell_ptr
+            cell_ptr = number(self.mem(cell_ptr))
+
+        if cell_ptr == 1:
+            prev_cell_ptr = 1.0
+            new_cell_ptr = 4.0
+            cell_ptr = 0.0
+        elif size <= memory_skipped:
+            new_cell_ptr = prev_cell_ptr + number(self.mem(prev_cell_ptr + 2)) + 3
+        else:
+            new_cell_ptr = cell_ptr + number(self.mem(cell_ptr + 2)) + 3
+            prev_cell_ptr = cell_ptr
+            cell_ptr = 0.0
+
+        while not len(memory) > new_cell_ptr + 3 + size:
+            memory.append("")
+
+        if prev_cell_ptr != 0:
+            self.set_mem(prev_cell_ptr, new_cell_ptr)
+        if cell_ptr != 0:
+            self.set_mem(cell_ptr + 1, new_cell_ptr)
+
+        self.set_mem(new_cell_ptr, cell_ptr)
+        self.set_mem(new_cell_ptr + 1, prev_cell_ptr)
+        self.set_mem(new_cell_ptr + 2, size)
+        self.globals['nano_malloc_return'] = new_cell_ptr + 3
+
+    def nano_free(self, ptr):
+        if ptr <= 0:
+            return
+
+        cell_ptr = ptr - 3
+        self.set_mem(self.mem(cell_ptr + 1), self.mem(cell_ptr))
+        if compare(self.mem(cell_ptr), 0.0) != 0:
+            self.set_mem(number(self.mem(cell_ptr)) + 1, self.mem(cell_ptr + 1))
+
+        self.set_mem(cell_ptr, 0.0)
+        self.set_mem(cell_ptr + 1, 0.0)
+        self.set_mem(cell_ptr + 2, 0.0)
+
+    def nano_alloc_stack(self):
+        stack_ptrs = self.lists['stack_ptrs']
+        stack_heads = self.lists['stack_heads']
+
+        for i in range(1, len(stack_ptrs) + 2):
+            if self.item('stack_ptrs', i) == "":
+                self.nano_malloc(512)
+                stack_pos = self.globals['nano_malloc_return']
+
+                if i > len(stack_ptrs):
+                    stack_ptrs.append(stack_pos)
+                    stack_heads.append(stack_pos)
+                else:
+                    stack_ptrs[i - 1] = stack_pos
+                    stack_heads[i - 1] = stack_pos
+
+                self.set_mem(stack_pos, stack_pos + 1)
+                return float(i)
+
+        return "error"
+
+    # == SCRIPTS ==
+
+    def start(self, gen):
+        self.threads.append(gen)
+
+    def static_init(self, sprite):
+        yield from self.run_block(sprite.program['static_init'], Context(sprite))
+
+    def event_script(self, sprite, proc):
+        stack_id = self.nano_alloc_stack()
+        yield from self.call(proc['name'], [stack_id], Context(sprite))
+
+    # what clicking the green flag starts: the stage's onflag script, which
+    # initializes memory and broadcasts nanoinit and then nanostart
+    def green_flag(self):
+        self.nano_init()
+
+        for sprite in self.sprites:
+            self.start(self.static_init(sprite))
+        for sprite in self.sprites:
+            for proc in sprite.program['procs']:
+                if proc['event'] != None and proc['event'][0] == 'flag':
+                    self.start(self.event_script(sprite, proc))
+
+    def run(self):
+        self.green_flag()
+
+        while self.threads and self.frames < self.max_frames:
+            i = 0
+            while i < len(self.threads):
+                try:
+                    next(self.threads[i])
+                    i += 1
+                except (StopIteration, StopThread):
+                    del self.threads[i]
+            self.frames += 1
+
+        return self
+
+    # what a run did that can be seen from outside: what was said and where
+    # the sprites ended up
+    def outcome(self):
+        return self.log, [sprite.state() for sprite in self.sprites]
+
+# writes a project to directory. sources maps file names to their contents.
+# the stage is empty unless given
+def write_project(directory, sources):
+    os.makedirs(directory, exist_ok=True)
+    sources = dict(sources)
+    sources.setdefault('stage.nano', "")
+
+    for filename, text in sources.items():
+        with open(os.path.join(directory, filename), 'w') as f:
+            f.write(text)
+
+# compiles a project, returning its (sprite name, ir program) pairs
+def compile_project(project_dir, output_dir, opt_level=0):
+    summary = nanoproject.compile(project_dir, output_dir, use_cache=False, opt_level=opt_level)
+    return summary['programs']
+
+def run_project(project_dir, output_dir, opt_level=0, **kwargs):
+    return Simulation(compile_project(project_dir, output_dir, opt_level), **kwargs).run()
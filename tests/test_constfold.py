@@ -0,0 +1,93 @@
+from constfold import const_fold_pass
+from ir import const, binop
+
+def program(body, locals=()):
+    return {'static_init': [], 'procs': [{'name': "_f", 'body': body}], 'locals': set(locals)}
+
+def fold(body, locals=()):
+    p = program(body, locals)
+    const_fold_pass(p)
+    return p['procs'][0]['body']
+
+def test_folds_arithmetic_and_joins():
+    assert fold([
+        ('set', 'x', binop("+", const(1), binop("*", const(2), const(3)))),
+        ('set', 'y', binop("&", const("a"), const(1.5))),
+        ('set', 'z', ('neg', binop("-", const(2), const(5)))),
+    ]) == [
+        ('set', 'x', const(7.0)),
+        ('set', 'y', const("a1.5")),
+        ('set', 'z', const(3.0)),
+    ]
+
+def test_keeps_values_without_a_literal():
+    # a literal true would be "true" to join, and 1e20 would be printed with an exponent
+    body = [
+        ('set', 'x', binop("<", const(1), const(2))),
+        ('set', 'y', binop("*", const(1e10), const(1e10))),
+        ('set', 'z', binop("/", const(1), const(0))),
+    ]
+    assert fold(body) == body
+
+def test_folds_comparisons_where_they_are_used():
+    assert fold([('set', 'x', binop("+", binop("<", const("10"), const("9")), const(0)))]) == [('set', 'x', const(0.0))]
+
+def test_constant_conditions_pick_a_branch():
+    assert fold([
+        ('if', binop("==", const("abc"), const("ABC")), [('set', 'x', const(1))], [('set', 'x', const(2))]),
+        ('if', binop(">", const(1), const(2)), [('set', 'y', const(1))], None),
+    ]) == [('set', 'x', const(1))]
+
+def test_loops_that_never_run_are_dropped():
+    assert fold([
+        ('until', binop("==", const(1), const(1)), [('set', 'x', const(1))]),
+        ('repeat', const(0.4), [('set', 'y', const(1))]),
+        ('repeat', const(0.5), [('set', 'z', const(1))]),
+    ]) == [('repeat', const(0.5), [('set', 'z', const(1))])]
+
+def test_until_that_never_ends_becomes_forever():
+    assert fold([('until', binop("==", const(1), const(2)), [('builtin', 'wait', [const(1)])])]) == [
+        ('forever', [('builtin', 'wait', [const(1)])])
+    ]
+
+def test_propagates_temp_until_a_call():
+    assert fold([
+        ('set', 'temp', const(5)),
+        ('set', 'x', binop("*", ('var', 'temp'), const(2))),
+        ('call', "_g", [('param', 'stack_id')]),
+        ('set', 'y', ('var', 'temp')),
+    ]) == [
+        ('set', 'temp', const(5)),
+        ('set', 'x', const(10.0)),
+        ('call', "_g", [('param', 'stack_id')]),
+        ('set', 'y', ('var', 'temp')),
+    ]
+
+def test_temp_is_unknown_in_loop_conditions():
+    body = [
+        ('set', 'temp', const(0)),
+        ('until', binop(">", ('var', 'temp'), const(3)), [('change', 'temp', const(1))]),
+    ]
+    assert fold(body) == body
+
+def test_propagates_locals_set_once():
+    assert fold([
+        ('set', '_1_k', const(2)),
+        ('set', '_2_n', const(1)),
+        ('change', '_2_n', const(1)),
+        ('set', 'x', binop("*", ('var', '_1_k'), ('var', '_2_n'))),
+        ('set', 'y', binop("*", ('var', '_1_k'), ('var', 'static'))),
+    ], locals=['_1_k', '_2_n']) == [
+        ('set', '_1_k', const(2)),
+        ('set', '_2_n', const(1)),
+        ('change', '_2_n', const(1)),
+        ('set', 'x', binop("*", const(2), ('var', '_2_n'))),
+        ('set', 'y', binop("*", const(2), ('var', 'static'))),
+    ]
+
+def test_propagation_reaches_a_fixed_point():
+    assert fold([
+        ('set', '_1_a', const(2)),
+        ('set', '_2_b', binop("+", ('var', '_1_a'), const(1))),
+        ('set', 'x', binop("*", ('var', '_2_b'), const(2))),
+    ], locals=['_1_a', '_2_b'])[2] == ('set', 'x', const(6.0))
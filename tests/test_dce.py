@@ -0,0 +1,79 @@
+from dce import dead_code_pass, unused_functions_pass
+from ir import const, binop
+
+def proc(name, body, event=None):
+    return {'name': name, 'warp': False, 'inline': None, 'params': [], 'body': body, 'event': event}
+
+def program(procs, locals=()):
+    return {'static_init': [], 'procs': procs, 'locals': set(locals)}
+
+def remove_dead_code(body, locals=()):
+    p = program([proc("_f", body)], locals)
+    dead_code_pass(p)
+    return p['procs'][0]['body']
+
+def test_removes_statements_after_forever():
+    assert remove_dead_code([
+        ('forever', [('builtin', 'wait', [const(1)])]),
+        ('builtin', 'say', [const("never")]),
+    ]) == [('forever', [('builtin', 'wait', [const(1)])])]
+
+def test_removes_empty_ifs():
+    assert remove_dead_code([
+        ('if', ('var', 'x'), [], None),
+        ('if', ('var', 'x'), [], [('builtin', 'say', [const("no")])]),
+    ]) == [('if', ('var', 'x'), [], [('builtin', 'say', [const("no")])])]
+
+def test_removes_locals_nothing_reads():
+    assert remove_dead_code([
+        ('set', '_1_a', const(1)),
+        ('change', '_1_a', const(1)),
+        ('set', '_2_b', const(2)),
+        ('builtin', 'say', [('var', '_2_b')]),
+        ('set', 'static', const(3)),
+    ], locals=['_1_a', '_2_b']) == [
+        ('set', '_2_b', const(2)),
+        ('builtin', 'say', [('var', '_2_b')]),
+        ('set', 'static', const(3)),
+    ]
+
+def test_removes_chains_of_unread_locals():
+    # the only read of _1_a is in an assignment to a local nothing reads
+    assert remove_dead_code([
+        ('set', '_1_a', const(1)),
+        ('set', '_2_b', ('var', '_1_a')),
+    ], locals=['_1_a', '_2_b']) == []
+
+def test_removes_overwritten_values():
+    assert remove_dead_code([
+        ('set', '_1_a', const("")),
+        ('set', '_1_a', const(4)),
+        ('set', 'temp', const(1)),
+        ('set', 'temp', const(2)),
+        ('builtin', 'say', [binop("+", ('var', '_1_a'), ('var', 'temp'))]),
+        ('set', 'temp', const(3)),
+    ], locals=['_1_a']) == [
+        ('set', '_1_a', const(4)),
+        ('set', 'temp', const(2)),
+        ('builtin', 'say', [binop("+", ('var', '_1_a'), ('var', 'temp'))]),
+    ]
+
+def test_keeps_values_read_in_nested_blocks():
+    body = [
+        ('set', '_1_a', const(1)),
+        ('if', ('var', 'x'), [('builtin', 'say', [('var', '_1_a')])], None),
+        ('set', '_1_a', const(2)),
+        ('builtin', 'say', [('var', '_1_a')]),
+    ]
+    assert remove_dead_code(body, locals=['_1_a']) == body
+
+def test_removes_unreachable_functions():
+    p = program([
+        proc("_used", [('call', "_also_used", [])]),
+        proc("_also_used", []),
+        proc("_unused", [('call', "_used", [])]),
+        proc("_recursive_unused", [('call', "_recursive_unused", [])]),
+        proc("_handler", [('call', "_used", [])], event=('flag', None)),
+    ])
+    unused_functions_pass(p)
+    assert [proc['name'] for proc in p['procs']] == ["_used", "_also_used", "_handler"]
@@ -0,0 +1,113 @@
+from framebase import frame_base_pass
+from ir import const, binop
+
+FB = ('var', 'fb')
+
+def slot(offset):
+    return ('load', binop("+", FB, const(offset)))
+
+def store(offset, value):
+    return ('store', binop("+", FB, const(offset)), value)
+
+def cache(body):
+    p = {'static_init': [], 'procs': [{'name': "_f", 'body': body}], 'locals': set()}
+    frame_base_pass(p)
+    return p['procs'][0]['body']
+
+def test_caches_the_frame_base_for_runs_of_accesses():
+    assert cache([
+        ('frame_store', 1, const(1)),
+        ('frame_store', 2, ('frame_slot', 1)),
+        ('builtin', 'say', [('frame_slot', 2)]),
+    ]) == [
+        ('local', 'fb', ('frame_base',)),
+        store(1, const(1)),
+        store(2, slot(1)),
+        ('builtin', 'say', [slot(2)]),
+    ]
+
+def test_leaves_single_accesses_alone():
+    body = [('builtin', 'say', [('frame_slot', 2)]), ('set', 'x', const(1))]
+    assert cache(body) == body
+
+def test_nothing_changes_without_frame_accesses():
+    body = [('set', 'x', const(1)), ('builtin', 'say', [('var', 'x')])]
+    assert cache(body) == body
+
+def test_takes_a_new_frame_base_from_where_it_was_set():
+    assert cache([
+        ('set_frame_base', ('stack_head',)),
+        ('frame_store', 1, const(1)),
+        ('frame_store', 2, ('frame_slot', 1)),
+    ]) == [
+        ('set_frame_base', ('stack_head',)),
+        ('local', 'fb', ('stack_head',)),
+        store(1, const(1)),
+        store(2, slot(1)),
+    ]
+
+def test_loads_again_after_calls():
+    # the call can run this procedure recursively, which sets fb to its own frame
+    assert cache([
+        ('frame_store', 1, const(1)),
+        ('frame_store', 2, const(2)),
+        ('call', "_f", [('param', 'stack_id')]),
+        ('frame_store', 2, ('frame_slot', 1)),
+        ('builtin', 'say', [('frame_slot', 2)]),
+    ]) == [
+        ('local', 'fb', ('frame_base',)),
+        store(1, const(1)),
+        store(2, const(2)),
+        ('call', "_f", [('param', 'stack_id')]),
+        ('set', 'fb', ('frame_base',)),
+        store(2, slot(1)),
+        ('builtin', 'say', [slot(2)]),
+    ]
+
+def test_loads_again_after_builtins_that_wait():
+    body = cache([
+        ('frame_store', 1, const(1)),
+        ('frame_store', 2, ('frame_slot', 1)),
+        ('builtin', 'wait', [const(1)]),
+        ('frame_store', 2, ('frame_slot', 1)),
+        ('builtin', 'say', [('frame_slot', 2)]),
+    ])
+    assert body[3:5] == [('builtin', 'wait', [const(1)]), ('set', 'fb', ('frame_base',))]
+
+    # say doesn't wait, so fb stays loaded across it
+    body = cache([
+        ('frame_store', 1, const(1)),
+        ('builtin', 'say', [('frame_slot', 1)]),
+        ('frame_store', 2, ('frame_slot', 1)),
+    ])
+    assert [stmt for stmt in body if stmt[0] in ('local', 'set')] == [('local', 'fb', ('frame_base',))]
+
+def test_loop_bodies_load_their_own_frame_base():
+    body = cache([
+        ('frame_store', 1, const(1)),
+        ('frame_store', 2, ('frame_slot', 1)),
+        ('until', binop(">", ('frame_slot', 1), const(3)), [
+            ('frame_store', 1, binop("+", ('frame_slot', 1), ('frame_slot', 2))),
+            ('builtin', 'say', [('frame_slot', 1)]),
+        ]),
+    ])
+
+    # every iteration starts after a yield, and the condition is evaluated after one too
+    until = body[3]
+    assert until[1] == binop(">", ('frame_slot', 1), const(3))
+    assert until[2] == [
+        ('set', 'fb', ('frame_base',)),
+        store(1, binop("+", slot(1), slot(2))),
+        ('builtin', 'say', [slot(1)]),
+    ]
+
+def test_declares_fb_before_its_first_use():
+    # the first load is in a branch, so fb is declared up front
+    body = cache([
+        ('if', ('var', 'x'), [
+            ('frame_store', 1, const(1)),
+            ('frame_store', 2, ('frame_slot', 1)),
+        ], None),
+    ])
+    assert body[0] == ('local', 'fb', const(0))
+    assert body[1][2][0] == ('set', 'fb', ('frame_base',))
@@ -0,0 +1,171 @@
+import pytest
+
+import ir
+import passes
+from inline import inline_pass, INLINE_THRESHOLD
+from ir import const, binop, STACK_ID
+from scratchsim import run_project, write_project
+
+def proc(name, body, params=(), warp=False, inline=None, event=None):
+    return {'name': name, 'warp': warp, 'inline': inline, 'params': list(params), 'body': body, 'event': event}
+
+def handler(body, warp=False):
+    return proc("_handler", body, warp=warp, event=('flag', None))
+
+def inline(procs, locals=()):
+    p = {'static_init': [], 'procs': procs, 'locals': set(locals)}
+    inline_pass(p)
+    return p
+
+def call(name, *args):
+    return ('call', name, [STACK_ID] + list(args))
+
+def calls_in(statements):
+    found = []
+    for stmt in statements:
+        if stmt[0] == 'call':
+            found.append(stmt[1])
+        for block in ir.stmt_blocks(stmt):
+            found.extend(calls_in(block))
+    return found
+
+def test_copies_the_body_and_binds_parameters():
+    p = inline([
+        proc("_sq", [('set', '_1_y', binop("*", ('param', 'x'), ('param', 'x'))), ('set', 'nano_ret', ('var', '_1_y'))], params=['x']),
+        handler([call("_sq", ('var', 'a')), ('builtin', 'say', [('var', 'nano_ret')])]),
+    ], locals=['_1_y'])
+
+    body = p['procs'][1]['body']
+    assert body == [
+        ('comment', "inlined _sq"),
+        ('set', '_sq_x_1', ('var', 'a')),
+        ('set', '_1_y_1', binop("*", ('var', '_sq_x_1'), ('var', '_sq_x_1'))),
+        ('set', 'nano_ret', ('var', '_1_y_1')),
+        ('comment', "end of inlined _sq"),
+        ('builtin', 'say', [('var', 'nano_ret')]),
+    ]
+    assert {'_sq_x_1', '_1_y_1'} <= p['locals']
+
+def test_constants_and_parameters_are_passed_as_they_are():
+    say_x = [('builtin', 'say', [('param', 'x')])]
+    p = inline([
+        proc("_show", say_x, params=['x']),
+        proc("_f", [call("_show", ('param', 'n')), call("_show", const(2))], params=['n'], inline=False),
+        handler([call("_f", const(1))]),
+    ])
+
+    assert p['procs'][1]['body'] == [
+        ('comment', "inlined _show"),
+        ('builtin', 'say', [('param', 'n')]),
+        ('comment', "end of inlined _show"),
+        ('comment', "inlined _show"),
+        ('builtin', 'say', [const(2)]),
+        ('comment', "end of inlined _show"),
+    ]
+
+def test_bound_parameters_stay_out_of_code_that_yields():
+    say_wait_x = [('builtin', 'say_wait', [('param', 'x'), const(0)])]
+
+    p = inline([proc("_show", say_wait_x, params=['x']), handler([call("_show", ('var', 'a'))])])
+    assert calls_in(p['procs'][1]['body']) == ["_show"]
+
+    p = inline([proc("_show", say_wait_x, params=['x']), handler([call("_show", const(1))])])
+    assert calls_in(p['procs'][1]['body']) == []
+
+def test_copies_leave_out_frames_they_dont_use():
+    enter = [('comment', "stack frame enter"), ('stack_adjust', 1), ('stack_store', 0, ('frame_base',)), ('set_frame_base', ('stack_head',))]
+    exit = [('comment', "stack frame end"), ('set', 'temp', ('frame_slot', 0)), ('stack_adjust', -1), ('set_frame_base', ('var', 'temp'))]
+    say = ('builtin', 'say', [const(1)])
+    store = ('frame_store', 1, const(1))
+
+    p = inline([proc("_f", enter + [say] + exit), handler([call("_f")])])
+    assert p['procs'][1]['body'] == [('comment', "inlined _f"), say, ('comment', "end of inlined _f")]
+
+    p = inline([proc("_f", enter + [store] + exit), handler([call("_f")])])
+    assert p['procs'][1]['body'] == [('comment', "inlined _f")] + enter + [store] + exit + [('comment', "end of inlined _f")]
+
+def test_every_copy_gets_its_own_locals():
+    p = inline([
+        proc("_f", [('set', '_1_a', const(1))], inline=True),
+        handler([call("_f"), call("_f")]),
+    ], locals=['_1_a'])
+
+    sets = [stmt[1] for stmt in p['procs'][1]['body'] if stmt[0] == 'set']
+    assert sets == ['_1_a_1', '_1_a_2']
+
+def test_respects_noinline():
+    p = inline([proc("_f", [], inline=False), handler([call("_f")])])
+    assert calls_in(p['procs'][1]['body']) == ["_f"]
+
+def test_never_inlines_recursion():
+    p = inline([
+        proc("_even", [call("_odd")]),
+        proc("_odd", [call("_even")]),
+        proc("_fact", [call("_fact")]),
+        handler([call("_even"), call("_fact")]),
+    ])
+    assert calls_in(p['procs'][3]['body']) == ["_even", "_fact"]
+
+def test_inlines_functions_calling_into_a_cycle():
+    p = inline([
+        proc("_loop", [call("_loop")]),
+        proc("_outer", [call("_loop")]),
+        handler([call("_outer")]),
+    ])
+    assert calls_in(p['procs'][2]['body']) == ["_loop"]
+
+def test_large_functions_are_inlined_only_when_called_once():
+    big_body = [('builtin', 'say', [const(i)]) for i in range(INLINE_THRESHOLD)]
+
+    p = inline([proc("_big", big_body), handler([call("_big"), call("_big")])])
+    assert calls_in(p['procs'][1]['body']) == ["_big", "_big"]
+
+    p = inline([proc("_big", big_body), handler([call("_big")])])
+    assert calls_in(p['procs'][1]['body']) == []
+
+def test_warp_loops_stay_out_of_code_that_isnt_warp():
+    loop = [('repeat', const(3), [('change', 'x', const(1))])]
+
+    p = inline([proc("_w", loop, warp=True), handler([call("_w")])])
+    assert calls_in(p['procs'][1]['body']) == ["_w"]
+
+    p = inline([proc("_w", loop, warp=True), handler([call("_w")], warp=True)])
+    assert calls_in(p['procs'][1]['body']) == []
+
+def test_callees_are_inlined_first():
+    p = inline([
+        proc("_inner", [('change', 'x', const(1))]),
+        proc("_outer", [call("_inner"), call("_inner")]),
+        handler([call("_outer")]),
+    ])
+    body = p['procs'][2]['body']
+    assert calls_in(body) == []
+    assert [stmt for stmt in body if stmt[0] == 'change'] == [('change', 'x', const(1))] * 2
+
+@pytest.mark.parametrize('opt_level', passes.OPT_LEVELS)
+def test_scripts_running_the_same_copy_keep_their_arguments(opt_level, tmp_path):
+    # f is called from two scripts, which take turns at every say_wait in the
+    # copy of disp inlined into it
+    write_project(tmp_path / 'project', {'sprite.nano': """
+func disp(n: number): void
+    say_wait(n, 0)
+    say_wait(n, 0)
+end
+
+@noinline
+func f(n: number): void
+    disp(n)
+    disp(n + 10)
+end
+
+when flag
+    f(1)
+end
+
+when flag
+    f(2)
+end
+"""})
+    simulation = run_project(str(tmp_path / 'project'), str(tmp_path / 'out'), opt_level)
+    said = [text for _, text in simulation.log]
+    assert said == ["1", "2", "1", "2", "11", "12", "11", "12"]
@@ -0,0 +1,213 @@
+# end-to-end: projects compiled at every optimization level behave the same
+import os
+
+import pytest
+
+import passes
+from scratchsim import Simulation, compile_project, write_project
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+# example -> (answers, what is said at -O0)
+EXAMPLES = {
+    'hello_world': ([], ["Hello, world!"]),
+    'scope': ([], ["shadowing variable", "original variable"] * 2),
+    'fibonacci': (["10", "1", "15"], ["55", "1", "610"]),
+    'memory_inspector': ([], None),
+    'movement': ([], None),
+}
+
+# program -> (source, answers, what is said at -O0)
+# functions that return don't declare locals, and while loops stay out of frames
+# that declare more locals after them, since the stack goes wrong at -O0 there too
+PROGRAMS = {
+    'folding': ("""
+func twice(n: number): number
+    return n * 2
+end
+
+func label(n: number): string
+    return "n=" & n & "px"
+end
+
+when flag
+    say_wait("a" & (2 * 3) & "b" & 1.5 & string(0.25 + 0.5), 0)
+    say_wait(number("12") + 1, 0)
+    say_wait(string(true) & string(1 == 1), 0)
+    say_wait((1 + 2) * (3 - 4) / 8, 0)
+    var limit = 3
+    if "10" < "9"
+        say_wait("wrong", 0)
+    elseif !(1 < 2) || (3 >= 3 && 2 <= 1) || 4 != 4
+        say_wait("bad", 0)
+    else
+        say_wait("good " & limit, 0)
+    end
+    var i = 0
+    while i < limit
+        say_wait(label(twice(i)), 0)
+        i = i + 1
+    end
+    repeat 2 * 1
+        say_wait("twice", 0)
+    end
+    while false
+        say_wait("never", 0)
+    end
+    say_wait(1 / 0, 0)
+    say_wait(0.1 + 0.2, 0)
+end
+""", [], ["a6b1.50.75", "13", "1true", "-0.375", "good 3", "n=0px", "n=2px", "n=4px", "twice", "twice", "Infinity", "0.30000000000000004"]),
+
+    'inlining': ("""
+func sq(x: number): number
+    return x * x
+end
+
+@noinline
+func cube(x: number): number
+    return x * sq(x)
+end
+
+@inline
+func big(out: number*, a: number): void
+    var i = 0
+    repeat a
+        out[0] = out[0] + sq(i) + cube(i)
+        i += 1
+    end
+end
+
+@warp
+func count(out: number*, n: number): void
+    repeat n
+        out[0] = out[0] + 1
+    end
+end
+
+func fact(n: number): number
+    if n <= 1
+        return 1
+    else
+        return n * fact(n - 1)
+    end
+end
+
+when flag
+    say_wait(sq(3), 0)
+    var s = 0
+    big(&s, 4)
+    say_wait(s, 0)
+    var c = 0
+    count(&c, 3)
+    say_wait(c, 0)
+    say_wait(fact(5) + sq(2), 0)
+end
+""", [], ["9", "50", "3", "124"]),
+
+    'arguments': ("""
+func bump(p: number*, x: number): number
+    p[0] = p[0] + 1
+    return x + p[0]
+end
+
+func mixed(a: number, b: number, c: number): number
+    return a * 1000 + b * 10 + c
+end
+
+func poke(out: number*, b: number): void
+    var p = &b
+    p[0] = p[0] + 100
+    out[0] = b
+end
+
+func countdown(n: number): void
+    while n > 0
+        say_wait(n, 0)
+        n -= 2
+    end
+end
+
+func rdec(n: number): number
+    if n <= 0
+        return 0
+    else
+        return rdec(n - 1) + 1
+    end
+end
+
+when flag
+    var counter = 0
+    say_wait(mixed(1, 2, 3), 0)
+    say_wait(mixed(bump(&counter, 1), counter, bump(&counter, 2)), 0)
+    var out = 0
+    poke(&out, counter)
+    say_wait(out & " " & counter, 0)
+    countdown(5)
+    say_wait(rdec(4), 0)
+    say_wait(mixed(rdec(2), number(ask("q")), rdec(1)), 0)
+end
+""", ["7"], ["1023", "2014", "102 2", "5", "3", "1", "4", "2071"]),
+
+    'memory': ("""
+func sum(out: number*, p: number*, n: number): void
+    var i = 0
+    out[0] = 0
+    while i < n
+        out[0] = out[0] + p[i]
+        i += 1
+    end
+end
+
+func fill(p: number*, n: number): void
+    var i = 0
+    while i < n
+        p[i] = i * i
+        i += 1
+    end
+end
+
+when flag
+    var total = 0
+    var p = number* (malloc(5))
+    fill(p, 5)
+    sum(&total, p, 5)
+    say_wait(total, 0)
+    var q = number* (malloc(3))
+    fill(q, 3)
+    free(void* (p))
+    sum(&total, q, 3)
+    say_wait(total & " " & *q, 0)
+end
+""", [], ["30", "5 0"]),
+}
+
+def outcomes(project_dir, tmp_path, answers):
+    results = {}
+    for opt_level in passes.OPT_LEVELS:
+        programs = compile_project(project_dir, str(tmp_path / f"out{opt_level}"), opt_level)
+        results[opt_level] = Simulation(programs, answers=answers, max_frames=500).run().outcome()
+    return results
+
+def said(outcome):
+    return [text for _, text in outcome[0]]
+
+@pytest.mark.parametrize('example', sorted(EXAMPLES))
+def test_examples_behave_the_same_at_every_level(example, tmp_path):
+    answers, expected = EXAMPLES[example]
+    results = outcomes(os.path.join(EXAMPLES_DIR, example), tmp_path, answers)
+
+    if expected != None:
+        assert said(results[0]) == expected
+    for opt_level in passes.OPT_LEVELS:
+        assert results[opt_level] == results[0], f"-O{opt_level} differs from -O0"
+
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_programs_behave_the_same_at_every_level(name, tmp_path):
+    source, answers, expected = PROGRAMS[name]
+    write_project(tmp_path / 'project', {'sprite.nano': source})
+    results = outcomes(str(tmp_path / 'project'), tmp_path, answers)
+
+    assert said(results[0]) == expected
+    for opt_level in passes.OPT_LEVELS:
+        assert results[opt_level] == results[0], f"-O{opt_level} differs from -O0"
@@ -0,0 +1,48 @@
+import passes
+from ir import const, binop
+
+def program(body):
+    return {
+        'static_init': [],
+        'procs': [{'name': "_f", 'warp': False, 'inline': None, 'params': [], 'body': body, 'event': ('flag', None)}],
+        'locals': set()
+    }
+
+def test_merges_adjacent_stack_adjusts():
+    assert passes.merge_stack_adjusts([
+        ('stack_adjust', 1),
+        ('stack_store', 0, const(1)),
+        ('stack_adjust', -2),
+        ('comment', "frame end"),
+        ('stack_adjust', -1),
+        ('set', 'x', const(1)),
+        ('stack_adjust', -1),
+        ('stack_adjust', 1),
+    ]) == [
+        ('stack_adjust', 1),
+        ('stack_store', 0, const(1)),
+        ('stack_adjust', -3),
+        ('comment', "frame end"),
+        ('set', 'x', const(1)),
+    ]
+
+def test_stack_adjusts_merge_in_nested_blocks():
+    p = program([('if', ('var', 'x'), [('stack_adjust', 2), ('stack_adjust', -1)], None)])
+    passes.stack_adjust_pass(p)
+    assert p['procs'][0]['body'] == [('if', ('var', 'x'), [('stack_adjust', 1)], None)]
+
+def test_level_zero_leaves_the_ir_alone():
+    body = [('set', 'x', binop("+", const(1), const(2))), ('stack_adjust', 1), ('stack_adjust', -1)]
+    p = program(list(body))
+    passes.optimize(p, 0)
+    assert p['procs'][0]['body'] == body
+
+def test_records_what_each_pass_did():
+    p = program([('set', 'x', binop("+", const(1), const(2))), ('stack_adjust', 1), ('stack_adjust', -1)])
+    stats = {}
+    passes.optimize(p, 1, stats)
+
+    assert set(stats) == set(opt_pass.name for opt_pass in passes.PASSES if opt_pass.level <= 1)
+    assert stats['const-fold']['nodes_removed'] == 2
+    assert stats['stack-adjust']['nodes_removed'] == 2
+    assert stats['stack-adjust']['stack_ops_saved'] == 4
@@ -0,0 +1,64 @@
+# self tail calls compiled into loops, run from scripts that take turns
+import pytest
+
+import passes
+from scratchsim import run_project, write_project
+
+SUMTO = """
+func sumto(n: number, acc: number): number
+    if n <= 0
+        return acc
+    else
+        return sumto(n - 1, acc + n)
+    end
+end
+"""
+
+@pytest.mark.parametrize('opt_level', passes.OPT_LEVELS)
+def test_concurrent_callers_keep_their_own_frames(opt_level, tmp_path):
+    # the loop yields every iteration, so the two calls run interleaved
+    write_project(tmp_path / 'project', {'sprite.nano': SUMTO + """
+when flag
+    say_wait("A " & sumto(10, 0), 0)
+end
+
+when flag
+    say_wait("B " & sumto(3, 0), 0)
+end
+"""})
+    simulation = run_project(str(tmp_path / 'project'), str(tmp_path / 'out'), opt_level)
+    said = [text for _, text in simulation.log]
+    assert sorted(said) == ["A 55", "B 6"]
+
+@pytest.mark.parametrize('opt_level', passes.OPT_LEVELS)
+def test_concurrent_callers_get_their_own_results(opt_level, tmp_path):
+    # both loops end in the same frame, after yielding once more
+    write_project(tmp_path / 'project', {'sprite.nano': SUMTO + """
+when flag
+    say_wait("A " & sumto(3, 0), 0)
+end
+
+when flag
+    say_wait("B " & sumto(3, 100), 0)
+end
+"""})
+    simulation = run_project(str(tmp_path / 'project'), str(tmp_path / 'out'), opt_level)
+    said = [text for _, text in simulation.log]
+    assert sorted(said) == ["A 6", "B 106"]
+
+@pytest.mark.parametrize('opt_level', passes.OPT_LEVELS)
+def test_warp_functions_finish_before_other_scripts_run(opt_level, tmp_path):
+    # warp loops don't yield, so these can return in nano_ret
+    write_project(tmp_path / 'project', {'sprite.nano': "@warp" + SUMTO + """
+when flag
+    say_wait("A " & sumto(3, 0), 0)
+end
+
+when flag
+    say_wait("B " & sumto(3, 100), 0)
+end
+"""})
+    simulation = run_project(str(tmp_path / 'project'), str(tmp_path / 'out'), opt_level)
+    said = [text for _, text in simulation.log]
+    assert sorted(said) == ["A 6", "B 106"]
+    assert 'nano_ret = ' in (tmp_path / 'out' / 'sprite.gs').read_text()
@@ -0,0 +1,214 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import traceback
+
+import nanoproject
+from compileerror import CompilationException
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# how long to wait for more changes after the first one, so that an editor
+# saving several files (or writing one in several steps) triggers one rebuild
+DEBOUNCE_TIME = 0.05
+
+# watches a set of directories (not recursively) through inotify.
+# raises OSError if inotify isn't available
+class InotifyWatcher:
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name == None:
+            raise OSError("libc not found")
+
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify not available")
+
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.watches = {} # watch descriptor -> directory
+
+    def set_directories(self, directories):
+        for wd in list(self.watches):
+            if self.watches[wd] not in directories:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+        watched = set(self.watches.values())
+        for directory in directories:
+            if directory in watched:
+                continue
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+
+    # blocks until something changes, then returns the paths that changed
+    def wait(self):
+        changed = set()
+        timeout = None
+
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return changed
+
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(data):
+                wd, _, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+
+                if wd in self.watches and name:
+                    changed.add(os.path.join(self.watches[wd], os.fsdecode(name)))
+
+            # gather whatever else arrives shortly after
+            timeout = DEBOUNCE_TIME
+
+    def close(self):
+        os.close(self.fd)
+
+# watches a set of directories (not recursively) by comparing
+# file modification times every poll_interval seconds
+class PollingWatcher:
+    def __init__(self, poll_interval=0.25):
+        self.poll_interval = poll_interval
+        self.directories = []
+        self.snapshot = {}
+
+    def take_snapshot(self):
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def set_directories(self, directories):
+        self.directories = sorted(directories)
+        self.snapshot = self.take_snapshot()
+
+    def wait(self):
+        changed = set()
+
+        while True:
+            time.sleep(self.poll_interval)
+            snapshot = self.take_snapshot()
+
+            for path in snapshot.keys() | self.snapshot.keys():
+                if snapshot.get(path) != self.snapshot.get(path):
+                    changed.add(path)
+
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+def create_watcher():
+    try:
+        return InotifyWatcher()
+    except OSError:
+        return PollingWatcher()
+
+def format_timings(timings):
+    return ", ".join(f"{name} {(seconds * 1000):.1f}ms" for name, seconds in timings.items())
+
+# builds the project, printing how long it took and what happened.
+# errors are reported instead of raised, so that watching can go on
+def build(project_dir, output_dir, sb3, sb3_backend, jobs, use_cache, opt_level=0, assets_changed=True):
+    start = time.perf_counter()
+
+    try:
+        summary = nanoproject.compile(project_dir, output_dir, jobs=jobs, use_cache=use_cache, opt_level=opt_level)
+    except (CompilationException, nanoproject.ProjectCompilationException) as e:
+        print(f"error: {e}")
+        return None
+    except Exception:
+        traceback.print_exc()
+        return None
+
+    timings = dict(summary['timings'])
+
+    # the sb3 doesn't need to be rebuilt if no file has changed,
+    # unless the change was to an asset
+    if sb3 and (summary['files_written'] > 0 or assets_changed):
+        sb3_start = time.perf_counter()
+        try:
+            nanoproject.build_sb3(output_dir, sb3, sb3_backend, summary['programs'])
+            timings[sb3_backend] = time.perf_counter() - sb3_start
+        except nanoproject.ProjectCompilationException as e:
+            print(f"error: {e}")
+        except Exception:
+            traceback.print_exc()
+
+    total = time.perf_counter() - start
+    print(f"built in {(total * 1000):.1f}ms ({format_timings(timings)}): {summary['files']} files, {summary['cached']} cached, {summary['files_written']} rewritten")
+    return summary
+
+# rebuilds the project whenever a .nano file in the project directory
+# or one of the assets used by the project changes
+def watch(project_dir, output_dir, sb3=None, sb3_backend='goboscript', jobs=1, use_cache=True, opt_level=0):
+    project_dir = os.path.abspath(project_dir)
+    output_dir = os.path.abspath(output_dir)
+
+    watcher = create_watcher()
+    print(f"watching {project_dir} ({'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'})")
+
+    assets = set()
+    summary = build(project_dir, output_dir, sb3, sb3_backend, jobs, use_cache, opt_level)
+
+    try:
+        while True:
+            if summary:
+                assets = set(summary['assets'])
+
+            directories = {project_dir}
+            for path in assets:
+                directories.add(os.path.dirname(path))
+            watcher.set_directories(directories)
+
+            while True:
+                changed = watcher.wait()
+                sources = [path for path in changed if os.path.dirname(path) == project_dir and path.endswith('.nano')]
+                changed_assets = [path for path in changed if path in assets]
+
+                if sources or changed_assets:
+                    break
+
+            summary = build(project_dir, output_dir, sb3, sb3_backend, jobs, use_cache, opt_level, len(changed_assets) > 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()